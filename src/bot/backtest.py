@@ -1,22 +1,44 @@
 """Backtest the trading strategy."""
 
-from dataclasses import dataclass
+from dataclasses import asdict, dataclass, field
 from datetime import datetime
+import heapq
 import itertools
+import os
+from typing import Iterator
+import numpy as np
 import pandas as pd
 import v20  # type: ignore
+import yaml
 from alive_progress import alive_it  # type: ignore
 
 from bot.constants import (
     SOURCE_COLUMNS,
+    SWEEP_SIZE,
     TP,
     SL,
+    WMA_PERIODS,
 )
-from core.kernel import KernelConfig, kernel
+from core.calc import METRIC_FIELDS
+from core.chunked import kernel_chunked
+from core.frame import CandleFrame
+from core.montecarlo import MonteCarloConfig, monte_carlo, summarize
+from core.kernel import (
+    KernelConfig,
+    NodeCache,
+    Pipeline,
+    cache_wma_matrix,
+    candle_columns,
+    kernel,
+    metrics_node,
+)
+from core.store import CandleReader
 from bot.exchange import (
     getOandaOHLC,
     OandaContext,
+    periods_per_year,
 )
+from bot.optimizer import OptimizerConfig, log_result, optimize
 
 import logging
 
@@ -24,6 +46,8 @@ from bot.reporting import report
 
 logger = logging.getLogger("backtest")
 APP_START_TIME = datetime.now()
+# metrics where a lower value ranks a result higher
+LOWER_IS_BETTER = {"losses", "gross_loss", "max_consecutive_losses", "max_drawdown"}
 
 
 class PerfTimer:
@@ -57,15 +81,21 @@ class SignalConfig:
     signal_exit_column: str
     stop_loss: float
     take_profit: float
+    wma_period: int | None = None
 
     def __str__(self):
         """Return a string representation of the SignalConfig object."""
-        return f"so:{self.source_column}, sib:{self.signal_buy_column}, sie:{self.signal_exit_column}, sl:{self.stop_loss}, tp:{self.take_profit}"
+        wp = f", wp:{self.wma_period}" if self.wma_period is not None else ""
+        return f"so:{self.source_column}, sib:{self.signal_buy_column}, sie:{self.signal_exit_column}, sl:{self.stop_loss}, tp:{self.take_profit}{wp}"
 
 
 @dataclass
 class Record:
-    """Record class."""
+    """Record class.
+
+    metrics holds the METRIC_FIELDS of core.calc.trade_metrics_numpy when the
+    record comes from a sweep.
+    """
 
     signal: int
     trigger: int
@@ -73,10 +103,22 @@ class Record:
     wins: int
     exit_total: float
     min_exit_total: float
+    metrics: dict[str, float] = field(default_factory=dict)
 
     def __str__(self) -> str:
         """Return a string representation of the Record object."""
-        return f"w:{self.wins} l:{self.losses}, q:{round(self.exit_total, 5)}, q_min:{round(self.min_exit_total, 5)}"
+        text = f"w:{self.wins} l:{self.losses}, q:{round(self.exit_total, 5)}, q_min:{round(self.min_exit_total, 5)}"
+        if self.metrics:
+            text += f", dd:{round(self.metrics['max_drawdown'], 5)}, sr:{round(self.metrics['sharpe'], 3)}"
+        return text
+
+    def score(self, rank_by: str) -> float:
+        """Return the value of a metric, negated when lower is better."""
+        if rank_by in ("exit_total", "min_exit_total", "wins", "losses"):
+            value = float(getattr(self, rank_by))
+        else:
+            value = self.metrics[rank_by]
+        return -value if rank_by in LOWER_IS_BETTER else value
 
 
 @dataclass
@@ -87,9 +129,372 @@ class ChartConfig:
     granularity: str
     wma_period: int
     candle_count: int
+    store_path: str | None = None
+    sweep_path: str | None = None
+    record_path: str | None = None
+    rank_by: str = "exit_total"
+
+    def __post_init__(self):
+        """Check that the results can be ranked by rank_by."""
+        if self.rank_by not in METRIC_FIELDS:
+            raise ValueError(
+                f"rank_by must be one of {', '.join(METRIC_FIELDS)}, not {self.rank_by}"
+            )
+
+
+def get_record(df: pd.DataFrame | CandleFrame) -> Record:
+    """Summarize the last row of a kernel output into a Record."""
+    if isinstance(df, CandleFrame):
+        return Record(
+            signal=df["signal"][-1],
+            trigger=df["trigger"][-1],
+            losses=df["losses"][-1],
+            wins=df["wins"][-1],
+            exit_total=df["exit_total"][-1],
+            min_exit_total=df["min_exit_total"][-1],
+        )
+    return Record(
+        signal=df["signal"].iloc[-1],
+        trigger=df["trigger"].iloc[-1],
+        losses=df["losses"].iloc[-1],
+        wins=df["wins"].iloc[-1],
+        exit_total=df["exit_total"].iloc[-1],
+        min_exit_total=df["min_exit_total"].iloc[-1],
+    )
+
+
+def sweep_entry(signal_conf: SignalConfig, rec: Record) -> dict:
+    """Return a result of a sweep as plain types, for YAML and JSON."""
+    return {
+        "signal_config": asdict(signal_conf),
+        "wins": int(rec.wins),
+        "losses": int(rec.losses),
+        "exit_total": float(rec.exit_total),
+        "min_exit_total": float(rec.min_exit_total),
+        "metrics": {name: float(value) for name, value in rec.metrics.items()},
+    }
+
+
+def save_sweep(path: str, results: list[tuple[SignalConfig, Record]]) -> None:
+    """Write the ranked results of a sweep, best first, for shadow trading.
+
+    The file is replaced atomically, so a running bot never reads a partial
+    sweep.
+    """
+    entries = [sweep_entry(signal_conf, rec) for signal_conf, rec in results]
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        yaml.safe_dump({"created": datetime.now().isoformat(), "results": entries}, f)
+    os.replace(tmp_path, path)
+    logger.info("saved %s sweep results to %s", len(entries), path)
+
+
+def load_sweep(path: str, top_k: int) -> list[SignalConfig]:
+    """Read the best top_k signal configurations of a sweep file."""
+    with open(path) as f:
+        sweep = yaml.safe_load(f)
+    return [
+        SignalConfig(**entry["signal_config"]) for entry in sweep["results"][:top_k]
+    ]
+
+
+def run_record(
+    columns: dict[str, np.ndarray],
+    kernel_conf: KernelConfig,
+    cache: NodeCache,
+    periods_per_year: float,
+) -> Record:
+    """Run the kernel pipeline of a configuration and reduce it to a Record with metrics.
+
+    periods_per_year is the number of candles in a year, see
+    bot.exchange.periods_per_year.
+    """
+    node = metrics_node(kernel_conf, periods_per_year)
+    output = Pipeline({"record": node}).run(columns, cache)["record"]
+    metrics = dict(zip(METRIC_FIELDS, output["metrics"].tolist()))
+    return Record(
+        signal=int(output["signal"]),
+        trigger=int(output["trigger"]),
+        losses=int(metrics["losses"]),
+        wins=int(metrics["wins"]),
+        exit_total=metrics["exit_total"],
+        min_exit_total=metrics["min_exit_total"],
+        metrics=metrics,
+    )
+
+
+def results_table(results: list[tuple[SignalConfig, Record]]) -> pd.DataFrame:
+    """Return one row per result with its signal configuration and metrics."""
+    return pd.DataFrame(
+        [
+            {**asdict(signal_conf), **rec.metrics, "signal": rec.signal, "trigger": rec.trigger}
+            for signal_conf, rec in results
+        ]
+    )
+
+
+def grid_combinations(
+    wma_period: int,
+    source_columns: list[str] = SOURCE_COLUMNS,
+    take_profits: list[float] = TP,
+    stop_losses: list[float] = SL,
+) -> Iterator[tuple[SignalConfig, KernelConfig]]:
+    """Yield the combinations of the exhaustive grid, skipping stop loss > take profit."""
+    for (
+        source_column_name,
+        signal_buy_column_name,
+        signal_exit_column_name,
+        take_profit_multiplier,
+        stop_loss_multiplier,
+    ) in itertools.product(
+        source_columns, source_columns, source_columns, take_profits, stop_losses
+    ):
+        if stop_loss_multiplier > take_profit_multiplier:
+            continue
+
+        kernel_conf = KernelConfig(
+            signal_buy_column=signal_buy_column_name,
+            signal_exit_column=signal_exit_column_name,
+            source_column=source_column_name,
+            wma_period=wma_period,
+            take_profit=take_profit_multiplier,
+            stop_loss=stop_loss_multiplier,
+        )
+        signal_conf = SignalConfig(
+            source_column_name,
+            signal_buy_column_name,
+            signal_exit_column_name,
+            stop_loss_multiplier,
+            take_profit_multiplier,
+        )
+        yield signal_conf, kernel_conf
+
+
+def grid_size(
+    source_columns: list[str] = SOURCE_COLUMNS,
+    take_profits: list[float] = TP,
+    stop_losses: list[float] = SL,
+) -> int:
+    """Return the number of combinations grid_combinations yields."""
+    tp_sl = sum(1 for tp, sl in itertools.product(take_profits, stop_losses) if sl <= tp)
+    return len(source_columns) ** 3 * tp_sl
+
+
+def keep_in_sweep(
+    sweep: list[tuple[float, int, SignalConfig, Record]],
+    seq: int,
+    signal_conf: SignalConfig,
+    rec: Record,
+    rank_by: str = "exit_total",
+) -> None:
+    """Keep a result in the heap of the best SWEEP_SIZE results by a metric.
+
+    seq must increase with every result, ties are ranked by it.  Results
+    without a value for the metric are dropped.
+    """
+    score = rec.score(rank_by)
+    if np.isnan(score):
+        return
+    entry = (score, -seq, signal_conf, rec)
+    if len(sweep) < SWEEP_SIZE:
+        heapq.heappush(sweep, entry)
+    elif entry[0] > sweep[0][0]:
+        heapq.heapreplace(sweep, entry)
+
+
+def ranked_sweep(
+    sweep: list[tuple[float, int, SignalConfig, Record]],
+) -> list[tuple[SignalConfig, Record]]:
+    """Return the results kept by keep_in_sweep, best first."""
+    return [(conf, rec) for _, _, conf, rec in sorted(sweep, reverse=True)]
+
+
+def robustness(
+    columns: dict[str, np.ndarray],
+    results: list[tuple[SignalConfig, Record]],
+    wma_period: int,
+    config: MonteCarloConfig,
+) -> list[tuple[SignalConfig, dict[str, float]]]:
+    """Score the top_k results on Monte Carlo paths and log their outcome distributions.
+
+    Returns
+    -------
+    list[tuple[SignalConfig, dict[str, float]]]
+        The configurations with the summary of core.montecarlo.summarize, ranked
+        by the 5th percentile of the exit total.
+
+    """
+    top = results[: config.top_k]
+    kernel_confs = [
+        KernelConfig(
+            signal_buy_column=signal_conf.signal_buy_column,
+            signal_exit_column=signal_conf.signal_exit_column,
+            source_column=signal_conf.source_column,
+            wma_period=signal_conf.wma_period or wma_period,
+            stop_loss=signal_conf.stop_loss,
+            take_profit=signal_conf.take_profit,
+        )
+        for signal_conf, _ in top
+    ]
+    start = datetime.now()
+    summaries = summarize(monte_carlo(columns, kernel_confs, config))
+    logger.info(
+        "monte carlo: %s paths x %s configurations in %s",
+        config.paths,
+        len(top),
+        datetime.now() - start,
+    )
+
+    order = sorted(range(len(top)), key=lambda i: summaries[i]["p5"], reverse=True)
+    for rank, i in enumerate(order, start=1):
+        signal_conf, rec = top[i]
+        summary = summaries[i]
+        logger.info(
+            "robust #%s p5:%s p50:%s p95:%s mean:%s std:%s profitable:%s "
+            "min_p5:%s historical:%s %s",
+            rank,
+            round(summary["p5"], 5),
+            round(summary["p50"], 5),
+            round(summary["p95"], 5),
+            round(summary["mean"], 5),
+            round(summary["std"], 5),
+            round(summary["profitable"], 3),
+            round(summary["min_exit_total_p5"], 5),
+            round(float(rec.exit_total), 5),
+            signal_conf,
+        )
+    return [(top[i][0], summaries[i]) for i in order]
+
+
+def get_chunked_record(
+    store_path: str, kernel_conf: KernelConfig, chunk_size: int = 1_000_000
+) -> Record:
+    """Run the kernel over a candle store chunk by chunk and summarize it into a Record.
+
+    The last candle of the store is treated as incomplete, like kernel with
+    include_incomplete=False.
+    """
+    block = CandleReader(store_path).block()
+    chunks = (
+        block[:, start : start + chunk_size]
+        for start in range(0, block.shape[1], chunk_size)
+    )
+    return Record(**kernel_chunked(chunks, False, kernel_conf).summary())
+
+
+def optimize_backtest(
+    orig_df: pd.DataFrame,
+    optimizer_config: OptimizerConfig,
+    sweep_path: str | None = None,
+    montecarlo_config: MonteCarloConfig | None = None,
+    rank_by: str = "exit_total",
+    granularity: str = "M5",
+) -> SignalConfig | None:
+    """Search the signal configurations and wma periods under an evaluation budget.
+
+    Parameters
+    ----------
+    orig_df : pd.DataFrame
+        The OHLC data to backtest against.
+    optimizer_config : OptimizerConfig
+        The optimizer configuration.
+    sweep_path : str | None, optional
+        Where to save the top_k configurations for shadow trading.
+    montecarlo_config : MonteCarloConfig | None, optional
+        When set, score the top_k configurations on Monte Carlo paths.
+    rank_by : str, optional
+        The metric of core.calc.METRIC_FIELDS the optimizer maximizes, or
+        minimizes for the metrics of LOWER_IS_BETTER.
+    granularity : str, optional
+        The Oanda granularity of the candles, which annualizes the metrics.
+
+    Returns
+    -------
+    SignalConfig | None
+        The best configuration found, with its wma_period set, or None if no
+        winning combination was found.
+
+    Notes
+    -----
+    Combinations where the losses exceed the wins by more than one are scored as
+    -inf, matching the filter used by the grid search.
+
+    """
+    space = {
+        "source_column": SOURCE_COLUMNS,
+        "signal_buy_column": SOURCE_COLUMNS,
+        "signal_exit_column": SOURCE_COLUMNS,
+        "take_profit": TP,
+        "stop_loss": SL,
+        "wma_period": WMA_PERIODS,
+    }
+    logger.info(
+        "optimizer: %s budget: %s search space: %s",
+        optimizer_config.method,
+        optimizer_config.budget,
+        # only the combinations with stop loss <= take profit are evaluated
+        grid_size() * len(WMA_PERIODS),
+    )
 
+    # the Heikin Ashi, wma and signal nodes are shared between the trials
+    columns = candle_columns(orig_df, include_incomplete=False)
+    cache = NodeCache()
+    candles_per_year = periods_per_year(granularity)
+    # source columns whose wma nodes were computed for every period at once
+    wma_sources: set[str] = set()
+
+    def evaluate(params: dict) -> tuple[float, tuple[SignalConfig, Record]] | None:
+        if params["stop_loss"] > params["take_profit"]:
+            return None
+
+        if params["source_column"] not in wma_sources:
+            wma_sources.add(params["source_column"])
+            cache_wma_matrix(cache, columns, params["source_column"], WMA_PERIODS)
+
+        rec = run_record(columns, KernelConfig(**params), cache, candles_per_year)
+        signal_conf = SignalConfig(
+            params["source_column"],
+            params["signal_buy_column"],
+            params["signal_exit_column"],
+            params["stop_loss"],
+            params["take_profit"],
+            params["wma_period"],
+        )
+        score = rec.score(rank_by)
+        if rec.losses - 1 > rec.wins or np.isnan(score):
+            return float("-inf"), (signal_conf, rec)
+
+        return score, (signal_conf, rec)
+
+    result = optimize(space, evaluate, optimizer_config)
+    log_result(result, logger)
+    logger.info(
+        "node cache hits: %s misses: %s unique signals: %s of %s",
+        cache.hits,
+        cache.misses,
+        *cache.signal_counts(),
+    )
 
-def backtest(chart_config: ChartConfig, token: str) -> SignalConfig | None:
+    if len(result.best) == 0 or result.best[0].score == float("-inf"):
+        logger.error("no winning combinations found")
+        return None
+
+    signal_conf, rec = result.best[0].result
+    logger.info("best found %s %s", signal_conf, rec)
+    winners = [t.result for t in result.best if t.score != float("-inf")]
+    if sweep_path is not None:
+        save_sweep(sweep_path, winners)
+    if montecarlo_config is not None:
+        robustness(columns, winners, WMA_PERIODS[0], montecarlo_config)
+    return signal_conf
+
+
+def backtest(
+    chart_config: ChartConfig,
+    token: str,
+    optimizer_config: OptimizerConfig | None = None,
+    montecarlo_config: MonteCarloConfig | None = None,
+) -> SignalConfig | None:
     """Run a backtest of the trading strategy.
 
     Parameters
@@ -98,6 +503,12 @@ def backtest(chart_config: ChartConfig, token: str) -> SignalConfig | None:
         The chart configuration.
     token : str
         The Oanda API token.
+    optimizer_config : OptimizerConfig | None, optional
+        When set, sample the combinations and wma periods with the optimizer
+        instead of running the exhaustive grid.
+    montecarlo_config : MonteCarloConfig | None, optional
+        When set, score the top_k winners on Monte Carlo paths and log the
+        distribution of their outcomes.
 
     Notes
     -----
@@ -115,9 +526,15 @@ def backtest(chart_config: ChartConfig, token: str) -> SignalConfig | None:
         chart_config.instrument,
     )
 
-    orig_df = getOandaOHLC(
-        ctx, count=chart_config.candle_count, granularity=chart_config.granularity
-    )
+    if chart_config.store_path is not None:
+        # read the candles the bot has been appending instead of asking Oanda
+        orig_df = CandleReader(chart_config.store_path).to_frame(
+            start=-chart_config.candle_count
+        )
+    else:
+        orig_df = getOandaOHLC(
+            ctx, count=chart_config.candle_count, granularity=chart_config.granularity
+        )
     logger.info(
         "count: %s granularity: %s wma_period: %s",
         chart_config.candle_count,
@@ -125,72 +542,46 @@ def backtest(chart_config: ChartConfig, token: str) -> SignalConfig | None:
         chart_config.wma_period,
     )
 
+    if optimizer_config is not None:
+        with PerfTimer(start_time, logger):
+            return optimize_backtest(
+                orig_df,
+                optimizer_config,
+                chart_config.sweep_path,
+                montecarlo_config,
+                chart_config.rank_by,
+                chart_config.granularity,
+            )
+
     best_max_conf = SignalConfig("", "", "", 0.0, 0.0)
     not_worst_conf = SignalConfig("", "", "", 0.0, 0.0)
-    best_df = pd.DataFrame()
-    not_worst_df = pd.DataFrame()
+    best_kernel_conf = None
+    not_worst_kernel_conf = None
     best_rec = Record(0, 0, 0, 0, -99.0, -99.0)
     not_worst_rec = Record(0, 0, 0, 0, -99.0, -99.0)
 
-    column_pairs = itertools.product(
-        SOURCE_COLUMNS, SOURCE_COLUMNS, SOURCE_COLUMNS, TP, SL
-    )
-    column_pair_len = (
-        len(SOURCE_COLUMNS)
-        * len(SOURCE_COLUMNS)
-        * len(SOURCE_COLUMNS)
-        * len(TP)
-        * len(SL)
-    )
+    column_pair_len = grid_size()
     logger.info(f"total_combinations: {column_pair_len}")
     total_found = 0
+    # only the summary is needed per combination, the shared nodes are cached
+    columns = candle_columns(orig_df, include_incomplete=False)
+    cache = NodeCache()
+    candles_per_year = periods_per_year(chart_config.granularity)
+    # the best SWEEP_SIZE combinations by rank_by, for shadow trading
+    sweep: list[tuple[float, int, SignalConfig, Record]] = []
     with PerfTimer(start_time, logger):
-        for (
-            source_column_name,
-            signal_buy_column_name,
-            signal_exit_column_name,
-            take_profit_multiplier,
-            stop_loss_multiplier,
-        ) in alive_it(column_pairs, total=column_pair_len):
-            if stop_loss_multiplier > take_profit_multiplier:
-                continue
-
-            kernel_conf = KernelConfig(
-                signal_buy_column=signal_buy_column_name,
-                signal_exit_column=signal_exit_column_name,
-                source_column=source_column_name,
-                wma_period=chart_config.wma_period,
-                take_profit=take_profit_multiplier,
-                stop_loss=stop_loss_multiplier,
-            )
-            df = kernel(
-                orig_df.copy(),
-                include_incomplete=False,
-                config=kernel_conf,
-            )
-
-            signal_conf = SignalConfig(
-                source_column_name,
-                signal_buy_column_name,
-                signal_exit_column_name,
-                stop_loss_multiplier,
-                take_profit_multiplier,
-            )
-
-            rec = Record(
-                signal=df["signal"].iloc[-1],
-                trigger=df["trigger"].iloc[-1],
-                losses=df["losses"].iloc[-1],
-                wins=df["wins"].iloc[-1],
-                exit_total=df["exit_total"].iloc[-1],
-                min_exit_total=df["min_exit_total"].iloc[-1],
-            )
+        for signal_conf, kernel_conf in alive_it(
+            grid_combinations(chart_config.wma_period), total=column_pair_len
+        ):
+            rec = run_record(columns, kernel_conf, cache, candles_per_year)
 
             if rec.losses - 1 > rec.wins:
                 continue
             else:
                 total_found += 1
 
+            keep_in_sweep(sweep, total_found, signal_conf, rec, chart_config.rank_by)
+
             if rec.min_exit_total > not_worst_rec.min_exit_total:
                 logger.debug(
                     "new min found %s %s",
@@ -199,7 +590,7 @@ def backtest(chart_config: ChartConfig, token: str) -> SignalConfig | None:
                 )
                 not_worst_rec = rec
                 not_worst_conf = signal_conf
-                not_worst_df = df.copy()
+                not_worst_kernel_conf = kernel_conf
 
             if rec.exit_total > best_rec.exit_total:
                 logger.debug(
@@ -209,19 +600,52 @@ def backtest(chart_config: ChartConfig, token: str) -> SignalConfig | None:
                 )
                 best_rec = rec
                 best_max_conf = signal_conf
-                best_df = df.copy()
+                best_kernel_conf = kernel_conf
 
     logger.info("total_found: %s", total_found)
+    if total_found > 0:
+        logger.info(
+            "best by %s:\n%s",
+            chart_config.rank_by,
+            results_table(ranked_sweep(sweep)).head(10).round(5).to_string(index=False),
+        )
+    if chart_config.sweep_path is not None and total_found > 0:
+        save_sweep(chart_config.sweep_path, ranked_sweep(sweep))
+    logger.info(
+        "node cache hits: %s misses: %s unique signals: %s of %s",
+        cache.hits,
+        cache.misses,
+        *cache.signal_counts(),
+    )
     if total_found == 0:
         logger.error("no winning combinations found")
         return None
+    if montecarlo_config is not None:
+        robustness(columns, ranked_sweep(sweep), chart_config.wma_period, montecarlo_config)
+
+    # rebuild the full frames of the two picks for the report
+    best_df = (
+        kernel(orig_df.copy(), include_incomplete=False, config=best_kernel_conf)
+        if best_kernel_conf is not None
+        else pd.DataFrame()
+    )
+    not_worst_df = (
+        kernel(orig_df.copy(), include_incomplete=False, config=not_worst_kernel_conf)
+        if not_worst_kernel_conf is not None
+        else pd.DataFrame()
+    )
 
     logger.debug(
         "best max found %s %s",
         best_max_conf,
         best_rec,
     )
-    report(best_df, best_max_conf.signal_buy_column, best_max_conf.signal_exit_column)
+    report(
+        best_df,
+        best_max_conf.signal_buy_column,
+        best_max_conf.signal_exit_column,
+        granularity=chart_config.granularity,
+    )
 
     logger.debug(
         "not worst found %s %s",
@@ -232,6 +656,7 @@ def backtest(chart_config: ChartConfig, token: str) -> SignalConfig | None:
         not_worst_df,
         not_worst_conf.signal_buy_column,
         not_worst_conf.signal_exit_column,
+        granularity=chart_config.granularity,
     )
 
     # choose the least worst combination to minimize loss
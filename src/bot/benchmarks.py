@@ -0,0 +1,326 @@
+"""Benchmarks that run against local stand-ins instead of the network."""
+
+import logging
+import os
+import sqlite3
+import tempfile
+from time import perf_counter, time_ns
+
+import numba  # type: ignore
+import numpy as np
+import pandas as pd
+import v20  # type: ignore
+
+from bot.backtest import grid_combinations
+from bot.exchange import (
+    OandaClient,
+    OandaContext,
+    OrderTemplate,
+    TradeLatency,
+    periods_per_year,
+    place_order,
+)
+from bot.mock_oanda import MockOandaServer
+from bot.synthetic import SyntheticConfig, iter_candles, oanda_frame, swap_frame
+from core.chart import ohlc
+from core.frame import CandleFrame
+from core.ingest import IngestConfig, ingest_swaps, swap_candles
+from core.kernel import (
+    KernelConfig,
+    NodeCache,
+    Pipeline,
+    candle_columns,
+    kernel,
+    metrics_node,
+)
+from core.montecarlo import MonteCarloConfig, monte_carlo
+from core.sqlkernel import exit_total_query, insert_history, kernel_metrics, register
+from core.store import CANDLE_COLUMNS
+
+logger = logging.getLogger("benchmarks")
+
+
+def percentiles(samples: list[float]) -> dict[str, float]:
+    """Summarize timings in seconds as milliseconds."""
+    ms = np.asarray(samples) * 1000
+    return {
+        "count": len(samples),
+        "mean": round(float(ms.mean()), 3),
+        "p50": round(float(np.percentile(ms, 50)), 3),
+        "p95": round(float(np.percentile(ms, 95)), 3),
+        "p99": round(float(np.percentile(ms, 99)), 3),
+    }
+
+
+def bench_order_path(iterations: int = 200, instrument: str = "USD_JPY") -> dict:
+    """Compare the v20 order path with the templated order path on a mock server.
+
+    Parameters
+    ----------
+    iterations : int, optional
+        The number of orders placed on each path.
+    instrument : str, optional
+        The instrument to trade.
+
+    Returns
+    -------
+    dict
+        Timing percentiles of both paths and the sent-to-fill latency recorded by
+        the templated path.
+
+    """
+    server = MockOandaServer().start()
+    try:
+        ctx = OandaContext(
+            v20.Context("127.0.0.1", server.port, ssl=False, token="mock"),
+            "mock",
+            "mock",
+            instrument,
+        )
+        client = OandaClient(
+            "mock", "mock", instrument, hostname="127.0.0.1", port=server.port, ssl=False
+        )
+        template = OrderTemplate(instrument, 1000)
+
+        # silence the per-order logging of both paths while timing
+        exchange_logger = logging.getLogger("exchange")
+        level = exchange_logger.level
+        exchange_logger.setLevel(logging.WARNING)
+
+        legacy = []
+        templated = []
+        for _ in range(iterations):
+            start = perf_counter()
+            place_order(ctx, 1000)
+            legacy.append(perf_counter() - start)
+
+            latency = TradeLatency(candle_close=time_ns(), kernel_done=time_ns())
+            start = perf_counter()
+            client.place_market_order(template, latency)
+            templated.append(perf_counter() - start)
+
+        exchange_logger.setLevel(level)
+        client.close()
+        fills = [
+            (lat.fill_received - lat.request_sent) / 1e9
+            for lat in client.trade_latencies
+        ]
+        result = {
+            "v20": percentiles(legacy),
+            "template": percentiles(templated),
+            "sent_to_fill": percentiles(fills),
+        }
+    finally:
+        server.stop()
+
+    for name, stats in result.items():
+        logger.info("%s: %s", name, stats)
+    return result
+
+
+def bench_kernel(
+    sizes: tuple[int, ...] = (100, 500, 1000, 5000), iterations: int = 200
+) -> dict:
+    """Compare the per-call kernel time on DataFrames and on CandleFrames.
+
+    Parameters
+    ----------
+    sizes : tuple[int, ...], optional
+        The candle counts to time.
+    iterations : int, optional
+        The number of kernel calls per size and frame type.
+
+    Returns
+    -------
+    dict
+        Timing percentiles by size of the DataFrame kernel, the CandleFrame
+        kernel and the conversion of the candles to a CandleFrame.
+
+    """
+    config = KernelConfig(
+        signal_buy_column="ha_bid_low",
+        signal_exit_column="ha_ask_high",
+        source_column="ha_close",
+        take_profit=0.1,
+        stop_loss=-0.05,
+    )
+    result = {}
+    for size in sizes:
+        df = oanda_frame(SyntheticConfig(rows=size, seed=size))
+        frame = CandleFrame.from_pandas(df)
+        # compile and warm up both paths
+        kernel(df, False, config)
+        kernel(frame, False, config)
+
+        pandas_times = []
+        frame_times = []
+        convert_times = []
+        for _ in range(iterations):
+            start = perf_counter()
+            kernel(df, False, config)
+            pandas_times.append(perf_counter() - start)
+
+            start = perf_counter()
+            converted = CandleFrame.from_pandas(df)
+            convert_times.append(perf_counter() - start)
+
+            start = perf_counter()
+            kernel(converted, False, config)
+            frame_times.append(perf_counter() - start)
+
+        result[size] = {
+            "pandas": percentiles(pandas_times),
+            "candle_frame": percentiles(frame_times),
+            "from_pandas": percentiles(convert_times),
+        }
+        logger.info("%s candles: %s", size, result[size])
+    return result
+
+
+def bench_montecarlo(paths: int = 10_000, configs: int = 50, rows: int = 5000) -> dict:
+    """Time the Monte Carlo scoring of grid configurations on synthetic candles.
+
+    Parameters
+    ----------
+    paths : int, optional
+        The number of bootstrapped paths.
+    configs : int, optional
+        The number of configurations, spread over the grid.
+    rows : int, optional
+        The number of candles per path.
+
+    Returns
+    -------
+    dict
+        The wall time in seconds, the simulated candles per second and the
+        number of threads used.
+
+    """
+    times, block = next(iter_candles(SyntheticConfig(rows=rows, seed=rows)))
+    candles = {name: block[i] for i, name in enumerate(CANDLE_COLUMNS)}
+    grid = [kernel_conf for _, kernel_conf in grid_combinations(20)]
+    kernel_confs = grid[:: max(1, len(grid) // configs)][:configs]
+    # compile outside of the timing
+    monte_carlo(candles, kernel_confs, MonteCarloConfig(paths=1))
+
+    start = perf_counter()
+    monte_carlo(candles, kernel_confs, MonteCarloConfig(paths=paths))
+    elapsed = perf_counter() - start
+    result = {
+        "seconds": round(elapsed, 3),
+        "candles_per_second": round(paths * len(kernel_confs) * rows / elapsed),
+        "threads": numba.get_num_threads(),
+    }
+    logger.info("%s paths x %s configs x %s candles: %s", paths, configs, rows, result)
+    return result
+
+
+def bench_ingest(rows: int = 100_000, files: int = 8, swaps_per_candle: float = 20.0) -> dict:
+    """Compare pandas ohlc with the parallel ingestion of swap files.
+
+    Parameters
+    ----------
+    rows : int, optional
+        The number of 5 minute candles the swaps span.
+    files : int, optional
+        The number of Parquet files the swaps are split into.
+    swaps_per_candle : float, optional
+        The mean number of swaps per candle.
+
+    Returns
+    -------
+    dict
+        The swaps per second of reading the files into pandas and running ohlc,
+        and of ingesting them into a new candle store.
+
+    """
+    df = swap_frame(SyntheticConfig(rows=rows, seed=rows), swaps_per_candle=swaps_per_candle)
+    cuts = np.linspace(0, len(df), files + 1).astype(int)
+    with tempfile.TemporaryDirectory() as source:
+        paths = [os.path.join(source, f"swaps_{i:04}.parquet") for i in range(files)]
+        for path, start, end in zip(paths, cuts[:-1], cuts[1:]):
+            df.iloc[start:end].to_parquet(path)
+        # compile outside of the timing
+        swap_candles(IngestConfig(source))
+
+        start = perf_counter()
+        ohlc(pd.concat(pd.read_parquet(path) for path in paths), serialization="none")
+        pandas_seconds = perf_counter() - start
+        ingested = ingest_swaps(IngestConfig(source), os.path.join(source, "candles.store"))
+
+    result = {
+        "swaps": len(df),
+        "pandas_rows_per_second": round(len(df) / pandas_seconds),
+        "ingest_rows_per_second": round(ingested.rows_per_second),
+        "threads": os.cpu_count(),
+    }
+    logger.info("%s swaps in %s files: %s", len(df), files, result)
+    return result
+
+
+def bench_sql(rows: int = 100_000, iterations: int = 5) -> dict:
+    """Compare exporting candles from SQLite into the kernel with running it in place.
+
+    Parameters
+    ----------
+    rows : int, optional
+        The number of candles in the ohlchistory table.
+    iterations : int, optional
+        The number of timed runs of each path, the fastest is reported.
+
+    Returns
+    -------
+    dict
+        The candles per second of reading the pair into pandas and running the
+        pipeline, of the kernel_metrics aggregate and of the staged window
+        functions.
+
+    """
+    config = KernelConfig("ha_bid_low", "ha_ask_high", "ha_close", 20, 0.1, -0.05)
+    candles_per_year = periods_per_year("M5")
+    times, block = next(iter_candles(SyntheticConfig(rows=rows, seed=rows)))
+    with tempfile.TemporaryDirectory() as directory:
+        conn = register(sqlite3.connect(os.path.join(directory, "history.db")))
+        insert_history(conn, "USD", "JPY", times, block)
+        query = exit_total_query(config)
+
+        def export() -> None:
+            df = pd.read_sql_query(
+                f"select timestamp, {', '.join(CANDLE_COLUMNS)} from ohlchistory "
+                "where token0 = ? and token1 = ? order by timestamp",
+                conn,
+                params=("USD", "JPY"),
+            )
+            columns = candle_columns(df, include_incomplete=True)
+            node = metrics_node(config, candles_per_year)
+            Pipeline({"record": node}).run(columns, NodeCache())
+
+        paths = {
+            "export": export,
+            "aggregate": lambda: kernel_metrics(
+                conn, "USD", "JPY", config, candles_per_year
+            ),
+            "window": lambda: conn.execute(query, ("USD", "JPY")).fetchall(),
+        }
+        # compile outside of the timing
+        export()
+        result: dict = {}
+        for name, path in paths.items():
+            samples = []
+            for _ in range(iterations):
+                start = perf_counter()
+                path()
+                samples.append(perf_counter() - start)
+            result[f"{name}_rows_per_second"] = round(rows / min(samples))
+        conn.close()
+    logger.info("%s candles: %s", rows, result)
+    return result
+
+
+BENCHMARKS = {
+    "orders": bench_order_path,
+    "kernel": bench_kernel,
+    "montecarlo": bench_montecarlo,
+    "ingest": bench_ingest,
+    "sql": bench_sql,
+}
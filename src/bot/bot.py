@@ -1,21 +1,30 @@
 """Bot that trades on Oanda."""
 
-from dataclasses import dataclass
-from datetime import datetime, timedelta
+from dataclasses import dataclass, replace
+from datetime import datetime
 import logging
-from time import sleep
-import v20  # type: ignore
+from time import time_ns
 
-from bot.backtest import ChartConfig, PerfTimer, Record, SignalConfig
+from bot.backtest import ChartConfig, PerfTimer, SignalConfig, get_record
+from bot.clock import WALL_CLOCK, Clock
+from core.frame import CandleBuffer
 from core.kernel import KernelConfig, kernel
+from core.store import CandleWriter
 from bot.reporting import report
 from bot.exchange import (
-    close_order,
-    get_open_trade,
-    getOandaOHLC,
-    place_order,
-    OandaContext,
+    NS_PER_SECOND,
+    granularity_ns,
+    next_candle_close,
+    to_rfc3339,
+    OandaClient,
+    OrderTemplate,
+    Recorder,
+    TradeLatency,
 )
+from bot.positions import PositionCache, TransactionStream
+from bot.dashboard import Dashboard, DashboardConfig
+from bot.reoptimize import ReoptimizeConfig, Reoptimizer
+from bot.shadow import ShadowConfig, ShadowTrader
 
 logger = logging.getLogger("bot")
 APP_START_TIME = datetime.now()
@@ -32,23 +41,39 @@ class TradeConfig:
 
 
 def bot_run(
-    ctx: OandaContext, signal_conf: SignalConfig, chart_conf: ChartConfig, amount: float, last_time: datetime
-) -> tuple[int, datetime, Exception | None]:
-    """Run the bot."""
+    client: OandaClient, positions: PositionCache, template: OrderTemplate, signal_conf: SignalConfig, chart_conf: ChartConfig, last_time: int,
+    store: CandleWriter | None = None, dashboard: Dashboard | None = None,
+    candles: CandleBuffer | None = None, shadow: ShadowTrader | None = None,
+    clock: Clock = WALL_CLOCK,
+) -> tuple[int, int, Exception | None]:
+    """Run the bot.
+
+    last_time is the epoch nanosecond timestamp of the newest candle of the
+    previous run, the newest timestamp of this run is returned.
+    """
+    if candles is None:
+        candles = CandleBuffer(chart_conf.candle_count)
     try:
-        trade_id = get_open_trade(ctx)
-        df = getOandaOHLC(
-            ctx, count=chart_conf.candle_count, granularity=chart_conf.granularity
+        # open trades come from the local cache, only reconciled periodically,
+        # and the reconcile runs while the candles are fetched
+        client.gather(
+            positions.maybe_reconcile,
+            lambda: fetch_candles(client, candles, chart_conf),
         )
+        trade_id = positions.first_trade_id(chart_conf.instrument)
     except Exception as err:
+        candles.clear()
         return -1, last_time, err
-    
-    recent_last_time = df.index[-1]
-    is_after_hours = (datetime.isoweekday == FRIDAY and datetime.now().hour >= FIVE_PM) or (
-        datetime.isoweekday == SUNDAY and datetime.now().hour < FIVE_PM)
+
+    if store is not None:
+        # share the completed candles with research processes
+        store.append_new(candles.timestamps()[:-1], candles.prices()[:, :-1])
+    recent_last_time = int(candles.timestamps()[-1])
+    is_after_hours = (datetime.isoweekday == FRIDAY and clock.now().hour >= FIVE_PM) or (
+        datetime.isoweekday == SUNDAY and clock.now().hour < FIVE_PM)
     if last_time == recent_last_time and not is_after_hours:
         logger.warning("bot_run: last_time == recent_last_time")
-        sleep(1)
+        clock.sleep(1)
         return trade_id, recent_last_time, None
     elif last_time == recent_last_time and is_after_hours:
         logger.info("bot_run: last_time == recent_last_time and is_after_hours")
@@ -58,48 +83,105 @@ def bot_run(
         signal_buy_column=signal_conf.signal_buy_column,
         signal_exit_column=signal_conf.signal_exit_column,
         source_column=signal_conf.source_column,
-        wma_period=chart_conf.wma_period,
+        wma_period=signal_conf.wma_period or chart_conf.wma_period,
         stop_loss=signal_conf.stop_loss,
         take_profit=signal_conf.take_profit,
     )
-    df = kernel(
-        df,
+    # the hot path runs on arrays, pandas is only needed for the report
+    frame = kernel(
+        candles.frame(),
         include_incomplete=False,
         config=kernel_conf,
     )
-    rec = Record(
-        signal=df["signal"].iloc[-1],
-        trigger=df["trigger"].iloc[-1],
-        losses=df["losses"].iloc[-1],
-        wins=df["wins"].iloc[-1],
-        exit_total=df["exit_total"].iloc[-1],
-        min_exit_total=df["min_exit_total"].iloc[-1],
+    rec = get_record(frame)
+    latency = TradeLatency(
+        candle_close=int(frame.index[-1]) + granularity_ns(chart_conf.granularity),
+        kernel_done=time_ns(),
     )
 
     if rec.trigger == 1 and trade_id == -1:
         try:
-            trade_id = place_order(
-                ctx,
-                amount,
-            )
+            trade_id = client.place_market_order(template, latency)
 
         except Exception as err:
             return -1, recent_last_time, err
 
     if rec.trigger == -1 and trade_id != -1:
         try:
-            close_order(ctx, trade_id)
+            close_trades(client, positions, chart_conf.instrument, latency)
         except Exception as err:
             return trade_id, recent_last_time, err
 
+    df = frame.to_pandas()
     if rec.trigger == 0 and rec.signal == 0 and trade_id != -1:
-        close_order(ctx, trade_id)
-        report(df, signal_conf.signal_buy_column, signal_conf.signal_exit_column)
+        close_trades(client, positions, chart_conf.instrument, latency)
+        report(
+            df,
+            signal_conf.signal_buy_column,
+            signal_conf.signal_exit_column,
+            frame.ledger,
+            chart_conf.granularity,
+        )
+
+    if dashboard is not None:
+        # only copies the charted columns, the diff is computed off the trading path
+        dashboard.publish(frame)
+
+    if shadow is not None:
+        # paper trade after the real orders so they are never delayed
+        try:
+            shadow.run(candles.frame())
+        except Exception as err:
+            logger.error("shadow: %s", err)
 
     # print the results
-    report(df, signal_conf.signal_buy_column, signal_conf.signal_exit_column)
+    report(
+        df,
+        signal_conf.signal_buy_column,
+        signal_conf.signal_exit_column,
+        frame.ledger,
+        chart_conf.granularity,
+    )
+
+    return positions.first_trade_id(chart_conf.instrument), recent_last_time, None
+
+
+def fetch_candles(
+    client: OandaClient, candles: CandleBuffer, chart_conf: ChartConfig
+) -> None:
+    """Refresh the candle window with the candles since the last complete one.
+
+    Only the last complete candle and anything newer is requested.  The whole
+    window is fetched again when the buffer is empty, the delta does not
+    connect to it or the delta is as long as the window.
+    """
+    since = candles.last_complete()
+    if since is not None:
+        times, block = client.get_candle_arrays(
+            chart_conf.granularity, count=chart_conf.candle_count, since=since
+        )
+        if len(times) < chart_conf.candle_count and candles.merge(times, block):
+            return
+        logger.warning("candles do not connect to the window, resyncing")
+
+    candles.clear()
+    times, block = client.get_candle_arrays(
+        chart_conf.granularity, count=chart_conf.candle_count
+    )
+    candles.merge(times, block)
+
 
-    return trade_id, recent_last_time, None
+def close_trades(
+    client: OandaClient,
+    positions: PositionCache,
+    instrument: str,
+    latency: TradeLatency | None = None,
+) -> None:
+    """Close every open trade of the instrument, stamping each close with a copy of latency."""
+    for trade in positions.open_trades(instrument):
+        client.close_trade(
+            trade.trade_id, replace(latency) if latency is not None else None
+        )
 
 
 def bot(
@@ -108,6 +190,9 @@ def bot(
     chart_conf: ChartConfig,
     signal_conf: SignalConfig,
     trade_conf: TradeConfig,
+    dashboard_conf: DashboardConfig | None = None,
+    shadow_conf: ShadowConfig | None = None,
+    reoptimize_conf: ReoptimizeConfig | None = None,
 ) -> None:
     """Bot that trades on Oanda.
 
@@ -126,46 +211,130 @@ def bot(
         The signal configuration.
     trade_conf : TradeConfig
         The trade configuration.
+    dashboard_conf : DashboardConfig | None, optional
+        Serve a live chart dashboard when given.
+    shadow_conf : ShadowConfig | None, optional
+        Paper trade the best configurations of the sweep at chart_conf.sweep_path
+        when given.
+    reoptimize_conf : ReoptimizeConfig | None, optional
+        Re-run the sweep in the background and trade its best configuration
+        when given.
 
     """
     logger.info("starting bot.")
 
-    ctx = OandaContext(
-        ctx=v20.Context("api-fxpractice.oanda.com", token=token),
-        account_id=account_id,
+    client = OandaClient(
         token=token,
+        account_id=account_id,
         instrument=chart_conf.instrument,
     )
+    if chart_conf.record_path is not None:
+        Recorder(chart_conf.record_path).attach(client.session)
+    template = OrderTemplate(chart_conf.instrument, trade_conf.amount)
+    positions = PositionCache(client)
+    TransactionStream(positions).start()
+    store = (
+        CandleWriter(chart_conf.store_path)
+        if chart_conf.store_path is not None
+        else None
+    )
+    dashboard = (
+        Dashboard(dashboard_conf).start() if dashboard_conf is not None else None
+    )
+    shadow = (
+        ShadowTrader(shadow_conf, chart_conf) if shadow_conf is not None else None
+    )
+    reoptimizer = (
+        Reoptimizer(reoptimize_conf, chart_conf).start()
+        if reoptimize_conf is not None
+        else None
+    )
+    bot_loop(
+        client,
+        positions,
+        template,
+        signal_conf,
+        chart_conf,
+        store=store,
+        dashboard=dashboard,
+        shadow=shadow,
+        reoptimizer=reoptimizer,
+    )
+
+
+def bot_loop(
+    client: OandaClient,
+    positions: PositionCache,
+    template: OrderTemplate,
+    signal_conf: SignalConfig,
+    chart_conf: ChartConfig,
+    store: CandleWriter | None = None,
+    dashboard: Dashboard | None = None,
+    shadow: ShadowTrader | None = None,
+    reoptimizer: Reoptimizer | None = None,
+    clock: Clock = WALL_CLOCK,
+    until: datetime | None = None,
+) -> int:
+    """Run bot_run once per candle.
+
+    The parameters not listed are those of bot_run.
+
+    Parameters
+    ----------
+    clock : Clock, optional
+        Paces the loop, a VirtualClock replays it as fast as possible.
+    until : datetime | None, optional
+        Stop once the clock passes this time, run forever when None.
 
-    last_time = datetime.now()
-    while True:
+    Returns
+    -------
+    int
+        The number of bot_run calls.
+
+    """
+    candles = CandleBuffer(chart_conf.candle_count)
+    # no candle has this timestamp, so the first run always trades
+    last_time = -1
+    cycles = 0
+    while until is None or clock.now() < until:
+        cycles += 1
+        if reoptimizer is not None:
+            # swap between cycles, so a cycle never mixes two configurations
+            signal_conf = reoptimizer.poll(signal_conf)
         with PerfTimer(APP_START_TIME, logger):
             trade_id, last_time, err = bot_run(
-                ctx, signal_conf, chart_conf=chart_conf, amount=trade_conf.amount, last_time=last_time,
+                client, positions, template, signal_conf, chart_conf=chart_conf, last_time=last_time, store=store,
+                dashboard=dashboard, candles=candles, shadow=shadow, clock=clock,
             )
+            logger.debug("latency: %s", client.latency.summary())
             if err is not None:
                 logger.error(err)
-                sleep(5)
+                positions.mark_dirty()
+                clock.sleep(5)
                 continue
 
         logger.info(f"columns used: {signal_conf}")
         logger.info(f"trade id: {trade_id}") if trade_id == -1 else None
-        sleep_until_next_5_minute(trade_id=trade_id)
-
+        sleep_until_next_candle(
+            chart_conf.granularity, trade_id=trade_id, clock=clock, last_time=last_time
+        )
+    return cycles
 
-def roundUp(dt):
-    """Round a datetime object to the next 5 minute interval."""
-    return (dt + timedelta(minutes=5 - dt.minute % 5)).replace(second=1, microsecond=0)
 
+def sleep_until_next_candle(
+    granularity: str = "M5",
+    trade_id: int = -1,
+    clock: Clock = WALL_CLOCK,
+    last_time: int = -1,
+):
+    """Sleep until a second after the current candle of the granularity closes.
 
-def sleep_until_next_5_minute(trade_id: int = -1):
-    """Sleep until the next 5 minute interval."""
-    now = datetime.now()
-    next_time = roundUp(now)
-    if (next_time - now) < timedelta(seconds=1):
-        next_time = next_time + timedelta(minutes=5)
+    last_time is the epoch nanosecond open of the last candle Oanda returned,
+    which aligns the granularities longer than H1, see next_candle_close.
+    """
+    now = clock.time_ns()
+    next_time = next_candle_close(now, granularity, last_time) + NS_PER_SECOND
     logger.info(
-        "sleeping until next 5 minute interval %s",
-        next_time.strftime("%Y-%m-%d %H:%M:%S.%f")[:-3],
+        "sleeping until next %s candle %s", granularity, to_rfc3339(next_time)[:23]
     )
-    sleep((next_time - now).total_seconds())
+    clock.sleep((next_time - now) / NS_PER_SECOND)
@@ -0,0 +1,62 @@
+"""Wall and virtual clocks for the bot loop."""
+
+from datetime import datetime, timedelta
+import time
+from typing import Callable
+
+
+class Clock:
+    """The wall clock."""
+
+    def now(self) -> datetime:
+        """Return the local time."""
+        return datetime.now()
+
+    def time_ns(self) -> int:
+        """Return the epoch nanoseconds."""
+        return time.time_ns()
+
+    def monotonic(self) -> float:
+        """Return seconds of a clock that never goes back."""
+        return time.monotonic()
+
+    def sleep(self, seconds: float) -> None:
+        """Block for seconds."""
+        time.sleep(seconds)
+
+
+WALL_CLOCK = Clock()
+EPOCH = datetime(1970, 1, 1)
+
+
+class VirtualClock(Clock):
+    """A clock that only moves when it is slept on.
+
+    sleep returns immediately after moving the clock forward, so a loop paced
+    by sleep runs as fast as its work allows.  Every listener is called with
+    the new time after each sleep, which lets a simulated exchange catch up.
+    """
+
+    def __init__(self, start: datetime):
+        """Initialize a VirtualClock object."""
+        self.start = start
+        self.current = start
+        self.listeners: list[Callable[[datetime], None]] = []
+
+    def now(self) -> datetime:
+        """Return the virtual time."""
+        return self.current
+
+    def time_ns(self) -> int:
+        """Return the epoch nanoseconds of the virtual time, taken as UTC."""
+        return (self.current - EPOCH) // timedelta(microseconds=1) * 1000
+
+    def monotonic(self) -> float:
+        """Return the virtual seconds since the start."""
+        return (self.current - self.start).total_seconds()
+
+    def sleep(self, seconds: float) -> None:
+        """Move the clock forward by seconds."""
+        self.current += timedelta(seconds=max(0.0, seconds))
+        for listener in self.listeners:
+            listener(self.current)
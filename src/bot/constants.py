@@ -2,6 +2,9 @@
 
 TP = [0.0, 0.05, 0.1, 0.15, 0.2]
 SL = [0.0, 0.05, 0.1, 0.15, 0.2]
+WMA_PERIODS = list(range(5, 205, 5))
+# configurations kept in a sweep file for shadow trading
+SWEEP_SIZE = 100
 
 SOURCE_COLUMNS = [
     "ha_open",
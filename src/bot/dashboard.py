@@ -0,0 +1,381 @@
+"""Live chart dashboard fed by the kernel output of every bot cycle."""
+
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import logging
+import queue
+import threading
+from typing import Any
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import orjson
+import pandas as pd
+
+from core.chart import lttb_numpy
+from core.frame import CandleFrame
+from core.store import to_epoch_ns
+
+logger = logging.getLogger("dashboard")
+
+DASHBOARD_COLUMNS = ["close", "wma", "signal", "trigger"]
+INT_COLUMNS = ["signal", "trigger"]
+
+PAGE = b"""<!doctype html>
+<html>
+<head><meta charset="utf-8"><title>MutantMarketBot</title></head>
+<body style="margin:0;font-family:sans-serif">
+<canvas id="chart" style="width:100vw;height:90vh"></canvas>
+<div id="status" style="padding:4px"></div>
+<script>
+const data = {time: [], close: [], wma: [], trigger: []};
+const canvas = document.getElementById("chart");
+function merge(update) {
+  const last = data.time.length ? data.time[data.time.length - 1] : -Infinity;
+  update.time.forEach((t, i) => {
+    let j = data.time.length - 1;
+    while (j >= 0 && data.time[j] > t) j--;
+    if (j < 0 || data.time[j] !== t) {
+      if (t < last) return;
+      j = data.time.push(t) - 1;
+    }
+    for (const c of ["close", "wma", "trigger"]) data[c][j] = update[c][i];
+  });
+}
+function draw() {
+  const ctx = canvas.getContext("2d");
+  const w = canvas.width = canvas.clientWidth, h = canvas.height = canvas.clientHeight;
+  const n = data.time.length;
+  if (n < 2) return;
+  const ys = data.close.concat(data.wma).filter(v => v !== null);
+  const lo = Math.min(...ys), hi = Math.max(...ys);
+  const t0 = data.time[0], t1 = data.time[n - 1];
+  const px = t => (t - t0) / (t1 - t0) * w, py = v => h - (v - lo) / (hi - lo || 1) * h;
+  for (const [col, color] of [["close", "#333"], ["wma", "#09c"]]) {
+    ctx.strokeStyle = color; ctx.beginPath();
+    data[col].forEach((v, i) => v === null ? null : ctx.lineTo(px(data.time[i]), py(v)));
+    ctx.stroke();
+  }
+  data.trigger.forEach((v, i) => {
+    if (!v) return;
+    ctx.fillStyle = v > 0 ? "#0a0" : "#c00";
+    ctx.fillRect(px(data.time[i]) - 3, py(data.close[i]) - 3, 6, 6);
+  });
+  document.getElementById("status").textContent =
+    n + " points, last " + new Date(t1 / 1e6).toISOString();
+}
+const events = new EventSource("events?points=" + Math.max(500, innerWidth * 2));
+events.addEventListener("snapshot", e => {
+  for (const c in data) data[c] = [];
+  merge(JSON.parse(e.data)); draw();
+});
+events.addEventListener("update", e => { merge(JSON.parse(e.data)); draw(); });
+</script>
+</body>
+</html>
+"""
+
+
+@dataclass
+class DashboardConfig:
+    """DashboardConfig class.
+
+    history is the number of candles kept on the server and max_points the
+    number of points a snapshot is downsampled to.  The first warmup rows of
+    every kernel frame never overwrite the history, since the Heikin Ashi and
+    WMA values are still settling there.
+    """
+
+    host: str = "127.0.0.1"
+    port: int = 8050
+    history: int = 500_000
+    max_points: int = 2000
+    warmup: int = 100
+    client_buffer: int = 64
+
+
+class _Client:
+    """The pending messages of one connected browser."""
+
+    def __init__(self, size: int):
+        self.messages: queue.Queue = queue.Queue(maxsize=size)
+        self.stale = False
+
+
+class Dashboard:
+    """Keep the candle history and push changes to connected browsers.
+
+    publish only hands a copy of the dashboard columns to a worker thread,
+    replacing a frame the worker has not picked up yet, so the bot never waits
+    on the dashboard.
+    The worker compares the frame with the history and sends only new or
+    changed candles.  Browsers that fall behind are resynchronized with a fresh
+    snapshot instead of being sent every missed update.
+    """
+
+    def __init__(self, config: DashboardConfig):
+        """Initialize a Dashboard object."""
+        self.config = config
+        self.pending: queue.Queue = queue.Queue(maxsize=1)
+        self.times = np.empty(0, dtype=np.int64)
+        self.values = {
+            column: np.empty(0, dtype=np.int64 if column in INT_COLUMNS else np.float64)
+            for column in DASHBOARD_COLUMNS
+        }
+        self.clients: list[_Client] = []
+        self.lock = threading.Lock()
+        self.server = DashboardServer(self, config.host, config.port)
+        self.worker = threading.Thread(target=self.run, name="dashboard", daemon=True)
+
+    def start(self) -> "Dashboard":
+        """Start the worker and serve the dashboard."""
+        self.worker.start()
+        self.server.start()
+        logger.info(
+            "dashboard on http://%s:%s", self.config.host, self.server.port
+        )
+        return self
+
+    def stop(self) -> None:
+        """Stop serving the dashboard."""
+        self.server.stop()
+        self.pending.put(None)
+
+    def publish(self, df: pd.DataFrame | CandleFrame) -> None:
+        """Hand a kernel frame to the worker without blocking.
+
+        The kernel frame holds views into the candle buffer, which the next
+        cycle rewrites in place, so the dashboard columns are copied first.
+        """
+        times = df.index if isinstance(df, CandleFrame) else to_epoch_ns(df.index)
+        frame = CandleFrame(
+            np.array(times, dtype=np.int64),
+            {
+                column: np.array(
+                    df[column], dtype=np.int64 if column in INT_COLUMNS else np.float64
+                )
+                for column in DASHBOARD_COLUMNS
+            },
+        )
+        try:
+            self.pending.put_nowait(frame)
+        except queue.Full:
+            try:
+                self.pending.get_nowait()
+            except queue.Empty:
+                pass
+            self.pending.put_nowait(frame)
+
+    def run(self) -> None:
+        """Apply published frames and broadcast the changes."""
+        while True:
+            df = self.pending.get()
+            if df is None:
+                return
+            try:
+                update = self.update(df)
+            except Exception as err:
+                logger.error("dashboard update: %s", err)
+                continue
+            if update is not None:
+                self.broadcast(b"update", update)
+
+    def update(self, df: pd.DataFrame | CandleFrame) -> dict[str, Any] | None:
+        """Merge a kernel frame into the history.
+
+        Returns
+        -------
+        dict[str, Any] | None
+            The new or changed candles, None when nothing changed.
+
+        """
+        times = df.index if isinstance(df, CandleFrame) else to_epoch_ns(df.index)
+        frame = {
+            column: np.asarray(
+                df[column], dtype=np.int64 if column in INT_COLUMNS else np.float64
+            )
+            for column in DASHBOARD_COLUMNS
+        }
+
+        with self.lock:
+            # rows of the frame that are already in the history
+            if len(self.times) > 0:
+                position = np.minimum(
+                    np.searchsorted(self.times, times), len(self.times) - 1
+                )
+                known = self.times[position] == times
+                known[: self.config.warmup] = False
+                new = times > self.times[-1]
+            else:
+                position = np.zeros(len(times), dtype=np.int64)
+                known = np.zeros(len(times), dtype=bool)
+                new = np.ones(len(times), dtype=bool)
+
+            changed = np.zeros(len(times), dtype=bool)
+            for column, values in frame.items():
+                old = self.values[column][position[known]]
+                if column in INT_COLUMNS:
+                    differs = old != values[known]
+                else:
+                    differs = ~np.isclose(old, values[known], rtol=1e-9, equal_nan=True)
+                changed[known] |= differs
+                self.values[column][position[known]] = values[known]
+
+            self.times = np.concatenate((self.times, times[new]))[-self.config.history :]
+            for column, values in frame.items():
+                self.values[column] = np.concatenate((self.values[column], values[new]))[
+                    -self.config.history :
+                ]
+
+        send = changed | new
+        if not send.any():
+            return None
+        update: dict[str, Any] = {"time": times[send]}
+        for column, values in frame.items():
+            update[column] = values[send]
+        return update
+
+    def snapshot(self, points: int | None = None) -> dict[str, Any]:
+        """Return the history downsampled to points, keeping the most recent trades."""
+        points = min(points or self.config.max_points, self.config.max_points)
+        with self.lock:
+            times = self.times
+            values = dict(self.values)
+        indices = lttb_numpy(times.astype(np.float64), values["close"], points)
+        trades = np.flatnonzero(values["trigger"] != 0)[-points:]
+        indices = np.union1d(indices, trades)
+        result: dict[str, Any] = {"time": times[indices]}
+        for column, column_values in values.items():
+            result[column] = column_values[indices]
+        return result
+
+    def connect(self) -> _Client:
+        """Register a browser."""
+        client = _Client(self.config.client_buffer)
+        with self.lock:
+            self.clients.append(client)
+        return client
+
+    def disconnect(self, client: _Client) -> None:
+        """Unregister a browser."""
+        with self.lock:
+            self.clients.remove(client)
+
+    def broadcast(self, event: bytes, data: dict[str, Any]) -> None:
+        """Send a server-sent event to every browser."""
+        message = encode_event(event, data)
+        with self.lock:
+            clients = list(self.clients)
+        for client in clients:
+            try:
+                client.messages.put_nowait(message)
+            except queue.Full:
+                client.stale = True
+
+
+def encode_event(event: bytes, data: dict[str, Any]) -> bytes:
+    """Encode a server-sent event."""
+    payload = orjson.dumps(data, option=orjson.OPT_SERIALIZE_NUMPY)
+    return b"event: " + event + b"\ndata: " + payload + b"\n\n"
+
+
+class DashboardHandler(BaseHTTPRequestHandler):
+    """Serve the page, snapshots and the event stream."""
+
+    server: "DashboardServer"
+
+    def log_message(self, format: str, *args: Any) -> None:
+        """Log requests at debug level instead of stderr."""
+        logger.debug(format, *args)
+
+    def send_body(self, status: int, content_type: str, body: bytes) -> None:
+        """Send a complete response."""
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def stream_events(self, points: int | None) -> None:
+        """Send a snapshot, then updates until the browser disconnects."""
+        dashboard = self.server.dashboard
+        client = dashboard.connect()
+        self.close_connection = True
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        try:
+            self.wfile.write(encode_event(b"snapshot", dashboard.snapshot(points)))
+            self.wfile.flush()
+            while True:
+                if client.stale:
+                    # fell behind, start over from a snapshot
+                    while not client.messages.empty():
+                        client.messages.get_nowait()
+                    client.stale = False
+                    message = encode_event(b"snapshot", dashboard.snapshot(points))
+                else:
+                    try:
+                        message = client.messages.get(timeout=15)
+                    except queue.Empty:
+                        message = b": keepalive\n\n"
+                self.wfile.write(message)
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            dashboard.disconnect(client)
+
+    def do_GET(self) -> None:
+        """Route the request."""
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        points = int(query["points"][0]) if "points" in query else None
+
+        if url.path == "/":
+            self.send_body(200, "text/html; charset=utf-8", PAGE)
+        elif url.path == "/events":
+            self.stream_events(points)
+        elif url.path == "/snapshot":
+            self.send_body(
+                200,
+                "application/json",
+                orjson.dumps(
+                    self.server.dashboard.snapshot(points),
+                    option=orjson.OPT_SERIALIZE_NUMPY,
+                ),
+            )
+        else:
+            self.send_body(404, "text/plain", b"not found")
+
+
+class DashboardServer(ThreadingHTTPServer):
+    """A threaded HTTP server holding a Dashboard."""
+
+    daemon_threads = True
+
+    def __init__(self, dashboard: Dashboard, host: str = "127.0.0.1", port: int = 0):
+        """Initialize a DashboardServer object, port 0 picks a free port."""
+        super().__init__((host, port), DashboardHandler)
+        self.dashboard = dashboard
+        self.thread: threading.Thread | None = None
+
+    @property
+    def port(self) -> int:
+        """Return the port the server is bound to."""
+        return self.server_address[1]
+
+    def start(self) -> "DashboardServer":
+        """Serve requests on a background thread."""
+        self.thread = threading.Thread(
+            target=self.serve_forever, name="dashboard_server", daemon=True
+        )
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Stop serving and close the socket."""
+        self.shutdown()
+        self.server_close()
@@ -1,11 +1,121 @@
 """Get OHLC data from an exchange and convert it into a pandas DataFrame."""
 
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
+from dataclasses import dataclass
+import random
+import threading
+from time import perf_counter, time_ns
+from typing import Any, Callable
+
+import numpy as np
+from numpy.typing import NDArray
+import orjson
+import requests
+from requests.adapters import HTTPAdapter
 import v20  # type: ignore
 import pandas as pd
 import logging
 
+from bot.clock import WALL_CLOCK, Clock
+
 logger = logging.getLogger("exchange")
 
+PRACTICE_HOSTNAME = "api-fxpractice.oanda.com"
+NS_PER_SECOND = 1_000_000_000
+OHLC_COLUMNS = [
+    "open",
+    "high",
+    "low",
+    "close",
+    "bid_open",
+    "bid_high",
+    "bid_low",
+    "bid_close",
+    "ask_open",
+    "ask_high",
+    "ask_low",
+    "ask_close",
+]
+# transactions Oanda answers an order or close it did not fill with
+ORDER_REJECT_KEYS = ("orderRejectTransaction", "orderCancelTransaction")
+# Oanda trades around the clock on weekdays
+TRADING_DAYS_PER_YEAR = 260
+GRANULARITY_SECONDS = {
+    "S5": 5,
+    "S10": 10,
+    "S15": 15,
+    "S30": 30,
+    "M1": 60,
+    "M2": 120,
+    "M4": 240,
+    "M5": 300,
+    "M10": 600,
+    "M15": 900,
+    "M30": 1800,
+    "H1": 3600,
+    "H2": 7200,
+    "H3": 10800,
+    "H4": 14400,
+    "H6": 21600,
+    "H8": 28800,
+    "H12": 43200,
+    "D": 86400,
+    "W": 604800,
+}
+
+
+def granularity_seconds(granularity: str) -> int:
+    """Return the length of a candle of the given Oanda granularity in seconds."""
+    if granularity not in GRANULARITY_SECONDS:
+        raise ValueError(f"unsupported granularity: {granularity}")
+    return GRANULARITY_SECONDS[granularity]
+
+
+def periods_per_year(granularity: str) -> float:
+    """Return the number of candles of the given Oanda granularity in a trading year.
+
+    A trading year has TRADING_DAYS_PER_YEAR days of 24 hours and 52 weekly candles.
+    """
+    if granularity == "W":
+        return 52.0
+    return TRADING_DAYS_PER_YEAR * 86400 / granularity_seconds(granularity)
+
+
+def granularity_ns(granularity: str) -> int:
+    """Return the length of a candle of the given Oanda granularity in nanoseconds."""
+    return granularity_seconds(granularity) * NS_PER_SECOND
+
+
+def next_candle_close(now_ns: int, granularity: str, last_time: int = -1) -> int:
+    """Return the epoch nanoseconds the candle open at now_ns closes at.
+
+    Candles are aligned on last_time, the epoch nanosecond open of a candle of
+    the granularity, when it is known.  Otherwise they are aligned to the
+    epoch, which is how Oanda aligns the granularities up to H1 only, the longer
+    ones start at 17:00 New York time.
+
+    Raises
+    ------
+    ValueError
+        If last_time is not known and the granularity is longer than H1.
+
+    """
+    step = granularity_ns(granularity)
+    if last_time < 0:
+        if step > granularity_ns("H1"):
+            raise ValueError(
+                f"{granularity} candles are not aligned to the epoch, a last_time is needed"
+            )
+        last_time = 0
+    return last_time + max(1, (now_ns - last_time) // step + 1) * step
+
+
+def parse_times(times: list[str]) -> NDArray[np.int64]:
+    """Parse Oanda RFC3339 candle times into int64 epoch nanoseconds, in one pass."""
+    # the times are UTC, numpy parses them once the Z suffix is dropped
+    return np.array([t.rstrip("Z") for t in times], dtype="datetime64[ns]").view(np.int64)
+
 
 class OandaContext:
     """OandaContext class."""
@@ -64,7 +174,7 @@ def getOandaOHLC(
     pd.DataFrame
         A DataFrame containing the OHLC data with the following columns:
 
-        - timestamp
+        - timestamp, int64 epoch nanoseconds
         - open
         - high
         - low
@@ -79,49 +189,21 @@ def getOandaOHLC(
         - ask_close
 
     """
-    df = pd.DataFrame(
-        columns=[
-            "timestamp",
-            "open",
-            "high",
-            "low",
-            "close",
-            "bid_open",
-            "bid_high",
-            "bid_low",
-            "bid_close",
-            "ask_open",
-            "ask_high",
-            "ask_low",
-            "ask_close",
-        ]
-    )
-
     resp = ctx.ctx.instrument.candles(
         instrument=ctx.instrument,
         granularity=granularity,
         price="MAB",
         count=count,
     )
-    if resp.body["candles"]:
-        candles: v20.instrument.Candlesticks = resp.body["candles"]
-        candle: v20.instrument.Candlestick
-        for i, candle in enumerate(candles):
-            df.loc[i] = {  # type: ignore
-                "timestamp": candle.time,
-                "open": candle.mid.o,
-                "high": candle.mid.h,
-                "low": candle.mid.l,
-                "close": candle.mid.c,
-                "bid_open": candle.bid.o,
-                "bid_high": candle.bid.h,
-                "bid_low": candle.bid.l,
-                "bid_close": candle.bid.c,
-                "ask_open": candle.ask.o,
-                "ask_high": candle.ask.h,
-                "ask_low": candle.ask.l,
-                "ask_close": candle.ask.c,
-            }
+    candles: v20.instrument.Candlesticks = resp.body["candles"] or []
+    data: dict[str, Any] = {"timestamp": parse_times([c.time for c in candles])}
+    for prefix, price in (("", "mid"), ("bid_", "bid"), ("ask_", "ask")):
+        for name, key in (("open", "o"), ("high", "h"), ("low", "l"), ("close", "c")):
+            data[prefix + name] = np.array(
+                [getattr(getattr(c, price), key) for c in candles], dtype=np.float64
+            )
+    df = pd.DataFrame(data, columns=["timestamp"] + OHLC_COLUMNS)
+    if len(candles) > 0:
         logger.info("retrieved %s candles", len(candles))
 
     return df
@@ -321,3 +403,528 @@ def get_open_trade(ctx: OandaContext) -> int:
                 return trades[0].id
 
     return -1
+
+
+class OandaError(Exception):
+    """An error response of the Oanda REST API, with its decoded body."""
+
+    def __init__(self, endpoint: str, status: int, body: dict[str, Any]):
+        """Initialize a OandaError object."""
+        super().__init__(f"{endpoint}: {status} {body}")
+        self.status = status
+        self.body = body
+
+
+def order_rejection(resp: dict[str, Any]) -> str | None:
+    """Return the reason an order or close response did not fill, None if it filled."""
+    if "orderFillTransaction" in resp:
+        return None
+    for key in ORDER_REJECT_KEYS:
+        if key in resp:
+            transaction = resp[key]
+            return transaction.get("rejectReason") or transaction.get("reason") or key
+    return str(resp)
+
+
+@dataclass
+class RetryConfig:
+    """Bounded exponential backoff for REST requests."""
+
+    max_attempts: int = 4
+    base_delay: float = 0.25
+    max_delay: float = 4.0
+
+
+class LatencyStats:
+    """Per-endpoint request latency, kept over a bounded window of samples."""
+
+    def __init__(self, window: int = 1024):
+        """Initialize a LatencyStats object."""
+        self.window = window
+        self.samples: dict[str, deque[float]] = {}
+        self.counts: dict[str, int] = {}
+        self.errors: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint: str, seconds: float, ok: bool) -> None:
+        """Record one request."""
+        with self._lock:
+            if endpoint not in self.samples:
+                self.samples[endpoint] = deque(maxlen=self.window)
+                self.counts[endpoint] = 0
+                self.errors[endpoint] = 0
+            self.samples[endpoint].append(seconds)
+            self.counts[endpoint] += 1
+            if not ok:
+                self.errors[endpoint] += 1
+
+    def summary(self) -> dict[str, dict[str, float]]:
+        """Summarize the latency of each endpoint in milliseconds."""
+        with self._lock:
+            result = {}
+            for endpoint, samples in self.samples.items():
+                ms = np.asarray(samples) * 1000
+                result[endpoint] = {
+                    "count": self.counts[endpoint],
+                    "errors": self.errors[endpoint],
+                    "mean": round(float(ms.mean()), 3),
+                    "p50": round(float(np.percentile(ms, 50)), 3),
+                    "p95": round(float(np.percentile(ms, 95)), 3),
+                    "max": round(float(ms.max()), 3),
+                }
+            return result
+
+
+@dataclass
+class TradeLatency:
+    """End-to-end latency stamps of opening or closing a trade, in epoch nanoseconds."""
+
+    candle_close: int = 0
+    kernel_done: int = 0
+    request_sent: int = 0
+    fill_received: int = 0
+    action: str = "open"
+
+    def summary(self) -> dict[str, float]:
+        """Return the latency of each stage in milliseconds."""
+        return {
+            "close_to_kernel": (self.kernel_done - self.candle_close) / 1e6,
+            "kernel_to_sent": (self.request_sent - self.kernel_done) / 1e6,
+            "sent_to_fill": (self.fill_received - self.request_sent) / 1e6,
+            "close_to_fill": (self.fill_received - self.candle_close) / 1e6,
+        }
+
+
+class OrderTemplate:
+    """A market order for one instrument, built and encoded once.
+
+    The request body of a plain market order is pre-encoded so submitting it
+    needs no object construction or serialization.  Take profit and trailing
+    stop details are only added when requested.
+    """
+
+    def __init__(self, instrument: str, units: float):
+        """Initialize a OrderTemplate object."""
+        self.instrument = instrument
+        self.decimals = 3 if instrument.split("_")[1] == "JPY" else 5
+        self.order = {
+            "type": "MARKET",
+            "instrument": instrument,
+            "units": f"{units:g}",
+            "timeInForce": "FOK",
+            "positionFill": "DEFAULT",
+        }
+        self.body = orjson.dumps({"order": self.order})
+
+    def render(self, take_profit: float = 0.0, trailing_distance: float = 0.0) -> bytes:
+        """Return the encoded request body."""
+        if take_profit <= 0.0 and trailing_distance <= 0.0:
+            return self.body
+
+        order: dict[str, Any] = dict(self.order)
+        if take_profit > 0.0:
+            order["takeProfitOnFill"] = {"price": f"{round(take_profit, self.decimals)}"}
+        if trailing_distance > 0.0:
+            order["trailingStopLossOnFill"] = {
+                "distance": f"{round(trailing_distance, self.decimals)}"
+            }
+        return orjson.dumps({"order": order})
+
+
+def candles_to_arrays(
+    candles: list[dict[str, Any]],
+) -> tuple[np.ndarray, np.ndarray]:
+    """Convert Oanda REST candles into epoch-nanosecond times and a price block.
+
+    Parameters
+    ----------
+    candles : list[dict[str, Any]]
+        The decoded "candles" array of an Oanda candles response, requested with
+        price="MAB" and RFC3339 times.
+
+    Returns
+    -------
+    tuple[np.ndarray, np.ndarray]
+        The int64 times and a (12 x rows) block in the order of OHLC_COLUMNS.
+
+    """
+    times = parse_times([c["time"] for c in candles])
+    block = np.empty((len(OHLC_COLUMNS), len(candles)))
+    row = 0
+    for price in ("mid", "bid", "ask"):
+        for key in ("o", "h", "l", "c"):
+            block[row] = np.array([c[price][key] for c in candles], dtype=np.float64)
+            row += 1
+    return times, block
+
+
+def to_rfc3339(epoch_ns: int) -> str:
+    """Format epoch nanoseconds the way Oanda formats candle times."""
+    return str(np.datetime64(int(epoch_ns), "ns")) + "Z"
+
+
+class Recorder:
+    """Append every response of a requests.Session to a JSON lines file."""
+
+    def __init__(self, path: str, clock: Clock = WALL_CLOCK):
+        """Initialize a Recorder object."""
+        self.file = open(path, "wb")
+        self.clock = clock
+        self.lock = threading.Lock()
+
+    def attach(self, session: requests.Session) -> "Recorder":
+        """Record the responses of a session."""
+        session.hooks["response"].append(self.record)
+        return self
+
+    def record(self, resp: requests.Response, *args: Any, **kwargs: Any) -> None:
+        """Write one response."""
+        line = orjson.dumps(
+            {
+                "time": self.clock.now().isoformat(),
+                "method": resp.request.method,
+                "url": resp.request.path_url,
+                "status": resp.status_code,
+                "body": resp.text,
+            }
+        )
+        with self.lock:
+            self.file.write(line + b"\n")
+            # a killed bot still leaves every response on disk
+            self.file.flush()
+
+    def close(self) -> None:
+        """Flush and close the file."""
+        self.file.close()
+
+
+class OandaClient:
+    """Oanda REST client with pooled, concurrent keep-alive connections and retries.
+
+    Independent requests are issued concurrently on a small thread pool that
+    shares one requests.Session, so every worker reuses the same persistent
+    connections, see gather.  Failed requests are retried with bounded
+    exponential backoff, slept on the clock, and the latency of every attempt
+    is recorded per endpoint.
+    """
+
+    def __init__(
+        self,
+        token: str,
+        account_id: str | None,
+        instrument: str,
+        hostname: str = PRACTICE_HOSTNAME,
+        port: int = 443,
+        ssl: bool = True,
+        retry: RetryConfig | None = None,
+        pool_size: int = 4,
+        timeout: float = 10.0,
+        clock: Clock = WALL_CLOCK,
+    ):
+        """Initialize a OandaClient object."""
+        self.account_id = account_id if account_id is not None else ""
+        self.instrument = instrument
+        self.base_url = f"{'https' if ssl else 'http'}://{hostname}:{port}"
+        self.retry = retry if retry is not None else RetryConfig()
+        self.timeout = timeout
+        self.clock = clock
+        self.latency = LatencyStats()
+        # size of the last response body per endpoint
+        self.response_bytes: dict[str, int] = {}
+        self.trade_latencies: deque[TradeLatency] = deque(maxlen=1024)
+        self.fill_listeners: list[Callable[[dict[str, Any]], None]] = []
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update(
+            {
+                "Authorization": f"Bearer {token}",
+                "Content-Type": "application/json",
+                "Accept-Datetime-Format": "RFC3339",
+                "Connection": "keep-alive",
+            }
+        )
+        self.executor = ThreadPoolExecutor(
+            max_workers=pool_size, thread_name_prefix="oanda"
+        )
+
+    def close(self) -> None:
+        """Release the thread pool and the pooled connections."""
+        self.executor.shutdown(wait=False)
+        self.session.close()
+
+    def gather(self, *calls: Callable[[], Any]) -> list[Any]:
+        """Run independent calls, i.e. a reconcile and a candle fetch, concurrently.
+
+        With a pool size of 1 the calls run one after the other in the given
+        order, which keeps the requests of a replay in a deterministic order.
+
+        Parameters
+        ----------
+        *calls : Callable[[], Any]
+            The calls, each sending its requests through this client.
+
+        Returns
+        -------
+        list[Any]
+            The results in the order of the calls.  Once every call finished,
+            the error of the first call that failed is raised.
+
+        """
+        futures = [self.executor.submit(call) for call in calls]
+        wait(futures)
+        return [future.result() for future in futures]
+
+    def request(
+        self,
+        endpoint: str,
+        method: str,
+        path: str,
+        params: dict[str, Any] | None = None,
+        body: bytes | None = None,
+        attempts: int | None = None,
+    ) -> dict[str, Any]:
+        """Send a request and decode the JSON response.
+
+        Connection errors, 429 and 5xx responses are retried with exponential
+        backoff, other error responses are raised immediately.  Error responses
+        are raised as an OandaError holding the decoded body.
+
+        Parameters
+        ----------
+        endpoint : str
+            The name the latency is recorded under.
+        method : str
+            The HTTP method.
+        path : str
+            The request path, i.e. /v3/accounts/<id>/openTrades.
+        params : dict[str, Any] | None, optional
+            The query parameters.
+        body : bytes | None, optional
+            The encoded JSON body.
+        attempts : int | None, optional
+            Overrides the number of attempts of the retry configuration.
+
+        Returns
+        -------
+        dict[str, Any]
+            The decoded response body.
+
+        """
+        delay = self.retry.base_delay
+        max_attempts = attempts if attempts is not None else self.retry.max_attempts
+        error: Exception = Exception(f"{endpoint}: no attempts made")
+        for attempt in range(1, max_attempts + 1):
+            start = perf_counter()
+            try:
+                resp = self.session.request(
+                    method,
+                    self.base_url + path,
+                    params=params,
+                    data=body,
+                    timeout=self.timeout,
+                )
+            except requests.RequestException as err:
+                self.latency.record(endpoint, perf_counter() - start, False)
+                error = err
+            else:
+                self.latency.record(endpoint, perf_counter() - start, resp.ok)
+                if resp.ok:
+                    self.response_bytes[endpoint] = len(resp.content)
+                    return orjson.loads(resp.content)
+                try:
+                    decoded = orjson.loads(resp.content)
+                except orjson.JSONDecodeError:
+                    decoded = {"errorMessage": resp.text}
+                error = OandaError(endpoint, resp.status_code, decoded)
+                if resp.status_code < 500 and resp.status_code != 429:
+                    raise error
+
+            if attempt < max_attempts:
+                logger.warning(
+                    "%s attempt %s failed: %s, retrying in %.2fs",
+                    endpoint,
+                    attempt,
+                    error,
+                    delay,
+                )
+                self.clock.sleep(delay * random.uniform(0.5, 1.0))
+                delay = min(delay * 2, self.retry.max_delay)
+
+        raise error
+
+    def send_order(
+        self,
+        endpoint: str,
+        method: str,
+        path: str,
+        body: bytes,
+        attempts: int | None = None,
+    ) -> dict[str, Any]:
+        """Send an order or close request and decode the response, rejects included.
+
+        Oanda answers an order or close it rejects with a 4xx status and the
+        reject transaction in the body, which is returned like a fill so the
+        caller can raise with its reason, see order_rejection.
+        """
+        try:
+            return self.request(endpoint, method, path, body=body, attempts=attempts)
+        except OandaError as err:
+            if not any(key in err.body for key in ORDER_REJECT_KEYS):
+                raise
+            return err.body
+
+    def notify_fill(self, resp: dict[str, Any]) -> None:
+        """Pass the fill transaction of an order response to the fill listeners."""
+        if "orderFillTransaction" in resp:
+            for listener in self.fill_listeners:
+                listener(resp["orderFillTransaction"])
+
+    def get_open_trades(self) -> list[dict[str, Any]]:
+        """Get all open trades of the account."""
+        return self.open_trades_snapshot()[0]
+
+    def open_trades_snapshot(self) -> tuple[list[dict[str, Any]], int]:
+        """Get all open trades and the id of the last transaction they include."""
+        body = self.request(
+            "open_trades", "GET", f"/v3/accounts/{self.account_id}/openTrades"
+        )
+        return body.get("trades", []), int(body.get("lastTransactionID", -1))
+
+    def get_candle_arrays(
+        self,
+        granularity: str = "M5",
+        count: int | None = None,
+        since: int | None = None,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Get candles as arrays, see candles_to_arrays.
+
+        Parameters
+        ----------
+        granularity : str, optional
+            The granularity of the candles.
+        count : int | None, optional
+            The number of most recent candles to get.
+        since : int | None, optional
+            Only get the candles from this epoch-nanosecond time on, inclusive.
+
+        Returns
+        -------
+        tuple[np.ndarray, np.ndarray]
+            The times and the (12 x rows) price block.
+
+        """
+        params: dict[str, Any] = {"price": "MAB", "granularity": granularity}
+        if count is not None:
+            params["count"] = count
+        if since is not None:
+            params["from"] = to_rfc3339(since)
+        body = self.request(
+            "candles",
+            "GET",
+            f"/v3/instruments/{self.instrument}/candles",
+            params=params,
+        )
+        start = perf_counter()
+        candles = body.get("candles", [])
+        times, block = candles_to_arrays(candles)
+        logger.info(
+            "retrieved %s candles, %s bytes, parsed in %.3f ms",
+            len(candles),
+            self.response_bytes.get("candles", 0),
+            (perf_counter() - start) * 1000,
+        )
+        return times, block
+
+    def place_market_order(
+        self,
+        template: OrderTemplate,
+        latency: TradeLatency | None = None,
+        take_profit: float = 0.0,
+        trailing_distance: float = 0.0,
+    ) -> int:
+        """Submit a market order built from a template.
+
+        The order is sent once, a retried market order could fill twice.
+        Logging of the order happens after the response is received.
+
+        Parameters
+        ----------
+        template : OrderTemplate
+            The prebuilt order for the instrument.
+        latency : TradeLatency | None, optional
+            Latency stamps of the trade; request_sent and fill_received are set
+            here and the stamps are kept in trade_latencies.
+        take_profit : float
+            The take profit price for the order.
+        trailing_distance : float
+            The trailing distance for the order.
+
+        Returns
+        -------
+        int
+            The trade ID of the opened trade.
+
+        """
+        body = template.render(take_profit, trailing_distance)
+        if latency is not None:
+            latency.request_sent = time_ns()
+        resp = self.send_order(
+            "order",
+            "POST",
+            f"/v3/accounts/{self.account_id}/orders",
+            body,
+            attempts=1,
+        )
+        if latency is not None:
+            latency.fill_received = time_ns()
+
+        self.notify_fill(resp)
+        logger.info(body.decode())
+        rejection = order_rejection(resp)
+        if rejection is not None:
+            logger.error(resp)
+            raise Exception(rejection)
+        trade_id = int(resp["orderFillTransaction"]["tradeOpened"]["tradeID"])
+
+        if latency is not None:
+            self.trade_latencies.append(latency)
+            logger.info("trade %s latency ms: %s", trade_id, latency.summary())
+
+        return trade_id
+
+    def close_trade(self, trade_id: int, latency: TradeLatency | None = None) -> None:
+        """Close an open trade.
+
+        Parameters
+        ----------
+        trade_id : int
+            The trade to close.
+        latency : TradeLatency | None, optional
+            Latency stamps of the close; request_sent and fill_received are set
+            here and the stamps are kept in trade_latencies.
+
+        """
+        if latency is not None:
+            latency.action = "close"
+            latency.request_sent = time_ns()
+        resp = self.send_order(
+            "close",
+            "PUT",
+            f"/v3/accounts/{self.account_id}/trades/{trade_id}/close",
+            b"{}",
+        )
+        if latency is not None:
+            latency.fill_received = time_ns()
+
+        self.notify_fill(resp)
+        rejection = order_rejection(resp)
+        if rejection is not None:
+            logger.error(resp)
+            raise Exception(rejection)
+
+        if latency is not None:
+            self.trade_latencies.append(latency)
+            logger.info("close %s latency ms: %s", trade_id, latency.summary())
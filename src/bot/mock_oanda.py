@@ -0,0 +1,401 @@
+"""Local stand-in for the Oanda v20 REST API."""
+
+from bisect import bisect_left
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import logging
+import queue
+import re
+import threading
+from time import sleep
+from typing import Any
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import orjson
+
+from bot.exchange import granularity_seconds
+
+logger = logging.getLogger("mock_oanda")
+
+CANDLES_PATH = re.compile(r"^/v3/instruments/(?P<instrument>[^/]+)/candles$")
+OPEN_TRADES_PATH = re.compile(r"^/v3/accounts/(?P<account>[^/]+)/openTrades$")
+SUMMARY_PATH = re.compile(r"^/v3/accounts/(?P<account>[^/]+)/summary$")
+ORDERS_PATH = re.compile(r"^/v3/accounts/(?P<account>[^/]+)/orders$")
+STREAM_PATH = re.compile(r"^/v3/accounts/(?P<account>[^/]+)/transactions/stream$")
+SINCE_PATH = re.compile(r"^/v3/accounts/(?P<account>[^/]+)/transactions/sinceid$")
+CLOSE_PATH = re.compile(
+    r"^/v3/accounts/(?P<account>[^/]+)/trades/(?P<trade>[^/]+)/close$"
+)
+
+
+def _prices(ohlc: tuple[float, float, float, float], offset: float) -> dict[str, str]:
+    """Format one side of a candle the way Oanda does."""
+    o, h, low, c = ohlc
+    return {
+        "o": f"{o + offset:.3f}",
+        "h": f"{h + offset:.3f}",
+        "l": f"{low + offset:.3f}",
+        "c": f"{c + offset:.3f}",
+    }
+
+
+class MockOandaState:
+    """The mutable state served by the mock server.
+
+    The history holds candles of one granularity, requests for any other
+    granularity are answered with a 400.
+    """
+
+    def __init__(
+        self,
+        seed: int = 0,
+        price: float = 150.0,
+        spread: float = 0.01,
+        granularity: str = "M5",
+    ):
+        """Initialize a MockOandaState object."""
+        self.rng = np.random.default_rng(seed)
+        self.price = price
+        self.spread = spread
+        self.granularity = granularity
+        self.step = timedelta(seconds=granularity_seconds(granularity))
+        self.start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        self.balance = 100000.0
+        self.trades: list[dict[str, Any]] = []
+        self.fail_next = 0
+        self.delay = 0.0
+        self.next_id = 1
+        self.heartbeat = 5.0
+        self.history: list[dict[str, Any]] = []
+        # the candle times of the history, for bisecting
+        self.times: list[str] = []
+        self.subscribers: list[queue.Queue] = []
+        # every published transaction, for the sinceid endpoint
+        self.transactions: list[dict[str, Any]] = []
+        self.lock = threading.Lock()
+
+    def publish(self, transaction: dict[str, Any]) -> None:
+        """Send a transaction to every transaction stream."""
+        self.transactions.append(transaction)
+        for subscriber in self.subscribers:
+            subscriber.put(transaction)
+
+    def transaction_id(self) -> str:
+        """Return the next transaction id."""
+        self.next_id += 1
+        return str(self.next_id)
+
+    def fill(self, order: dict[str, Any]) -> dict[str, Any]:
+        """Fill a market order at the last price and open a trade."""
+        create_id = self.transaction_id()
+        fill_id = self.transaction_id()
+        price = f"{self.price:.3f}"
+        self.trades.append(
+            {
+                "id": fill_id,
+                "instrument": order["instrument"],
+                "currentUnits": order["units"],
+                "price": price,
+                "state": "OPEN",
+            }
+        )
+        fill = {
+            "id": fill_id,
+            "type": "ORDER_FILL",
+            "instrument": order["instrument"],
+            "units": order["units"],
+            "price": price,
+            "tradeOpened": {"tradeID": fill_id, "units": order["units"]},
+        }
+        self.publish(fill)
+        return {
+            "orderCreateTransaction": {"id": create_id, "type": "MARKET_ORDER"},
+            "orderFillTransaction": fill,
+            "lastTransactionID": fill_id,
+        }
+
+    def reject(self, type: str, reason: str) -> dict[str, Any]:
+        """Return the error body Oanda answers a rejected order or close with."""
+        reject_id = self.transaction_id()
+        return {
+            "orderRejectTransaction": {
+                "id": reject_id,
+                "type": type,
+                "rejectReason": reason,
+            },
+            "lastTransactionID": reject_id,
+            "errorCode": reason,
+            "errorMessage": reason.replace("_", " ").lower(),
+        }
+
+    def close(self, trade_id: str) -> dict[str, Any] | None:
+        """Close an open trade, returns None if it does not exist."""
+        for trade in self.trades:
+            if trade["id"] == trade_id:
+                self.trades.remove(trade)
+                fill_id = self.transaction_id()
+                fill = {
+                    "id": fill_id,
+                    "type": "ORDER_FILL",
+                    "instrument": trade["instrument"],
+                    "units": f"-{trade['currentUnits']}",
+                    "price": f"{self.price:.3f}",
+                    "tradesClosed": [
+                        {"tradeID": trade_id, "units": f"-{trade['currentUnits']}"}
+                    ],
+                }
+                self.publish(fill)
+                return {"orderFillTransaction": fill, "lastTransactionID": fill_id}
+        return None
+
+    def advance(self, count: int = 1) -> None:
+        """Append count candles to the history as a random walk, the last one is forming."""
+        last = self.history[-1] if len(self.history) > 0 else None
+        price = float(last["mid"]["c"]) if last is not None else self.price
+        closes = price + np.cumsum(self.rng.normal(0, self.spread * 5, count))
+        opens = np.concatenate(([price], closes[:-1]))
+        highs = np.maximum(opens, closes) + self.spread
+        lows = np.minimum(opens, closes) - self.spread
+        half = self.spread / 2
+
+        first = len(self.history)
+        for i in range(count):
+            ohlc = (opens[i], highs[i], lows[i], closes[i])
+            time = (self.start + self.step * (first + i)).strftime(
+                "%Y-%m-%dT%H:%M:%S.000000000Z"
+            )
+            self.history.append(
+                {
+                    "volume": 1,
+                    "time": time,
+                    "mid": _prices(ohlc, 0.0),
+                    "bid": _prices(ohlc, -half),
+                    "ask": _prices(ohlc, half),
+                }
+            )
+            self.times.append(time)
+        if count > 0:
+            # orders fill at the last price
+            self.price = float(self.history[-1]["mid"]["c"])
+
+    def advance_to(self, now: datetime) -> None:
+        """Extend the history up to the candle forming at now, a UTC time."""
+        if now.tzinfo is None:
+            now = now.replace(tzinfo=timezone.utc)
+        count = int((now - self.start) / self.step) + 1
+        if count > len(self.history):
+            self.advance(count - len(self.history))
+
+    def candles(
+        self, instrument: str, granularity: str, count: int | None, since: str | None
+    ) -> dict[str, Any]:
+        """Return the last count candles, or up to count candles from since on.
+
+        The history is extended on demand, so the first request decides how far
+        back it reaches.
+        """
+        if since is None:
+            count = count if count is not None else 500
+            if len(self.history) < count:
+                self.advance(count - len(self.history))
+            selected = self.history[-count:]
+        else:
+            first = bisect_left(self.times, since)
+            selected = self.history[first : first + (count if count is not None else 500)]
+
+        last = self.history[-1]["time"] if len(self.history) > 0 else None
+        candles = [dict(c, complete=c["time"] != last) for c in selected]
+        return {"instrument": instrument, "granularity": granularity, "candles": candles}
+
+
+    def respond(
+        self, method: str, url: str, body: dict[str, Any] | None = None
+    ) -> tuple[int, dict[str, Any]]:
+        """Answer a request to the REST API, except the transaction stream.
+
+        Parameters
+        ----------
+        method : str
+            The HTTP method.
+        url : str
+            The path and query string of the request.
+        body : dict[str, Any] | None, optional
+            The decoded request body.
+
+        Returns
+        -------
+        tuple[int, dict[str, Any]]
+            The status code and the response body.
+
+        """
+        parsed = urlparse(url)
+        path = parsed.path
+        query = parse_qs(parsed.query)
+        with self.lock:
+            if method == "GET":
+                if match := CANDLES_PATH.match(path):
+                    count = int(query["count"][0]) if "count" in query else None
+                    since = query["from"][0] if "from" in query else None
+                    granularity = query.get("granularity", ["S5"])[0]
+                    if granularity != self.granularity:
+                        return 400, {
+                            "errorMessage": f"only {self.granularity} candles are served"
+                        }
+                    return 200, self.candles(
+                        match["instrument"], granularity, count, since
+                    )
+                if OPEN_TRADES_PATH.match(path):
+                    return 200, {
+                        "trades": list(self.trades),
+                        "lastTransactionID": str(self.next_id),
+                    }
+                if SINCE_PATH.match(path):
+                    since = int(query["id"][0])
+                    return 200, {
+                        "transactions": [
+                            t for t in self.transactions if int(t["id"]) > since
+                        ],
+                        "lastTransactionID": str(self.next_id),
+                    }
+                if SUMMARY_PATH.match(path):
+                    return 200, {"account": {"balance": f"{self.balance:.4f}"}}
+            elif method == "POST" and ORDERS_PATH.match(path):
+                order = (body or {})["order"]
+                if float(order["units"]) == 0:
+                    return 400, self.reject("MARKET_ORDER_REJECT", "UNITS_INVALID")
+                return 201, self.fill(order)
+            elif method == "PUT" and (match := CLOSE_PATH.match(path)):
+                closed = self.close(match["trade"])
+                if closed is None:
+                    return 404, self.reject(
+                        "MARKET_ORDER_REJECT", "TRADE_DOESNT_EXIST"
+                    )
+                return 200, closed
+        return 404, {"errorMessage": f"unknown path {path}"}
+
+
+class MockOandaHandler(BaseHTTPRequestHandler):
+    """Request handler serving the subset of the v20 API the bot uses."""
+
+    protocol_version = "HTTP/1.1"
+    server: "MockOandaServer"
+
+    def log_message(self, format: str, *args: Any) -> None:
+        """Route the access log through logging."""
+        logger.debug(format, *args)
+
+    def send_json(self, status: int, body: dict[str, Any]) -> None:
+        """Send a JSON response on the keep-alive connection."""
+        payload = orjson.dumps(body)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def injected_failure(self) -> bool:
+        """Apply the configured delay and fail the request if requested."""
+        state = self.server.state
+        if state.delay > 0:
+            sleep(state.delay)
+        with state.lock:
+            if state.fail_next > 0:
+                state.fail_next -= 1
+                self.send_json(503, {"errorMessage": "injected failure"})
+                return True
+        return False
+
+    def stream_transactions(self) -> None:
+        """Stream transactions and heartbeats as JSON lines until disconnected."""
+        state = self.server.state
+        subscriber: queue.Queue = queue.Queue()
+        with state.lock:
+            state.subscribers.append(subscriber)
+
+        self.close_connection = True
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        try:
+            while True:
+                try:
+                    message = subscriber.get(timeout=state.heartbeat)
+                except queue.Empty:
+                    message = {
+                        "type": "HEARTBEAT",
+                        "lastTransactionID": str(state.next_id),
+                    }
+                self.wfile.write(orjson.dumps(message) + b"\n")
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            with state.lock:
+                state.subscribers.remove(subscriber)
+
+    def do_GET(self) -> None:
+        """Serve candles, open trades, the account summary and transactions."""
+        if self.injected_failure():
+            return
+        if STREAM_PATH.match(urlparse(self.path).path):
+            self.stream_transactions()
+        else:
+            self.send_json(*self.server.state.respond("GET", self.path))
+
+    def read_json(self) -> dict[str, Any]:
+        """Read and decode the request body."""
+        length = int(self.headers.get("Content-Length", 0))
+        return orjson.loads(self.rfile.read(length)) if length > 0 else {}
+
+    def do_POST(self) -> None:
+        """Fill market orders."""
+        # the body is read first, so a failure leaves the connection usable
+        body = self.read_json()
+        if self.injected_failure():
+            return
+        self.send_json(*self.server.state.respond("POST", self.path, body))
+
+    def do_PUT(self) -> None:
+        """Close trades."""
+        body = self.read_json()
+        if self.injected_failure():
+            return
+        self.send_json(*self.server.state.respond("PUT", self.path, body))
+
+
+class MockOandaServer(ThreadingHTTPServer):
+    """A threaded HTTP server holding a MockOandaState."""
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        state: MockOandaState | None = None,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        handler: type[BaseHTTPRequestHandler] = MockOandaHandler,
+    ):
+        """Initialize a MockOandaServer object, port 0 picks a free port."""
+        super().__init__((host, port), handler)
+        self.state = state if state is not None else MockOandaState()
+        self.thread: threading.Thread | None = None
+
+    @property
+    def port(self) -> int:
+        """Return the port the server is bound to."""
+        return self.server_address[1]
+
+    def start(self) -> "MockOandaServer":
+        """Serve requests on a background thread."""
+        self.thread = threading.Thread(
+            target=self.serve_forever, name="mock_oanda", daemon=True
+        )
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Stop serving and close the socket."""
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,208 @@
+"""Budgeted random and Bayesian search over a discrete parameter space."""
+
+from dataclasses import dataclass
+import heapq
+import itertools
+import logging
+import math
+from typing import Any, Callable
+
+import numpy as np
+
+logger = logging.getLogger("optimizer")
+
+RANDOM = "random"
+BAYESIAN = "bayesian"
+
+
+@dataclass
+class OptimizerConfig:
+    """OptimizerConfig class."""
+
+    method: str = RANDOM
+    budget: int = 1000
+    seed: int | None = None
+    top_k: int = 10
+    startup_trials: int = 50
+    candidates: int = 64
+    gamma: float = 0.15
+
+
+@dataclass
+class Trial:
+    """Trial class."""
+
+    params: dict[str, Any]
+    score: float
+    result: Any = None
+
+    def __str__(self) -> str:
+        """Return a string representation of the Trial object."""
+        result = self.result if isinstance(self.result, tuple) else (self.result,)
+        return f"score:{round(self.score, 5)} " + " ".join(str(r) for r in result)
+
+
+@dataclass
+class OptimizeResult:
+    """OptimizeResult class."""
+
+    best: list[Trial]
+    convergence: list[float]
+    evaluations: int
+
+
+def _smoothed_density(
+    counts: np.ndarray, ordinal: bool, prior_weight: float
+) -> np.ndarray:
+    """Turn category counts into a smoothed probability vector."""
+    density = counts.astype(float) + prior_weight
+    if ordinal and len(density) > 2:
+        # neighbouring values of an ordered dimension share some of the weight
+        density = np.convolve(density, [0.25, 0.5, 0.25], mode="same")
+    return density / density.sum()
+
+
+def _tpe_sample(
+    rng: np.random.Generator,
+    sizes: list[int],
+    ordinal: list[bool],
+    history: np.ndarray,
+    scores: np.ndarray,
+    config: OptimizerConfig,
+) -> tuple[int, ...]:
+    """Draw the next point with a tree-structured Parzen estimator.
+
+    The history is split into a good and a bad set by score.  Candidates are
+    drawn from the good density and the one with the highest good/bad
+    likelihood ratio is returned.
+    """
+    n_good = max(1, math.ceil(config.gamma * len(scores)))
+    order = np.argsort(-scores, kind="stable")
+    good = history[order[:n_good]]
+    bad = history[order[n_good:]]
+
+    log_ratio = np.zeros(config.candidates)
+    candidates = np.empty((config.candidates, len(sizes)), dtype=np.int64)
+    for j, size in enumerate(sizes):
+        l_density = _smoothed_density(
+            np.bincount(good[:, j], minlength=size), ordinal[j], 1.0
+        )
+        g_density = _smoothed_density(
+            np.bincount(bad[:, j], minlength=size), ordinal[j], 1.0
+        )
+        candidates[:, j] = rng.choice(size, size=config.candidates, p=l_density)
+        log_ratio += np.log(l_density[candidates[:, j]]) - np.log(
+            g_density[candidates[:, j]]
+        )
+
+    return tuple(int(i) for i in candidates[int(np.argmax(log_ratio))])
+
+
+def optimize(
+    space: dict[str, list[Any]],
+    evaluate: Callable[[dict[str, Any]], tuple[float, Any] | None],
+    config: OptimizerConfig,
+) -> OptimizeResult:
+    """Search a discrete parameter space under an evaluation budget.
+
+    Parameters
+    ----------
+    space : dict[str, list[Any]]
+        The candidate values for each parameter.
+    evaluate : Callable[[dict[str, Any]], tuple[float, Any] | None]
+        Scores one set of parameters.  Returns the score (higher is better) and
+        an arbitrary result object, or None if the parameters are infeasible.
+        Infeasible points do not count against the budget.
+    config : OptimizerConfig
+        The optimizer configuration.
+
+    Returns
+    -------
+    OptimizeResult
+        The best trials found, best-so-far score after each evaluation and the
+        number of evaluations performed.
+
+    Notes
+    -----
+    The random method samples points uniformly without replacement.  The
+    bayesian method samples uniformly for the first startup_trials evaluations
+    and then switches to a tree-structured Parzen estimator.
+
+    """
+    if config.method not in (RANDOM, BAYESIAN):
+        raise ValueError(f"unknown optimizer method: {config.method}")
+
+    rng = np.random.default_rng(config.seed)
+    names = list(space.keys())
+    sizes = [len(space[name]) for name in names]
+    ordinal = [
+        all(isinstance(v, (int, float)) for v in space[name]) for name in names
+    ]
+    space_size = math.prod(sizes)
+    budget = min(config.budget, space_size)
+    max_draws = budget * 20
+
+    seen: set[tuple[int, ...]] = set()
+    history: list[tuple[int, ...]] = []
+    scores: list[float] = []
+    convergence: list[float] = []
+    best: list[tuple[float, int, Trial]] = []
+    counter = itertools.count()
+
+    draws = 0
+    while len(scores) < budget and len(seen) < space_size and draws < max_draws:
+        draws += 1
+        if config.method == BAYESIAN and len(scores) >= config.startup_trials:
+            point = _tpe_sample(
+                rng,
+                sizes,
+                ordinal,
+                np.asarray(history, dtype=np.int64),
+                np.asarray(scores),
+                config,
+            )
+        else:
+            point = tuple(int(rng.integers(size)) for size in sizes)
+
+        if point in seen:
+            continue
+        seen.add(point)
+
+        params = {name: space[name][i] for name, i in zip(names, point)}
+        outcome = evaluate(params)
+        if outcome is None:
+            continue
+
+        score, result = outcome
+        if math.isnan(score):
+            score = -math.inf
+        history.append(point)
+        scores.append(score)
+        convergence.append(max(score, convergence[-1]) if convergence else score)
+
+        trial = Trial(params, score, result)
+        if len(best) < config.top_k:
+            heapq.heappush(best, (score, next(counter), trial))
+        elif score > best[0][0]:
+            heapq.heapreplace(best, (score, next(counter), trial))
+
+    return OptimizeResult(
+        best=[t for _, _, t in sorted(best, key=lambda b: (-b[0], b[1]))],
+        convergence=convergence,
+        evaluations=len(scores),
+    )
+
+
+def log_result(result: OptimizeResult, log: logging.Logger = logger) -> None:
+    """Log the best trials and how the best score converged."""
+    log.info("evaluations: %s", result.evaluations)
+    checkpoint = 1
+    while checkpoint < result.evaluations:
+        log.info("best after %s: %s", checkpoint, result.convergence[checkpoint - 1])
+        checkpoint *= 2
+    if result.evaluations > 0:
+        log.info(
+            "best after %s: %s", result.evaluations, result.convergence[-1]
+        )
+    for rank, trial in enumerate(result.best, start=1):
+        log.info("top %s: %s", rank, trial)
@@ -0,0 +1,261 @@
+"""Local cache of open trades kept current from fills and the transaction stream."""
+
+from dataclasses import dataclass
+import logging
+import threading
+from time import sleep
+from typing import Any
+
+import orjson
+import requests
+
+from bot.clock import WALL_CLOCK, Clock
+from bot.exchange import OandaClient
+
+logger = logging.getLogger("positions")
+
+STREAM_HOSTNAME = "stream-fxpractice.oanda.com"
+
+
+@dataclass
+class CachedTrade:
+    """An open trade as known locally."""
+
+    trade_id: int
+    instrument: str
+    units: float
+    price: float
+
+
+class PositionCache:
+    """Open trades per instrument, updated without a REST round trip.
+
+    Fills reported by order responses and by the transaction stream are applied
+    as they arrive.  The two sources deliver the same fills in no particular
+    order, so a fill that was applied already, or that the last reconcile
+    includes, is skipped, and a trade that was closed is not opened again by a
+    late copy of its opening fill.  A full list of the open trades is only
+    requested when the reconcile interval has passed or the cache was marked
+    dirty after an error.
+    """
+
+    def __init__(
+        self,
+        client: OandaClient,
+        reconcile_interval: float = 900.0,
+        clock: Clock = WALL_CLOCK,
+    ):
+        """Initialize a PositionCache object."""
+        self.client = client
+        self.clock = clock
+        self.reconcile_interval = reconcile_interval
+        self.trades: dict[str, dict[int, CachedTrade]] = {}
+        self.last_reconcile = 0.0
+        self.dirty = True
+        # the last transaction the stream delivered, -1 before the first one
+        self.last_transaction_id = -1
+        # the last transaction the open trades of the last reconcile include
+        self.reconciled_id = -1
+        # fills and closed trades applied since the last reconcile
+        self.applied_fills: set[int] = set()
+        self.closed_trades: set[int] = set()
+        self.lock = threading.Lock()
+        client.fill_listeners.append(self.apply_fill)
+
+    def open_trades(self, instrument: str) -> list[CachedTrade]:
+        """Return the open trades of an instrument, oldest first."""
+        with self.lock:
+            trades = self.trades.get(instrument, {})
+            return [trades[trade_id] for trade_id in sorted(trades)]
+
+    def first_trade_id(self, instrument: str) -> int:
+        """Return the id of the oldest open trade, or -1 when there is none."""
+        trades = self.open_trades(instrument)
+        return trades[0].trade_id if len(trades) > 0 else -1
+
+    def mark_dirty(self) -> None:
+        """Force a reconcile on the next cycle."""
+        self.dirty = True
+
+    def apply_fill(self, fill: dict[str, Any]) -> None:
+        """Apply an ORDER_FILL transaction unless it is stale or applied already."""
+        fill_id = int(fill["id"])
+        instrument = fill.get("instrument", "")
+        with self.lock:
+            if fill_id <= self.reconciled_id or fill_id in self.applied_fills:
+                return
+            self.applied_fills.add(fill_id)
+            trades = self.trades.setdefault(instrument, {})
+            if "tradeOpened" in fill:
+                opened = fill["tradeOpened"]
+                trade_id = int(opened["tradeID"])
+                if trade_id not in self.closed_trades:
+                    trades[trade_id] = CachedTrade(
+                        trade_id=trade_id,
+                        instrument=instrument,
+                        units=float(opened["units"]),
+                        price=float(opened.get("price", fill.get("price", 0.0))),
+                    )
+            for closed in fill.get("tradesClosed", []):
+                trade_id = int(closed["tradeID"])
+                trades.pop(trade_id, None)
+                self.closed_trades.add(trade_id)
+            if "tradeReduced" in fill:
+                reduced = fill["tradeReduced"]
+                trade = trades.get(int(reduced["tradeID"]))
+                if trade is not None:
+                    trade.units += float(reduced["units"])
+
+    def apply_transaction(self, transaction: dict[str, Any]) -> None:
+        """Apply one message of the transaction stream."""
+        if transaction.get("type") == "HEARTBEAT":
+            transaction_id = int(transaction["lastTransactionID"])
+        else:
+            transaction_id = int(transaction["id"])
+            if transaction.get("type") == "ORDER_FILL":
+                self.apply_fill(transaction)
+        self.last_transaction_id = max(self.last_transaction_id, transaction_id)
+
+    def reconcile(self) -> None:
+        """Replace the cache with the open trades listed by the REST API.
+
+        Trades opened or closed by fills newer than the listing are kept as
+        they are in the cache.
+        """
+        trades, reconciled_id = self.client.open_trades_snapshot()
+        by_instrument: dict[str, dict[int, CachedTrade]] = {}
+        for trade in trades:
+            cached = CachedTrade(
+                trade_id=int(trade["id"]),
+                instrument=trade["instrument"],
+                units=float(trade["currentUnits"]),
+                price=float(trade["price"]),
+            )
+            by_instrument.setdefault(cached.instrument, {})[cached.trade_id] = cached
+
+        with self.lock:
+            for instrument, cached_trades in self.trades.items():
+                for trade_id, cached in cached_trades.items():
+                    if trade_id > reconciled_id:
+                        by_instrument.setdefault(instrument, {})[trade_id] = cached
+            for listed in by_instrument.values():
+                for trade_id in self.closed_trades:
+                    listed.pop(trade_id, None)
+            self.trades = by_instrument
+            self.reconciled_id = max(self.reconciled_id, reconciled_id)
+            # older fills are skipped by their id from now on
+            self.applied_fills = {
+                i for i in self.applied_fills if i > self.reconciled_id
+            }
+            self.closed_trades = {
+                i for i in self.closed_trades if i > self.reconciled_id
+            }
+        self.last_reconcile = self.clock.monotonic()
+        self.dirty = False
+        logger.info("reconciled %s open trades", len(trades))
+
+    def maybe_reconcile(self) -> None:
+        """Reconcile when dirty or when the reconcile interval has passed."""
+        if (
+            self.dirty
+            or self.clock.monotonic() - self.last_reconcile >= self.reconcile_interval
+        ):
+            self.reconcile()
+
+
+class TransactionStream:
+    """Feed the Oanda transaction stream into a PositionCache on a daemon thread.
+
+    When the stream fails the cache is marked dirty, so the next cycle falls
+    back to a full reconcile, and the stream reconnects with backoff.  Once
+    reconnected, the transactions missed since the last one the stream
+    delivered are requested from the REST API and applied first.
+    """
+
+    def __init__(
+        self,
+        cache: PositionCache,
+        hostname: str = STREAM_HOSTNAME,
+        port: int = 443,
+        ssl: bool = True,
+        max_delay: float = 30.0,
+    ):
+        """Initialize a TransactionStream object."""
+        self.cache = cache
+        client = cache.client
+        self.url = (
+            f"{'https' if ssl else 'http'}://{hostname}:{port}"
+            f"/v3/accounts/{client.account_id}/transactions/stream"
+        )
+        self.since_url = (
+            f"{client.base_url}/v3/accounts/{client.account_id}/transactions/sinceid"
+        )
+        self.headers = dict(client.session.headers)
+        self.max_delay = max_delay
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(
+            target=self.run, name="transaction_stream", daemon=True
+        )
+
+    def start(self) -> "TransactionStream":
+        """Start reading the stream."""
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Stop reading after the current message."""
+        self.stopped.set()
+
+    def catch_up(self) -> int:
+        """Apply the transactions after the last one the stream delivered.
+
+        The stream is connected first, so a transaction is either in the
+        response or still buffered on the stream, and applying it twice is
+        harmless.  Nothing is requested before the stream delivered a first
+        message, the reconcile covers that.
+
+        Returns
+        -------
+        int
+            The number of transactions applied.
+
+        """
+        since = self.cache.last_transaction_id
+        if since < 0:
+            return 0
+        with requests.get(
+            self.since_url, headers=self.headers, params={"id": since}, timeout=10
+        ) as resp:
+            resp.raise_for_status()
+            transactions = orjson.loads(resp.content).get("transactions", [])
+        for transaction in transactions:
+            self.cache.apply_transaction(transaction)
+        logger.info(
+            "caught up on %s transactions since %s", len(transactions), since
+        )
+        return len(transactions)
+
+    def run(self) -> None:
+        """Read the stream until stopped, reconnecting on errors."""
+        delay = 1.0
+        while not self.stopped.is_set():
+            try:
+                with requests.get(
+                    self.url, headers=self.headers, stream=True, timeout=(10, 30)
+                ) as resp:
+                    resp.raise_for_status()
+                    self.catch_up()
+                    delay = 1.0
+                    for line in resp.iter_lines():
+                        if self.stopped.is_set():
+                            return
+                        if line:
+                            self.cache.apply_transaction(orjson.loads(line))
+            except Exception as err:
+                logger.error("transaction stream: %s", err)
+
+            if self.stopped.is_set():
+                return
+            self.cache.mark_dirty()
+            sleep(delay)
+            delay = min(delay * 2, self.max_delay)
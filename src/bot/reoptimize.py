@@ -0,0 +1,246 @@
+"""Re-run the backtest sweep in a low-priority background process."""
+
+from dataclasses import dataclass
+from datetime import datetime
+import logging
+import multiprocessing
+import os
+from time import perf_counter, process_time, sleep
+
+import numpy as np
+
+from bot.backtest import (
+    ChartConfig,
+    PerfTimer,
+    Record,
+    SignalConfig,
+    grid_combinations,
+    keep_in_sweep,
+    load_sweep,
+    ranked_sweep,
+    run_record,
+    save_sweep,
+)
+from bot.exchange import periods_per_year
+from core.kernel import NodeCache
+from core.store import CandleReader
+
+logger = logging.getLogger("reoptimize")
+
+
+@dataclass
+class ReoptimizeConfig:
+    """ReoptimizeConfig class.
+
+    The sweep runs every interval seconds when the store has new candles.  The
+    process runs at the given nice level, on the given cpus when set, and
+    sleeps as needed to use at most cpu_share of one CPU.  The swept window
+    grows with the new candles up to window_slack candles over the candle_count
+    of the chart config before it starts over, see SweepWindow.
+    """
+
+    interval: int = 3600
+    nice: int = 19
+    cpu_share: float = 0.5
+    cpus: list[int] | None = None
+    log_file: str = "reoptimize.log"
+    window_slack: int = 1000
+
+
+class Throttle:
+    """Cap the CPU time of the calling process to a share of the wall time."""
+
+    def __init__(self, cpu_share: float):
+        """Initialize a Throttle object."""
+        self.cpu_share = cpu_share
+        self.cpu_start = process_time()
+        self.wall_start = perf_counter()
+
+    def pause(self) -> None:
+        """Sleep until the CPU time used so far is within the share."""
+        if self.cpu_share >= 1:
+            return
+        target = (process_time() - self.cpu_start) / self.cpu_share
+        behind = target - (perf_counter() - self.wall_start)
+        if behind > 0:
+            sleep(behind)
+
+
+class SweepWindow:
+    """The candles the sweeps of a re-optimizer run over and their NodeCache.
+
+    The window starts at a fixed row of the store and the cache lives across
+    sweeps, so the Heikin Ashi and WMA columns are only computed for the candles
+    appended since the last sweep, see NodeCache.extend.  Once the window is
+    more than slack candles longer than candle_count it starts over at the
+    last candle_count candles with an empty cache.
+    """
+
+    def __init__(self, store_path: str, candle_count: int, slack: int):
+        """Initialize a SweepWindow object."""
+        self.store_path = store_path
+        self.candle_count = candle_count
+        self.slack = slack
+        self.cache = NodeCache()
+        self.start = -1
+        self.end = 0
+
+    def columns(self) -> dict[str, np.ndarray]:
+        """Return the candle columns of the window, extended to the latest candles."""
+        reader = CandleReader(self.store_path)
+        count = len(reader)
+        too_long = count - self.start > self.candle_count + self.slack
+        if self.start < 0 or count < self.end or too_long:
+            self.start = max(0, count - self.candle_count)
+            self.end = self.start
+            self.cache.clear()
+        # the bot may have appended candles since len
+        columns = reader.columns(self.start)
+        end = self.start + len(next(iter(columns.values())))
+        if end > self.end:
+            self.cache.extend(columns)
+        self.end = end
+        return columns
+
+
+def sweep(
+    chart_conf: ChartConfig, config: ReoptimizeConfig, window: SweepWindow
+) -> list[tuple[SignalConfig, Record]]:
+    """Run the exhaustive grid over the latest candles of the store.
+
+    The candles are read straight from the store the bot appends to, and the
+    Heikin Ashi, WMA and signal nodes are shared between combinations through
+    the NodeCache of the window.
+
+    Returns
+    -------
+    list[tuple[SignalConfig, Record]]
+        The best SWEEP_SIZE winning combinations by chart_conf.rank_by, best
+        first.
+
+    """
+    columns = window.columns()
+    cache = window.cache
+    hits, misses = cache.hits, cache.misses
+    candles_per_year = periods_per_year(chart_conf.granularity)
+    throttle = Throttle(config.cpu_share)
+    results: list[tuple[float, int, SignalConfig, Record]] = []
+    found = 0
+    for i, (signal_conf, kernel_conf) in enumerate(
+        grid_combinations(chart_conf.wma_period)
+    ):
+        rec = run_record(columns, kernel_conf, cache, candles_per_year)
+        if rec.losses - 1 <= rec.wins:
+            found += 1
+            keep_in_sweep(results, found, signal_conf, rec, chart_conf.rank_by)
+        if i % 256 == 0:
+            throttle.pause()
+    logger.info(
+        "swept %s candles, %s winning combinations, node cache hits: %s misses: %s "
+        "unique signals: %s of %s",
+        len(next(iter(columns.values()))),
+        found,
+        cache.hits - hits,
+        cache.misses - misses,
+        *cache.signal_counts(),
+    )
+    return ranked_sweep(results)
+
+
+def limit_cpu(config: ReoptimizeConfig) -> None:
+    """Lower the priority of the current process and pin it to config.cpus."""
+    os.nice(config.nice)
+    if config.cpus is not None and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, config.cpus)
+
+
+def run_reoptimizer(config: ReoptimizeConfig, chart_conf: ChartConfig) -> None:
+    """Sweep whenever the interval passed and new candles were stored, forever."""
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s|%(levelname)s|%(name)s|%(message)s",
+        handlers=[logging.FileHandler(config.log_file)],
+    )
+    limit_cpu(config)
+    start_time = datetime.now()
+    window = SweepWindow(
+        chart_conf.store_path, chart_conf.candle_count, config.window_slack
+    )
+    last_count = -1
+    while True:
+        start = perf_counter()
+        try:
+            count = len(CandleReader(chart_conf.store_path))
+            if count > last_count:
+                with PerfTimer(start_time, logger):
+                    results = sweep(chart_conf, config, window)
+                if len(results) > 0:
+                    save_sweep(chart_conf.sweep_path, results)
+                    logger.info("best %s %s", *results[0])
+                last_count = count
+        except Exception as err:
+            logger.error("reoptimize: %s", err)
+        sleep(max(0.0, config.interval - (perf_counter() - start)))
+
+
+class Reoptimizer:
+    """Run the sweep in a background process and pick up its results.
+
+    The process is started with spawn, so it shares no locks with the threads
+    of the bot, and runs at a low priority with a capped CPU share so it never
+    delays bot_run.  It reads the candles from the store the bot appends to and
+    publishes the results by replacing the sweep file, which the bot checks at
+    every candle boundary with poll.
+    """
+
+    def __init__(self, config: ReoptimizeConfig, chart_conf: ChartConfig):
+        """Initialize a Reoptimizer object."""
+        if chart_conf.store_path is None or chart_conf.sweep_path is None:
+            raise ValueError(
+                "re-optimization needs a store_path and a sweep_path in the chart config"
+            )
+        self.config = config
+        self.chart_conf = chart_conf
+        self.sweep_mtime = (
+            os.stat(chart_conf.sweep_path).st_mtime
+            if os.path.exists(chart_conf.sweep_path)
+            else 0.0
+        )
+        self.process = multiprocessing.get_context("spawn").Process(
+            target=run_reoptimizer,
+            args=(config, chart_conf),
+            name="reoptimize",
+            daemon=True,
+        )
+
+    def start(self) -> "Reoptimizer":
+        """Start the background process."""
+        self.process.start()
+        logger.info(
+            "re-optimizing every %ss in process %s", self.config.interval, self.process.pid
+        )
+        return self
+
+    def stop(self) -> None:
+        """Stop the background process."""
+        self.process.terminate()
+        self.process.join()
+
+    def poll(self, signal_conf: SignalConfig) -> SignalConfig:
+        """Return the best configuration of a new sweep, or signal_conf if there is none.
+
+        Only the modification time of the sweep file is checked when nothing
+        changed, so this is cheap enough to call at every candle boundary.
+        """
+        try:
+            mtime = os.stat(self.chart_conf.sweep_path).st_mtime
+        except FileNotFoundError:
+            return signal_conf
+        if mtime == self.sweep_mtime:
+            return signal_conf
+        self.sweep_mtime = mtime
+        best = load_sweep(self.chart_conf.sweep_path, 1)
+        if len(best) == 0 or best[0] == signal_conf:
+            return signal_conf
+        logger.info("switching signal config from %s to %s", signal_conf, best[0])
+        return best[0]
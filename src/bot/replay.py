@@ -0,0 +1,259 @@
+"""Record Oanda responses and replay the bot loop against them on a virtual clock."""
+
+import abc
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+import logging
+from time import perf_counter
+from typing import Any
+from urllib.parse import urlparse
+
+import orjson
+import requests
+from requests.adapters import BaseAdapter
+
+from bot.backtest import ChartConfig, SignalConfig
+from bot.bot import TradeConfig, bot_loop
+from bot.clock import WALL_CLOCK, Clock, VirtualClock
+from bot.exchange import OandaClient, OrderTemplate, Recorder
+from bot.mock_oanda import MockOandaState
+from bot.positions import PositionCache
+
+logger = logging.getLogger("replay")
+
+
+class ReplayMismatch(Exception):
+    """The bot sent a request the recording does not have at this point."""
+
+
+@dataclass
+class ReplayConfig:
+    """ReplayConfig class.
+
+    Without a replay_path the bot trades against a simulated exchange from
+    start (a UTC time) for days.  With a replay_path it trades against the
+    recorded responses until they run out.  record_path records every
+    response, so a simulated run can be replayed later.
+    """
+
+    start: str = "2024-02-01T00:00:00"
+    days: float = 30.0
+    seed: int = 0
+    record_path: str | None = None
+    replay_path: str | None = None
+
+
+@dataclass
+class ReplayResult:
+    """The outcome of a replay."""
+
+    cycles: int
+    virtual_days: float
+    seconds: float
+    # (virtual time, method, path) of every order and close request
+    orders: list[tuple[str, str, str]] = field(default_factory=list)
+    mismatches: list[str] = field(default_factory=list)
+
+
+def build_response(
+    request: requests.PreparedRequest, status: int, content: bytes
+) -> requests.Response:
+    """Build the response an HTTP adapter would return."""
+    resp = requests.Response()
+    resp.status_code = status
+    resp._content = content
+    resp.headers["Content-Type"] = "application/json"
+    resp.encoding = "utf-8"
+    resp.url = request.url or ""
+    resp.request = request
+    return resp
+
+
+class _LocalAdapter(BaseAdapter, abc.ABC):
+    """A requests transport answering in process, noting every order."""
+
+    def __init__(self, clock: Clock):
+        """Initialize a _LocalAdapter object."""
+        super().__init__()
+        self.clock = clock
+        self.orders: list[tuple[str, str, str]] = []
+
+    @abc.abstractmethod
+    def answer(self, request: requests.PreparedRequest) -> tuple[int, bytes]:
+        """Return the status code and the encoded body answering a request."""
+
+    def send(self, request: requests.PreparedRequest, **kwargs: Any) -> requests.Response:
+        """Answer a request."""
+        if request.method != "GET":
+            self.orders.append(
+                (
+                    self.clock.now().isoformat(),
+                    request.method or "",
+                    urlparse(request.url).path,
+                )
+            )
+        return build_response(request, *self.answer(request))
+
+    def close(self) -> None:
+        """Nothing to release."""
+
+
+class MockAdapter(_LocalAdapter):
+    """Serve requests from a MockOandaState without sockets or threads."""
+
+    def __init__(self, state: MockOandaState, clock: Clock):
+        """Initialize a MockAdapter object."""
+        super().__init__(clock)
+        self.state = state
+
+    def answer(self, request: requests.PreparedRequest) -> tuple[int, bytes]:
+        """Route the request to the mock state."""
+        body = orjson.loads(request.body) if request.body else None
+        status, response = self.state.respond(
+            request.method or "GET", request.path_url, body
+        )
+        return status, orjson.dumps(response)
+
+
+class ReplayAdapter(_LocalAdapter):
+    """Answer requests with recorded responses, in the recorded order.
+
+    Every request must match the method and URL of one of the next lookahead
+    recordings, so any difference in the decisions of the bot shows up as a
+    ReplayMismatch.  The lookahead allows for the requests a live bot sent
+    concurrently, see OandaClient.gather, which are recorded in the order they
+    completed.
+    """
+
+    def __init__(self, path: str, clock: Clock, lookahead: int = 4):
+        """Initialize a ReplayAdapter object."""
+        super().__init__(clock)
+        with open(path, "rb") as f:
+            self.exchanges = deque(orjson.loads(line) for line in f if line.strip())
+        self.lookahead = lookahead
+        self.mismatches: list[str] = []
+
+    def answer(self, request: requests.PreparedRequest) -> tuple[int, bytes]:
+        """Pop the first of the next recorded responses that answers this request."""
+        if len(self.exchanges) == 0:
+            raise ReplayMismatch(f"no recorded response left for {request.path_url}")
+        for i in range(min(self.lookahead, len(self.exchanges))):
+            exchange = self.exchanges[i]
+            if (
+                exchange["method"] == request.method
+                and exchange["url"] == request.path_url
+            ):
+                del self.exchanges[i]
+                return exchange["status"], exchange["body"].encode()
+
+        exchange = self.exchanges.popleft()
+        message = (
+            f"{self.clock.now().isoformat()} expected {exchange['method']} "
+            f"{exchange['url']}, got {request.method} {request.path_url}"
+        )
+        self.mismatches.append(message)
+        raise ReplayMismatch(message)
+
+
+def replay(
+    chart_conf: ChartConfig,
+    signal_conf: SignalConfig,
+    trade_conf: TradeConfig,
+    config: ReplayConfig,
+) -> ReplayResult:
+    """Run the bot loop on a virtual clock against a local stand-in for Oanda.
+
+    The loop is the one bot runs, but sleep only moves the clock forward and
+    there is no transaction stream, so the open trades come from order
+    responses and reconciles alone.  With the same inputs every run sends the
+    same requests and makes the same trades.
+
+    Parameters
+    ----------
+    chart_conf : ChartConfig
+        The chart configuration, the simulated exchange serves candles of its
+        granularity.
+    signal_conf : SignalConfig
+        The signal configuration.
+    trade_conf : TradeConfig
+        The trade configuration.
+    config : ReplayConfig
+        What to replay against and for how long.
+
+    Returns
+    -------
+    ReplayResult
+        The number of cycles, the virtual and wall time taken, the orders sent
+        and the requests that did not match the recording.
+
+    """
+    if config.replay_path is not None:
+        replay_adapter = ReplayAdapter(config.replay_path, WALL_CLOCK)
+        if len(replay_adapter.exchanges) == 0:
+            raise ValueError(f"{config.replay_path} has no recorded responses")
+        start = datetime.fromisoformat(replay_adapter.exchanges[0]["time"])
+        # the last recorded cycle runs before the clock passes its time
+        until = datetime.fromisoformat(replay_adapter.exchanges[-1]["time"])
+        until += timedelta(seconds=1)
+        clock = VirtualClock(start)
+        replay_adapter.clock = clock
+        adapter: _LocalAdapter = replay_adapter
+    else:
+        start = datetime.fromisoformat(config.start)
+        until = start + timedelta(days=config.days)
+        clock = VirtualClock(start)
+        state = MockOandaState(seed=config.seed, granularity=chart_conf.granularity)
+        # enough history before the start for the first window
+        state.start = (
+            start.replace(tzinfo=timezone.utc) - state.step * chart_conf.candle_count
+        )
+        state.advance_to(start)
+        clock.listeners.append(state.advance_to)
+        adapter = MockAdapter(state, clock)
+
+    # one worker, so the requests of a cycle are sent in a deterministic order
+    client = OandaClient(
+        "replay", "replay", chart_conf.instrument, ssl=False, pool_size=1, clock=clock
+    )
+    client.session.mount("http://", adapter)
+    recorder = (
+        Recorder(config.record_path, clock).attach(client.session)
+        if config.record_path is not None
+        else None
+    )
+    positions = PositionCache(client, clock=clock)
+    template = OrderTemplate(chart_conf.instrument, trade_conf.amount)
+
+    wall_start = perf_counter()
+    try:
+        cycles = bot_loop(
+            client,
+            positions,
+            template,
+            signal_conf,
+            chart_conf,
+            clock=clock,
+            until=until,
+        )
+    finally:
+        client.close()
+        if recorder is not None:
+            recorder.close()
+
+    result = ReplayResult(
+        cycles=cycles,
+        virtual_days=(clock.now() - start) / timedelta(days=1),
+        seconds=perf_counter() - wall_start,
+        orders=adapter.orders,
+        mismatches=getattr(adapter, "mismatches", []),
+    )
+    logger.info(
+        "replayed %s cycles, %.1f virtual days in %.1fs, %s orders, %s mismatches",
+        result.cycles,
+        result.virtual_days,
+        result.seconds,
+        len(result.orders),
+        len(result.mismatches),
+    )
+    return result
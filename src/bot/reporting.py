@@ -1,9 +1,13 @@
 """Functions for reporting trading results."""
 
-from datetime import timedelta
+import numpy as np
 import pandas as pd
 import logging
 
+from bot.exchange import granularity_ns
+from core.calc import ledger_totals, trade_ledger
+from core.store import to_epoch_ns
+
 
 logger = logging.getLogger("reporting")
 
@@ -15,6 +19,8 @@ def report(
     df: pd.DataFrame,
     signal_buy_column: str,
     signal_exit_column: str,
+    ledger: np.ndarray | None = None,
+    granularity: str = "M5",
 ):
     """Print a report of the trading results.
 
@@ -26,8 +32,50 @@ def report(
         The column name for the buy signal data.
     signal_exit_column : str
         The column name for the exit signal data.
+    ledger : np.ndarray | None, optional
+        The trade ledger of df, as set on a CandleFrame by the kernel.  It is
+        computed from df when None.
+    granularity : str, optional
+        The Oanda granularity of the candles, to print when each one completed.
 
     """
+    # only the rows that are printed are formatted
+    if logger.isEnabledFor(logging.INFO):
+        if ledger is None:
+            ledger = trade_ledger(df)
+        # the entry and exit rows of the last 12 trades hold the last 12 triggers
+        recent = ledger[-12:]
+        rows = np.concatenate([recent["entry_index"], recent["exit_index"]])
+        rows = np.sort(rows[rows >= 0])[-12:]
+        totals = ledger_totals(ledger)
+        logger.info(
+            "recent trades, trades: %s wins: %s losses: %s total: %s",
+            len(ledger),
+            totals["wins"],
+            totals["losses"],
+            round(totals["exit_total"], 5),
+        )
+        logger.info(
+            "\n" + format_ticks(
+                df.iloc[rows], signal_buy_column, signal_exit_column, granularity
+            )
+        )
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("current status")
+        logger.debug(
+            "\n" + format_ticks(
+                df.tail(6), signal_buy_column, signal_exit_column, granularity
+            )
+        )
+
+
+def format_ticks(
+    df: pd.DataFrame,
+    signal_buy_column: str,
+    signal_exit_column: str,
+    granularity: str = "M5",
+) -> str:
+    """Format kernel rows as a table with the time each candle completed."""
     df_ticks = df.reset_index()[
         [
             "timestamp",
@@ -45,22 +93,10 @@ def report(
             "exit_total",
         ]
     ]
-    df_ticks["timestamp"] = pd.to_datetime(df_ticks["timestamp"])
-    df_ticks["completed_datetime"] = (
-        (timedelta(minutes=5) + df_ticks["timestamp"]).dt
-    ).strftime("%Y-%m-%d %H:%M:%S")
-    df_ticks.drop("timestamp", axis=1, inplace=True)
-    df_orders = df_ticks.copy()
-    df_orders = df_orders[df_orders["trigger"] != 0]
-    logger.info("recent trades")
-    logger.info(
-        "\n"
-        + df_orders.tail(12)
-        .round(4)
-        .to_string(index=False, header=True, justify="left")
-    )
-    logger.debug("current status")
-    logger.debug(
-        "\n"
-        + df_ticks.tail(6).round(4).to_string(index=False, header=True, justify="left")
+    # a candle completes one granularity after its epoch nanosecond timestamp
+    completed = to_epoch_ns(df_ticks["timestamp"]) + granularity_ns(granularity)
+    df_ticks["completed_datetime"] = pd.to_datetime(completed, utc=True).strftime(
+        "%Y-%m-%d %H:%M:%S"
     )
+    df_ticks.drop("timestamp", axis=1, inplace=True)
+    return df_ticks.round(4).to_string(index=False, header=True, justify="left")
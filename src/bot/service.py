@@ -0,0 +1,464 @@
+"""Serve backtest sweeps over HTTP from a pool of warm worker processes."""
+
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import asdict, dataclass, field
+from functools import partial
+import hashlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import logging
+import multiprocessing
+import os
+import threading
+from time import time
+from typing import Any
+import uuid
+
+import numpy as np
+import orjson
+
+from bot.backtest import (
+    ChartConfig,
+    Record,
+    SignalConfig,
+    grid_combinations,
+    grid_size,
+    keep_in_sweep,
+    ranked_sweep,
+    run_record,
+    sweep_entry,
+)
+from bot.constants import SL, SOURCE_COLUMNS, TP
+from bot.exchange import periods_per_year
+from bot.synthetic import SyntheticConfig, iter_candles
+from core.kernel import KernelConfig, NodeCache
+from core.store import CANDLE_COLUMNS, CandleReader
+
+logger = logging.getLogger("service")
+
+
+@dataclass
+class ServiceConfig:
+    """ServiceConfig class.
+
+    workers processes run the jobs, all cores when None, and every job is split
+    into chunks of chunk_size combinations.  The results of the last
+    cache_size distinct jobs are kept.
+    """
+
+    host: str = "127.0.0.1"
+    port: int = 8060
+    workers: int | None = None
+    chunk_size: int = 1024
+    cache_size: int = 128
+
+
+@dataclass
+class GridConfig:
+    """The combinations a job sweeps, the grid of the backtest by default.
+
+    Every wma period of wma_periods is swept, only the wma_period of the chart
+    config when None.
+    """
+
+    source_columns: list[str] = field(default_factory=lambda: list(SOURCE_COLUMNS))
+    take_profits: list[float] = field(default_factory=lambda: list(TP))
+    stop_losses: list[float] = field(default_factory=lambda: list(SL))
+    wma_periods: list[int] | None = None
+
+
+@dataclass
+class Job:
+    """A backtest sweep and its progress."""
+
+    id: str
+    key: str
+    chart_conf: ChartConfig
+    total: int
+    top_k: int
+    submitted: float
+    status: str = "queued"
+    cached: bool = False
+    done: int = 0
+    found: int = 0
+    chunks: int = 0
+    started: float | None = None
+    finished: float | None = None
+    error: str | None = None
+    sweep: list[tuple[float, int, SignalConfig, Record]] = field(default_factory=list)
+    results: list[dict] | None = None
+
+    def summary(self) -> dict[str, Any]:
+        """Return the status and progress of the job."""
+        end = self.finished if self.finished is not None else time()
+        elapsed = end - self.started if self.started is not None else 0.0
+        return {
+            "id": self.id,
+            "status": self.status,
+            "cached": self.cached,
+            "done": self.done,
+            "total": self.total,
+            "progress": self.done / self.total if self.total > 0 else 1.0,
+            "found": self.found,
+            "elapsed": round(elapsed, 3),
+            "combinations_per_second": round(self.done / elapsed) if elapsed > 0 else None,
+            "error": self.error,
+        }
+
+
+# the candle window a worker swept last and its shared nodes
+_WINDOW: tuple[tuple[str, int, int], dict[str, np.ndarray], NodeCache] | None = None
+
+
+def warm_worker() -> None:
+    """Import and compile everything a job needs when a worker starts."""
+    _, block = next(iter_candles(SyntheticConfig(rows=300, seed=0)))
+    columns = {name: block[i] for i, name in enumerate(CANDLE_COLUMNS)}
+    cache = NodeCache()
+    candles_per_year = periods_per_year("M5")
+    # one configuration through every op of the kernel pipeline
+    run_record(
+        columns,
+        KernelConfig("ha_bid_low", "ha_ask_high", "ha_close", 20, 0.1, 0.05),
+        cache,
+        candles_per_year,
+    )
+    run_record(columns, KernelConfig("close", "close", "open", 20), cache, candles_per_year)
+
+
+def worker_pid() -> int:
+    """Return the pid of the worker, to start and warm every worker."""
+    return os.getpid()
+
+
+def window(store_path: str, start: int, end: int) -> tuple[dict[str, np.ndarray], NodeCache]:
+    """Return the candle columns of rows start to end and the NodeCache for them.
+
+    A worker keeps the window it swept last, so the Heikin Ashi, WMA and signal
+    nodes are shared between every chunk and job over the same candles.
+    """
+    global _WINDOW
+    key = (store_path, start, end)
+    if _WINDOW is None or _WINDOW[0] != key:
+        columns = CandleReader(store_path).columns(start)
+        _WINDOW = (
+            key,
+            {name: values[: end - start] for name, values in columns.items()},
+            NodeCache(),
+        )
+    return _WINDOW[1], _WINDOW[2]
+
+
+def run_chunk(
+    store_path: str,
+    start: int,
+    end: int,
+    first_seq: int,
+    combinations: list[tuple[SignalConfig, KernelConfig]],
+    rank_by: str,
+    candles_per_year: float,
+) -> tuple[list[tuple[float, int, SignalConfig, Record]], int, float]:
+    """Run a chunk of a job in a worker.
+
+    candles_per_year annualizes the metrics, see bot.exchange.periods_per_year.
+
+    Returns
+    -------
+    tuple
+        The best winning combinations of the chunk as keep_in_sweep entries,
+        the number of winning combinations and the time the chunk started.
+
+    """
+    started = time()
+    columns, cache = window(store_path, start, end)
+    sweep: list[tuple[float, int, SignalConfig, Record]] = []
+    found = 0
+    for i, (signal_conf, kernel_conf) in enumerate(combinations):
+        rec = run_record(columns, kernel_conf, cache, candles_per_year)
+        if rec.losses - 1 <= rec.wins:
+            found += 1
+            keep_in_sweep(sweep, first_seq + i, signal_conf, rec, rank_by)
+    return sweep, found, started
+
+
+class JobService:
+    """Queue backtest jobs on a pool of warm worker processes.
+
+    The workers are spawned and warmed up front, so a job pays neither the
+    imports nor the numba compilation of a CLI backtest.  Every job reads its
+    candles from the candle store of its chart config, and identical jobs over
+    an unchanged store are answered from the result cache.
+    """
+
+    def __init__(self, config: ServiceConfig):
+        """Initialize a JobService object."""
+        self.config = config
+        self.workers = config.workers or os.cpu_count() or 1
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=warm_worker,
+        )
+        self.jobs: dict[str, Job] = {}
+        self.cache: OrderedDict[str, list[dict]] = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.completed = 0
+        self.combinations = 0
+        self.busy = 0.0
+        self.server = ServiceServer(self, config.host, config.port)
+
+    def start(self) -> "JobService":
+        """Start and warm every worker, then serve the API."""
+        futures = [self.executor.submit(worker_pid) for _ in range(self.workers)]
+        pids = sorted({future.result() for future in futures})
+        self.server.start()
+        logger.info(
+            "backtest service on http://%s:%s with %s warm workers %s",
+            self.config.host,
+            self.server.port,
+            len(pids),
+            pids,
+        )
+        return self
+
+    def stop(self) -> None:
+        """Stop serving and shut the workers down."""
+        self.server.stop()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def submit(self, request: dict[str, Any]) -> Job:
+        """Queue a job, or answer it from the cache.
+
+        Parameters
+        ----------
+        request : dict
+            The chart_config, with a store_path, and optionally a grid, see
+            GridConfig, and the number of results top_k.
+
+        """
+        chart_conf = ChartConfig(**request["chart_config"])
+        if chart_conf.store_path is None:
+            raise ValueError("a job needs a store_path in the chart config")
+        candles_per_year = periods_per_year(chart_conf.granularity)
+        grid = GridConfig(**(request.get("grid") or {}))
+        top_k = int(request.get("top_k", 10))
+
+        # the complete candles of the window, like backtest reads them
+        reader = CandleReader(chart_conf.store_path)
+        end = len(reader) - 1
+        start = max(0, end + 1 - chart_conf.candle_count)
+        if end - start < 1:
+            raise ValueError(f"{chart_conf.store_path} has too few candles")
+        last_time = int(reader.timestamps(end - 1)[0])
+        key = hashlib.sha1(
+            orjson.dumps(
+                {
+                    "chart_config": asdict(chart_conf),
+                    "grid": asdict(grid),
+                    "top_k": top_k,
+                    "window": [start, end, last_time],
+                },
+                option=orjson.OPT_SORT_KEYS,
+            )
+        ).hexdigest()
+
+        periods = grid.wma_periods or [chart_conf.wma_period]
+        total = len(periods) * grid_size(
+            grid.source_columns, grid.take_profits, grid.stop_losses
+        )
+        job = Job(uuid.uuid4().hex[:12], key, chart_conf, total, top_k, time())
+        with self.lock:
+            self.jobs[job.id] = job
+            if key in self.cache:
+                self.hits += 1
+                self.cache.move_to_end(key)
+                job.results = self.cache[key]
+                job.status = "done"
+                job.cached = True
+                job.done = total
+                job.started = job.finished = job.submitted
+                return job
+            self.misses += 1
+
+        chunk: list[tuple[SignalConfig, KernelConfig]] = []
+        seq = 0
+        chunks = []
+        for period in periods:
+            for signal_conf, kernel_conf in grid_combinations(
+                period, grid.source_columns, grid.take_profits, grid.stop_losses
+            ):
+                if grid.wma_periods is not None:
+                    signal_conf.wma_period = period
+                chunk.append((signal_conf, kernel_conf))
+                if len(chunk) == self.config.chunk_size:
+                    chunks.append((seq, chunk))
+                    seq += len(chunk)
+                    chunk = []
+        if len(chunk) > 0:
+            chunks.append((seq, chunk))
+        job.chunks = len(chunks)
+        for first_seq, combinations in chunks:
+            future = self.executor.submit(
+                run_chunk,
+                chart_conf.store_path,
+                start,
+                end,
+                first_seq,
+                combinations,
+                chart_conf.rank_by,
+                candles_per_year,
+            )
+            future.add_done_callback(partial(self.chunk_done, job, len(combinations)))
+        logger.info("job %s: %s combinations in %s chunks", job.id, total, len(chunks))
+        return job
+
+    def chunk_done(self, job: Job, size: int, future: Future) -> None:
+        """Merge the results of a chunk into its job."""
+        with self.lock:
+            if job.status == "failed":
+                return
+            if future.cancelled() or future.exception() is not None:
+                job.status = "failed"
+                job.error = "cancelled" if future.cancelled() else str(future.exception())
+                job.finished = time()
+                logger.error("job %s failed: %s", job.id, job.error)
+                return
+            entries, found, started = future.result()
+            job.status = "running"
+            job.started = started if job.started is None else min(job.started, started)
+            for _, seq, signal_conf, rec in entries:
+                keep_in_sweep(job.sweep, -seq, signal_conf, rec, job.chart_conf.rank_by)
+            job.found += found
+            job.done += size
+            job.chunks -= 1
+            if job.chunks > 0:
+                return
+
+            job.results = [
+                sweep_entry(signal_conf, rec)
+                for signal_conf, rec in ranked_sweep(job.sweep)[: job.top_k]
+            ]
+            job.sweep = []
+            job.status = "done"
+            job.finished = time()
+            self.completed += 1
+            self.combinations += job.total
+            self.busy += job.finished - job.started
+            self.cache[job.key] = job.results
+            while len(self.cache) > self.config.cache_size:
+                self.cache.popitem(last=False)
+        logger.info("job %s done %s", job.id, job.summary())
+
+    def job(self, job_id: str) -> dict[str, Any] | None:
+        """Return the progress and, once done, the results of a job."""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            return {**job.summary(), "results": job.results}
+
+    def stats(self) -> dict[str, Any]:
+        """Return the state of the queue, the cache and the throughput."""
+        with self.lock:
+            statuses = [job.status for job in self.jobs.values()]
+            return {
+                "workers": self.workers,
+                "queued": statuses.count("queued"),
+                "running": statuses.count("running"),
+                "done": statuses.count("done"),
+                "failed": statuses.count("failed"),
+                "cache_hits": self.hits,
+                "cache_misses": self.misses,
+                "cached_results": len(self.cache),
+                "combinations": self.combinations,
+                "combinations_per_second": (
+                    round(self.combinations / self.busy) if self.busy > 0 else None
+                ),
+            }
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    """Route the JSON API of a JobService.
+
+    POST /jobs queues a job, GET /jobs lists the jobs, GET /jobs/<id> returns
+    the progress and results of a job and GET /stats the service statistics.
+    """
+
+    server: "ServiceServer"
+
+    def log_message(self, format: str, *args: Any) -> None:
+        """Log requests at debug level instead of stderr."""
+        logger.debug(format, *args)
+
+    def send_json(self, status: int, data: Any) -> None:
+        """Send a JSON response, NaNs become null."""
+        body = orjson.dumps(data, option=orjson.OPT_SERIALIZE_NUMPY)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        """Return jobs and statistics."""
+        service = self.server.service
+        parts = self.path.strip("/").split("/")
+        if parts == ["stats"]:
+            self.send_json(200, service.stats())
+        elif parts == ["jobs"]:
+            with service.lock:
+                jobs = [job.summary() for job in service.jobs.values()]
+            self.send_json(200, jobs)
+        elif len(parts) == 2 and parts[0] == "jobs":
+            job = service.job(parts[1])
+            if job is None:
+                self.send_json(404, {"error": f"no job {parts[1]}"})
+            else:
+                self.send_json(200, job)
+        else:
+            self.send_json(404, {"error": "not found"})
+
+    def do_POST(self) -> None:
+        """Queue a job."""
+        if self.path.strip("/") != "jobs":
+            self.send_json(404, {"error": "not found"})
+            return
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            job = self.server.service.submit(orjson.loads(self.rfile.read(length)))
+        except (KeyError, TypeError, ValueError, OSError) as err:
+            self.send_json(400, {"error": str(err)})
+            return
+        self.send_json(200 if job.cached else 202, job.summary())
+
+
+class ServiceServer(ThreadingHTTPServer):
+    """A threaded HTTP server holding a JobService."""
+
+    daemon_threads = True
+
+    def __init__(self, service: JobService, host: str = "127.0.0.1", port: int = 0):
+        """Initialize a ServiceServer object, port 0 picks a free port."""
+        super().__init__((host, port), ServiceHandler)
+        self.service = service
+        self.thread: threading.Thread | None = None
+
+    @property
+    def port(self) -> int:
+        """Return the port the server is bound to."""
+        return self.server_address[1]
+
+    def start(self) -> "ServiceServer":
+        """Serve requests on a background thread."""
+        self.thread = threading.Thread(
+            target=self.serve_forever, name="service_server", daemon=True
+        )
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Stop serving and close the socket."""
+        self.shutdown()
+        self.server_close()
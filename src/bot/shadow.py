@@ -0,0 +1,152 @@
+"""Paper trade the best configurations of the latest sweep next to the live bot."""
+
+from dataclasses import dataclass
+import logging
+import os
+from time import perf_counter
+
+import numpy as np
+
+from bot.backtest import ChartConfig, SignalConfig, load_sweep
+from core.calc import ASK_COLUMN, BID_COLUMN
+from core.frame import CandleFrame
+from core.kernel import KernelConfig, Pipeline
+
+logger = logging.getLogger("shadow")
+
+
+@dataclass
+class ShadowConfig:
+    """ShadowConfig class.
+
+    top_k is the number of sweep configurations paper traded and summary the
+    number of leading configurations logged every candle.
+    """
+
+    top_k: int = 100
+    summary: int = 5
+
+
+@dataclass
+class PaperTrades:
+    """The paper trades of one configuration since the bot started."""
+
+    entry: float = np.nan
+    pnl: float = 0.0
+    trades: int = 0
+    wins: int = 0
+    losses: int = 0
+
+    @property
+    def is_open(self) -> bool:
+        """Return whether a paper trade is open."""
+        return not np.isnan(self.entry)
+
+
+class ShadowTrader:
+    """Evaluate the top configurations of a sweep on every new candle.
+
+    All configurations run through one Pipeline, so the Heikin Ashi, WMA and
+    signal nodes they have in common are computed once per candle and only the
+    position stages are computed per configuration.  A configuration enters on
+    a trigger of 1 at the ask and exits on a trigger of -1 at the bid, like the
+    live bot, but no order is ever sent.  The sweep file is reloaded whenever a
+    backtest replaces it.
+    """
+
+    def __init__(self, config: ShadowConfig, chart_conf: ChartConfig):
+        """Initialize a ShadowTrader object."""
+        if chart_conf.sweep_path is None:
+            raise ValueError("shadow trading needs a sweep_path in the chart config")
+        self.config = config
+        self.chart_conf = chart_conf
+        self.signal_confs: list[SignalConfig] = []
+        self.paper: list[PaperTrades] = []
+        self.pipeline = Pipeline({})
+        self.sweep_mtime = 0.0
+        self.last_time: int | None = None
+
+    def reload(self) -> None:
+        """Load the sweep when the file changed, resetting the paper trades.
+
+        Until a backtest writes the sweep file there is nothing to load, and the
+        configurations of a sweep file that was removed keep being traded.
+        """
+        if not os.path.exists(self.chart_conf.sweep_path):
+            return
+        mtime = os.stat(self.chart_conf.sweep_path).st_mtime
+        if mtime == self.sweep_mtime:
+            return
+        self.signal_confs = load_sweep(self.chart_conf.sweep_path, self.config.top_k)
+        self.paper = [PaperTrades() for _ in self.signal_confs]
+        self.pipeline = Pipeline.from_configs(
+            {
+                str(i): KernelConfig(
+                    signal_buy_column=signal_conf.signal_buy_column,
+                    signal_exit_column=signal_conf.signal_exit_column,
+                    source_column=signal_conf.source_column,
+                    wma_period=signal_conf.wma_period or self.chart_conf.wma_period,
+                    stop_loss=signal_conf.stop_loss,
+                    take_profit=signal_conf.take_profit,
+                )
+                for i, signal_conf in enumerate(self.signal_confs)
+            }
+        )
+        self.sweep_mtime = mtime
+        logger.info(
+            "paper trading %s configurations, %s pipeline nodes",
+            len(self.signal_confs),
+            len(self.pipeline.order),
+        )
+
+    def run(self, frame: CandleFrame) -> None:
+        """Paper trade the last complete candle of the frame, once per candle.
+
+        Parameters
+        ----------
+        frame : CandleFrame
+            The candle window, the last candle is still forming.
+
+        """
+        frame = frame.head(-1)
+        if len(frame) == 0 or frame.index[-1] == self.last_time:
+            return
+        self.last_time = int(frame.index[-1])
+        start = perf_counter()
+        self.reload()
+
+        outputs = self.pipeline.run(frame.columns)
+        ask = float(frame[ASK_COLUMN][-1])
+        bid = float(frame[BID_COLUMN][-1])
+        for i, (signal_conf, paper) in enumerate(zip(self.signal_confs, self.paper)):
+            trigger = outputs[str(i)]["trigger"][-1]
+            if trigger == 1 and not paper.is_open:
+                paper.entry = ask
+                logger.info("paper open #%s %s at %s", i, signal_conf, ask)
+            elif trigger == -1 and paper.is_open:
+                pnl = bid - paper.entry
+                paper.pnl += pnl
+                paper.trades += 1
+                paper.wins += pnl > 0
+                paper.losses += pnl < 0
+                paper.entry = np.nan
+                logger.info(
+                    "paper close #%s %s at %s pnl %s total %s",
+                    i, signal_conf, bid, round(pnl, 5), round(paper.pnl, 5),
+                )
+
+        ranked = sorted(
+            range(len(self.paper)), key=lambda i: self.paper[i].pnl, reverse=True
+        )
+        for i in ranked[: self.config.summary]:
+            paper = self.paper[i]
+            logger.info(
+                "paper #%s pnl:%s trades:%s wins:%s losses:%s open:%s %s",
+                i, round(paper.pnl, 5), paper.trades, paper.wins, paper.losses,
+                paper.is_open, self.signal_confs[i],
+            )
+        logger.debug(
+            "paper traded %s configurations in %.3f ms",
+            len(self.paper),
+            (perf_counter() - start) * 1000,
+        )
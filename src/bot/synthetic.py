@@ -0,0 +1,221 @@
+"""Generate synthetic market data in the formats the exchange functions return."""
+
+from dataclasses import dataclass
+import logging
+from typing import Iterator
+
+import numpy as np
+import pandas as pd
+
+from bot.exchange import NS_PER_SECOND, OHLC_COLUMNS
+from core.store import CandleWriter
+
+logger = logging.getLogger("synthetic")
+
+NS_PER_HOUR = 3600 * NS_PER_SECOND
+NS_PER_DAY = 24 * NS_PER_HOUR
+
+
+@dataclass
+class SyntheticConfig:
+    """SyntheticConfig class.
+
+    drift and volatility are the mean and standard deviation of the log return
+    per candle.  spread is the absolute ask - bid distance and spread_jitter its
+    relative standard deviation.  gap_probability drops candles at random and
+    weekend_gaps removes the Friday 21:00 to Sunday 21:00 UTC close.
+    """
+
+    rows: int = 5000
+    start: str = "2024-01-01"
+    granularity_seconds: int = 300
+    price: float = 150.0
+    drift: float = 0.0
+    volatility: float = 0.0005
+    spread: float = 0.01
+    spread_jitter: float = 0.0
+    gap_probability: float = 0.0
+    weekend_gaps: bool = False
+    decimals: int = 3
+    seed: int | None = None
+    chunk_size: int = 1_000_000
+
+
+def _is_closed(times: np.ndarray) -> np.ndarray:
+    """Return which epoch-nanosecond times fall in the weekend close."""
+    days = times // NS_PER_DAY
+    weekday = (days + 3) % 7  # 1970-01-01 was a Thursday, Monday is 0
+    hour = (times % NS_PER_DAY) // NS_PER_HOUR
+    return ((weekday == 4) & (hour >= 21)) | (weekday == 5) | (
+        (weekday == 6) & (hour < 21)
+    )
+
+
+def iter_candles(config: SyntheticConfig) -> Iterator[tuple[np.ndarray, np.ndarray]]:
+    """Generate candles in chunks.
+
+    Each random stream has its own generator spawned from the seed and is
+    consumed in order, so the random draws only depend on the seed and not on
+    the chunk size.  Prices can differ in the last bit between chunk sizes since
+    the cumulative returns restart at every chunk, which the rounding to
+    decimals normally hides.
+
+    Yields
+    ------
+    tuple[np.ndarray, np.ndarray]
+        Epoch-nanosecond timestamps and a (12 x rows) price block in the order
+        of OHLC_COLUMNS.
+
+    """
+    returns_rng, wick_rng, spread_rng, gap_rng = (
+        np.random.default_rng(s)
+        for s in np.random.SeedSequence(config.seed).spawn(4)
+    )
+    step = config.granularity_seconds * NS_PER_SECOND
+    next_time = pd.Timestamp(config.start, tz="UTC").value
+    last_close = config.price
+    emitted = 0
+
+    while emitted < config.rows:
+        n = min(config.chunk_size, config.rows - emitted)
+        times = next_time + step * np.arange(n, dtype=np.int64)
+        next_time += step * n
+        keep = np.ones(n, dtype=bool)
+        if config.weekend_gaps:
+            keep &= ~_is_closed(times)
+        if config.gap_probability > 0:
+            keep &= gap_rng.random(n) >= config.gap_probability
+        times = times[keep]
+        n = len(times)
+        if n == 0:
+            continue
+
+        log_returns = returns_rng.normal(config.drift, config.volatility, n)
+        closes = last_close * np.exp(np.cumsum(log_returns))
+        opens = np.concatenate(([last_close], closes[:-1]))
+        last_close = closes[-1]
+        wicks = np.abs(wick_rng.normal(0, config.volatility / 2, (n, 2)))
+        highs = np.maximum(opens, closes) * np.exp(wicks[:, 0])
+        lows = np.minimum(opens, closes) * np.exp(-wicks[:, 1])
+
+        spread = config.spread * np.maximum(
+            1 + spread_rng.normal(0, config.spread_jitter, n), 0
+        )
+        mid = np.stack([opens, highs, lows, closes])
+        block = np.concatenate([mid, mid - spread / 2, mid + spread / 2])
+
+        emitted += n
+        yield times, np.round(block, config.decimals)
+
+
+def _to_frame(
+    times: np.ndarray, block: np.ndarray, string_timestamps: bool
+) -> pd.DataFrame:
+    """Build a frame shaped like getOandaOHLC, with RFC3339 strings if string_timestamps."""
+    data = {
+        "timestamp": pd.to_datetime(times, utc=True).strftime(
+            "%Y-%m-%dT%H:%M:%S.000000000Z"
+        )
+        if string_timestamps
+        else times
+    }
+    for i, name in enumerate(OHLC_COLUMNS):
+        data[name] = block[i]
+    return pd.DataFrame(data)
+
+
+def iter_oanda_frames(
+    config: SyntheticConfig, string_timestamps: bool = False
+) -> Iterator[pd.DataFrame]:
+    """Stream candles as DataFrames in the schema getOandaOHLC returns.
+
+    The timestamps are int64 epoch nanoseconds like those of getOandaOHLC, or
+    the RFC3339 strings of the Oanda API with string_timestamps.
+    """
+    for times, block in iter_candles(config):
+        yield _to_frame(times, block, string_timestamps)
+
+
+def oanda_frame(config: SyntheticConfig, string_timestamps: bool = False) -> pd.DataFrame:
+    """Generate all candles as one DataFrame in the schema getOandaOHLC returns."""
+    return pd.concat(
+        iter_oanda_frames(config, string_timestamps), ignore_index=True
+    )
+
+
+def iter_swap_frames(
+    config: SyntheticConfig,
+    swaps_per_candle: float = 20.0,
+    mean_size: float = 1.0,
+    is_swapped: bool = False,
+) -> Iterator[pd.DataFrame]:
+    """Stream DEX swaps in the format core.chart.ohlc expects.
+
+    Swaps arrive as a Poisson process around the synthetic mid price.  A buy has
+    a negative amount0 and fills at the ask, a sell has a positive amount0 and
+    fills at the bid.
+
+    Parameters
+    ----------
+    config : SyntheticConfig
+        The configuration of the underlying price path.
+    swaps_per_candle : float, optional
+        The mean number of swaps per candle.
+    mean_size : float, optional
+        The mean size of a swap in token0.
+    is_swapped : bool, optional
+        Emit amount0 and amount1 swapped, to be read with isSwapped=True.
+
+    Yields
+    ------
+    pd.DataFrame
+        Swaps with a DatetimeIndex and the columns amount0 and amount1.
+
+    """
+    swap_rng = np.random.default_rng(
+        np.random.SeedSequence(config.seed).spawn(5)[4]
+    )
+    step = config.granularity_seconds * NS_PER_SECOND
+    for times, block in iter_candles(config):
+        counts = swap_rng.poisson(swaps_per_candle, len(times))
+        candle = np.repeat(np.arange(len(times)), counts)
+        total = len(candle)
+        if total == 0:
+            continue
+
+        # walk linearly from open to close within the candle
+        offset = swap_rng.random(total)
+        swap_times = times[candle] + (offset * step).astype(np.int64)
+        order = np.lexsort((swap_times, candle))
+        candle, offset, swap_times = candle[order], offset[order], swap_times[order]
+        mid = block[0, candle] + (block[3, candle] - block[0, candle]) * offset
+        half_spread = (block[8, candle] - block[4, candle]) / 2
+
+        buy = swap_rng.random(total) < 0.5
+        size = swap_rng.exponential(mean_size, total)
+        amount0 = np.where(buy, -size, size)
+        amount1 = np.where(buy, size * (mid + half_spread), -size * (mid - half_spread))
+
+        df = pd.DataFrame(
+            {"amount0": amount0, "amount1": amount1},
+            index=pd.DatetimeIndex(pd.to_datetime(swap_times), name="timestamp"),
+        )
+        if is_swapped:
+            df.rename(columns={"amount0": "amount1", "amount1": "amount0"}, inplace=True)
+        yield df
+
+
+def swap_frame(config: SyntheticConfig, **kwargs) -> pd.DataFrame:
+    """Generate all swaps as one DataFrame, see iter_swap_frames."""
+    return pd.concat(iter_swap_frames(config, **kwargs))
+
+
+def write_store(config: SyntheticConfig, path: str) -> int:
+    """Stream synthetic candles into a candle store without holding them in memory."""
+    writer = CandleWriter(path, capacity=max(config.rows, 1))
+    count = 0
+    for times, block in iter_candles(config):
+        count = writer.append(times, block)
+    writer.flush()
+    logger.info("wrote %s synthetic candles to %s", count, path)
+    return count
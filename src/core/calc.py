@@ -1,14 +1,49 @@
 """Functions for calculating trading signals."""
 
+from typing import Any, Sequence
+
 import pandas as pd
 import numpy as np
 import talib
+from numba import jit, prange  # type: ignore
+from numpy.typing import NDArray
+
+from core.frame import CandleFrame
 
 ASK_COLUMN = "ask_close"
 BID_COLUMN = "bid_close"
+METRIC_FIELDS = [
+    "exit_total",
+    "min_exit_total",
+    "wins",
+    "losses",
+    "trades",
+    "win_rate",
+    "gross_profit",
+    "gross_loss",
+    "profit_factor",
+    "avg_trade",
+    "avg_win",
+    "avg_loss",
+    "max_consecutive_losses",
+    "max_drawdown",
+    "sharpe",
+    "sortino",
+    "time_in_market",
+]
+# one row per trade, an open trade has an exit_index of -1 and a NaN exit
+TRADE_DTYPE = np.dtype(
+    [
+        ("entry_index", np.int64),
+        ("exit_index", np.int64),
+        ("entry_price", np.float64),
+        ("exit_price", np.float64),
+        ("pnl", np.float64),
+    ]
+)
 
 
-def exit_total(df: pd.DataFrame) -> None:
+def exit_total(df: pd.DataFrame | CandleFrame) -> None:
     """Calculate the cumulative total of all trades and the running total of the portfolio.
 
     Parameters
@@ -27,6 +62,21 @@ def exit_total(df: pd.DataFrame) -> None:
     is the cumulative total of the portfolio, including the current trade.
 
     """
+    if isinstance(df, CandleFrame):
+        (
+            df["exit_value"],
+            df["exit_total"],
+            df["wins"],
+            df["losses"],
+            df["min_exit_total"],
+        ) = exit_total_numpy(
+            df["position_value"],
+            df["trigger"],
+            np.array([0.0, 0.0, 0.0, 0.0, np.nan]),
+        )
+        df["running_total"] = df["exit_total"] + df["position_value"] * df["signal"]
+        return
+
     df["exit_value"] = df["position_value"] * ((df["trigger"] == -1).astype(int))
     df["exit_total"] = df["exit_value"].cumsum()
     df["running_total"] = df["exit_total"] + (df["position_value"] * df["signal"])
@@ -35,7 +85,48 @@ def exit_total(df: pd.DataFrame) -> None:
     df["min_exit_total"] = df["exit_total"].expanding().min()
 
 
-def take_profit(df: pd.DataFrame, take_profit: float) -> None:
+def trade_ledger(df: pd.DataFrame | CandleFrame) -> NDArray[Any]:
+    """Return the trades of a kernel output as a structured array of TRADE_DTYPE.
+
+    A trade enters on a trigger of 1 at the ask and exits on the next trigger of
+    -1 at the bid, its pnl is the exit_value of that row.  The indices are row
+    positions in df.
+    """
+    entry_index, exit_index, entry_price, exit_price, pnl = trade_ledger_numpy(
+        np.asarray(df["trigger"], dtype=np.int64),
+        np.asarray(df["position_value"], dtype=np.float64),
+        np.asarray(df[ASK_COLUMN], dtype=np.float64),
+        np.asarray(df[BID_COLUMN], dtype=np.float64),
+    )
+    ledger = np.empty(len(entry_index), dtype=TRADE_DTYPE)
+    ledger["entry_index"] = entry_index
+    ledger["exit_index"] = exit_index
+    ledger["entry_price"] = entry_price
+    ledger["exit_price"] = exit_price
+    ledger["pnl"] = pnl
+    return ledger
+
+
+def ledger_totals(ledger: NDArray[Any]) -> dict[str, float]:
+    """Return the exit total, min exit total, wins and losses of a trade ledger.
+
+    The totals are those of the last row of exit_total, computed from the trades
+    alone.  Before the first entry the exit total is NaN, after it the running
+    total starts from 0.
+    """
+    pnl = ledger["pnl"][ledger["exit_index"] >= 0]
+    if len(ledger) == 0:
+        return {"exit_total": np.nan, "min_exit_total": np.nan, "wins": 0, "losses": 0}
+    totals = np.cumsum(np.nan_to_num(pnl))
+    return {
+        "exit_total": float(totals[-1]) if len(totals) > 0 else 0.0,
+        "min_exit_total": float(min(0.0, totals.min())) if len(totals) > 0 else 0.0,
+        "wins": int(np.sum(pnl > 0)),
+        "losses": int(np.sum(pnl < 0)),
+    }
+
+
+def take_profit(df: pd.DataFrame | CandleFrame, take_profit: float) -> None:
     """Apply a take profit strategy to the trading data.
 
     Parameters
@@ -63,13 +154,20 @@ def take_profit(df: pd.DataFrame, take_profit: float) -> None:
 
     """
     df["take_profit"] = take_profit
+    if isinstance(df, CandleFrame):
+        df["signal"] = take_profit_numpy(
+            df["signal"], df["trigger"], df["position_value"], take_profit
+        )
+        df["trigger"] = trigger_numpy(df["signal"], -1)
+        return
+
     df.loc[
         (df["position_value"] > df["take_profit"]) & (df["trigger"] != 1), "signal"
     ] = 0
     df["trigger"] = df["signal"].diff().fillna(0).astype(int)
 
 
-def stop_loss(df: pd.DataFrame, stop_loss: float) -> None:
+def stop_loss(df: pd.DataFrame | CandleFrame, stop_loss: float) -> None:
     """Apply a stop loss strategy to the trading data.
 
     Parameters
@@ -97,11 +195,16 @@ def stop_loss(df: pd.DataFrame, stop_loss: float) -> None:
 
     """
     df["stop_loss"] = stop_loss
+    if isinstance(df, CandleFrame):
+        df["signal"] = stop_loss_numpy(df["signal"], df["position_value"], stop_loss)
+        df["trigger"] = trigger_numpy(df["signal"], -1)
+        return
+
     df.loc[df["position_value"] < df["stop_loss"], "signal"] = 0
     df["trigger"] = df["signal"].diff().fillna(0).astype(int)
 
 
-def entry_price(df: pd.DataFrame) -> None:
+def entry_price(df: pd.DataFrame | CandleFrame) -> None:
     """Calculate the entry price for a given trading signal.
 
     When the trigger is 1, use the ask_open price (buy signal), so when the trigger is -1, it means
@@ -132,6 +235,12 @@ def entry_price(df: pd.DataFrame) -> None:
 
     """
     df["internal_bit_mask"] = df["signal"] | abs(df["trigger"])
+    if isinstance(df, CandleFrame):
+        df["entry_price"], df["position_value"], _ = entry_price_numpy(
+            df["signal"], df["trigger"], df[ASK_COLUMN], df[BID_COLUMN], np.nan
+        )
+        return
+
     df["entry_price"] = np.where(df["trigger"] == 1, df[ASK_COLUMN], np.nan)
     df["entry_price"] = df["entry_price"].ffill() * df["internal_bit_mask"]
     df["position_value"] = (df[BID_COLUMN] - df["entry_price"]) * df[
@@ -166,3 +275,542 @@ def atr(df: pd.DataFrame, wma_period: int) -> None:
         df["close"].to_numpy(),
         timeperiod=wma_period,
     )
+
+
+@jit(nopython=True)
+def wma_sums_numpy(
+    window: NDArray[np.float64], oldest: int, period: int
+) -> tuple[float, float]:
+    """Rebuild the running sums wma_numpy carries after an output.
+
+    They are the sum of the window and its sum weighted 0 to period - 1 from the
+    oldest value, at ring buffer position oldest, to the newest.
+    """
+    period_sub = 0.0
+    period_sum = 0.0
+    for k in range(period):
+        value = window[(oldest + k) % period]
+        period_sub += value
+        period_sum += k * value
+    return period_sub, period_sum
+
+
+@jit(nopython=True)
+def wma_numpy(
+    source: NDArray[Any],
+    period: int,
+    state: NDArray[np.float64],
+    window: NDArray[np.float64],
+    out: NDArray[np.float64] | None = None,
+) -> NDArray[np.float64]:
+    """Calculate the weighted moving average with TA-Lib's recurrence, resumable across chunks.
+
+    The running sums are updated like the reference TA_WMA.  The subtraction
+    of the window sum accumulates rounding errors over long series, so every
+    period values the sums are rebuilt from the window, which keeps the output
+    within about 1e-12 of the exact weighted sum at any length, like talib.WMA.
+    The rebuilds
+    depend on the number of values seen and not on the chunks, so resuming from
+    the state of the previous chunk gives exactly the same output as one call
+    over the concatenated input.
+
+    Parameters
+    ----------
+    source : NDArray
+        The next chunk of source prices.
+    period : int
+        The period for the weighted moving average.
+    state : NDArray[np.float64]
+        [period_sub, period_sum, trailing_value, seen], zeros to start.  Updated
+        in place.
+    window : NDArray[np.float64]
+        A ring buffer of the last period inputs.  Updated in place.
+    out : NDArray[np.float64] | None, optional
+        Receives the output instead of a new array, i.e. a row of a matrix.
+
+    Returns
+    -------
+    NDArray[np.float64]
+        The weighted moving average of the chunk, NaN until period values were seen.
+
+    """
+    if out is None:
+        out = np.empty(len(source))
+    out[:] = np.nan
+    divider = (period * (period + 1)) >> 1
+    period_sub = state[0]
+    period_sum = state[1]
+    trailing = state[2]
+    seen = int(state[3])
+    # ring buffer position of seen % period, without a division per row
+    head = seen % period
+    for i in range(len(source)):
+        value = source[i]
+        # TA-Lib skips leading NaNs
+        if seen == 0 and np.isnan(value):
+            continue
+        window[head] = value
+        head = head + 1 if head + 1 < period else 0
+        if period == 1:
+            out[i] = value
+        elif seen < period - 1:
+            period_sub += value
+            period_sum += value * (seen + 1)
+        else:
+            period_sub += value
+            period_sub -= trailing
+            period_sum += value * period
+            trailing = window[head]
+            out[i] = period_sum / divider
+            period_sum -= period_sub
+        seen += 1
+        # the window holds a full period again, rebuilding is O(1) per row
+        if period > 1 and head == 0:
+            period_sub, period_sum = wma_sums_numpy(window, 0, period)
+
+    state[0] = period_sub
+    state[1] = period_sum
+    state[2] = trailing
+    state[3] = seen
+    return out
+
+
+def weighted_moving_average(source: NDArray[Any], period: int) -> NDArray[np.float64]:
+    """Calculate the weighted moving average of a whole series with wma_numpy.
+
+    Every path computing a WMA, in memory, chunked or extended, runs the
+    arithmetic of wma_numpy, so they all give the same bits.
+    """
+    return wma_numpy(
+        np.ascontiguousarray(source, dtype=np.float64),
+        period,
+        np.zeros(4),
+        np.zeros(period),
+    )
+
+
+@jit(nopython=True, parallel=True)
+def wma_matrix_numpy(
+    source: NDArray[np.float64], periods: NDArray[np.int64]
+) -> NDArray[np.float64]:
+    """Calculate the weighted moving averages of a source, in parallel across periods."""
+    out = np.empty((len(periods), len(source)))
+    for row in prange(len(periods)):
+        period = periods[row]
+        wma_numpy(source, period, np.zeros(4), np.zeros(period), out[row])
+    return out
+
+
+def wma_matrix(source: NDArray[Any], periods: Sequence[int]) -> NDArray[np.float64]:
+    """Calculate the weighted moving average of a source array for many periods at once.
+
+    Parameters
+    ----------
+    source : NDArray
+        The source prices.
+    periods : Sequence[int]
+        The periods for the weighted moving averages.
+
+    Returns
+    -------
+    NDArray[np.float64]
+        A (periods x candles) matrix where row i is the weighted_moving_average
+        of periods[i].
+
+    Notes
+    -----
+    Every row is one O(n) pass of the running sums of wma_numpy, rebuilt from
+    the window every period values.  A single pair of cumulative sums over the
+    whole source would serve every period, but their differences cancel more
+    digits the longer the series, while the rebuilt sums stay within about
+    1e-12 of talib.WMA at any length.  The rows have the bits of
+    weighted_moving_average, so they can stand in for the wma nodes of
+    core.kernel.Pipeline.
+
+    """
+    return wma_matrix_numpy(
+        np.ascontiguousarray(source, dtype=np.float64),
+        np.asarray(periods, dtype=np.int64),
+    )
+
+
+def extend_weighted_moving_average(
+    previous: NDArray[np.float64], source: NDArray[Any], period: int
+) -> NDArray[np.float64]:
+    """Extend the weighted moving average of the first rows of a source to all rows.
+
+    Once wma_numpy rebuilds its running sums, which it does every period
+    values, its state only depends on the last period values.  The recurrence
+    is restarted period values before the last rebuild the previous rows
+    contain, so the result has the bits of weighted_moving_average over the
+    whole source.
+
+    Parameters
+    ----------
+    previous : NDArray[np.float64]
+        The weighted moving average of the first rows of the source.
+    source : NDArray
+        The source prices, the previous rows followed by the appended ones.
+    period : int
+        The period for the weighted moving average.
+
+    Returns
+    -------
+    NDArray[np.float64]
+        The weighted moving average of the source.
+
+    """
+    source = np.ascontiguousarray(source, dtype=np.float64)
+    valid = np.flatnonzero(~np.isnan(source[: len(previous)]))
+    if len(valid) == 0:
+        return weighted_moving_average(source, period)
+    # the values seen up to the last rebuild within the previous rows
+    begin = valid[0]
+    seen = (len(previous) - begin) // period * period
+    restart = begin + seen - period
+    if seen < period or np.isnan(source[restart]):
+        return weighted_moving_average(source, period)
+    tail = weighted_moving_average(source[restart:], period)
+    return np.concatenate((previous[: begin + seen], tail[period:]))
+
+
+@jit(nopython=True)
+def wma_signals_numpy(
+    buy: NDArray[Any],
+    exit: NDArray[Any],
+    wma: NDArray[Any],
+    compare_exit: bool,
+) -> NDArray[np.int64]:
+    """Calculate the signal of core.kernel.wma_signals on arrays."""
+    signal = np.zeros(len(buy), dtype=np.int64)
+    for i in range(len(buy)):
+        if buy[i] > wma[i]:
+            signal[i] = 1
+        if compare_exit and exit[i] < wma[i]:
+            signal[i] = 0
+    return signal
+
+
+@jit(nopython=True)
+def trigger_numpy(signal: NDArray[np.int64], prev_signal: int) -> NDArray[np.int64]:
+    """Calculate signal.diff().fillna(0), continuing from the previous signal.
+
+    A prev_signal of -1 marks the first row of the series, whose trigger is 0.
+    """
+    trigger = np.empty(len(signal), dtype=np.int64)
+    prev = prev_signal
+    for i in range(len(signal)):
+        trigger[i] = 0 if prev < 0 else signal[i] - prev
+        prev = signal[i]
+    return trigger
+
+
+@jit(nopython=True)
+def entry_price_numpy(
+    signal: NDArray[np.int64],
+    trigger: NDArray[np.int64],
+    ask: NDArray[Any],
+    bid: NDArray[Any],
+    last_entry: float,
+) -> tuple[NDArray[np.float64], NDArray[np.float64], float]:
+    """Calculate the entry price and position value of entry_price on arrays.
+
+    Parameters
+    ----------
+    signal : NDArray[np.int64]
+        The signal.
+    trigger : NDArray[np.int64]
+        The trigger.
+    ask : NDArray
+        The ask prices used to enter.
+    bid : NDArray
+        The bid prices used to value the position.
+    last_entry : float
+        The last entry price of the previous chunk, NaN to start.
+
+    Returns
+    -------
+    tuple[NDArray[np.float64], NDArray[np.float64], float]
+        The entry price, the position value and the last entry price.
+
+    """
+    entry = np.empty(len(signal))
+    position_value = np.empty(len(signal))
+    for i in range(len(signal)):
+        mask = signal[i] | abs(trigger[i])
+        if trigger[i] == 1 and not np.isnan(ask[i]):
+            last_entry = ask[i]
+        entry[i] = last_entry * mask
+        position_value[i] = (bid[i] - entry[i]) * mask
+    return entry, position_value, last_entry
+
+
+@jit(nopython=True)
+def take_profit_numpy(
+    signal: NDArray[np.int64],
+    trigger: NDArray[np.int64],
+    position_value: NDArray[np.float64],
+    take_profit: float,
+) -> NDArray[np.int64]:
+    """Return the signal after take_profit, without the trigger update."""
+    out = signal.copy()
+    for i in range(len(signal)):
+        if position_value[i] > take_profit and trigger[i] != 1:
+            out[i] = 0
+    return out
+
+
+@jit(nopython=True)
+def stop_loss_numpy(
+    signal: NDArray[np.int64],
+    position_value: NDArray[np.float64],
+    stop_loss: float,
+) -> NDArray[np.int64]:
+    """Return the signal after stop_loss, without the trigger update."""
+    out = signal.copy()
+    for i in range(len(signal)):
+        if position_value[i] < stop_loss:
+            out[i] = 0
+    return out
+
+
+@jit(nopython=True)
+def exit_total_numpy(
+    position_value: NDArray[np.float64],
+    trigger: NDArray[np.int64],
+    state: NDArray[np.float64],
+) -> tuple[
+    NDArray[np.float64],
+    NDArray[np.float64],
+    NDArray[np.int64],
+    NDArray[np.int64],
+    NDArray[np.float64],
+]:
+    """Calculate the totals of exit_total on arrays, resumable across chunks.
+
+    NaNs are skipped the way pandas cumsum and expanding min skip them, so the
+    results are bit-identical to exit_total.
+
+    Parameters
+    ----------
+    position_value : NDArray[np.float64]
+        The position value.
+    trigger : NDArray[np.int64]
+        The trigger.
+    state : NDArray[np.float64]
+        [exit_total, started, wins, losses, min_exit_total], use
+        [0, 0, 0, 0, nan] to start.  Updated in place.
+
+    Returns
+    -------
+    tuple
+        The exit value, exit total, wins, losses and min exit total.
+
+    """
+    n = len(position_value)
+    exit_value = np.empty(n)
+    exit_total = np.empty(n)
+    wins = np.empty(n, dtype=np.int64)
+    losses = np.empty(n, dtype=np.int64)
+    min_exit_total = np.empty(n)
+    total = state[0]
+    started = state[1] > 0
+    n_wins = np.int64(state[2])
+    n_losses = np.int64(state[3])
+    minimum = state[4]
+    for i in range(n):
+        value = position_value[i] * (1 if trigger[i] == -1 else 0)
+        exit_value[i] = value
+        addend = 0.0 if np.isnan(value) else value
+        total = total + addend if started else addend
+        started = True
+        if np.isnan(value):
+            exit_total[i] = np.nan
+        else:
+            exit_total[i] = total
+            if np.isnan(minimum) or total < minimum:
+                minimum = total
+        if value > 0:
+            n_wins += 1
+        if value < 0:
+            n_losses += 1
+        wins[i] = n_wins
+        losses[i] = n_losses
+        min_exit_total[i] = minimum
+
+    state[0] = total
+    state[1] = 1.0 if started else 0.0
+    state[2] = n_wins
+    state[3] = n_losses
+    state[4] = minimum
+    return exit_value, exit_total, wins, losses, min_exit_total
+
+
+@jit(nopython=True)
+def trade_ledger_numpy(
+    trigger: NDArray[np.int64],
+    position_value: NDArray[np.float64],
+    ask: NDArray[np.float64],
+    bid: NDArray[np.float64],
+) -> tuple[
+    NDArray[np.int64],
+    NDArray[np.int64],
+    NDArray[np.float64],
+    NDArray[np.float64],
+    NDArray[np.float64],
+]:
+    """Collect the trades of trade_ledger on arrays.
+
+    The entry price follows entry_price_numpy, an entry without an ask keeps
+    the previous entry price.  An exit without an open trade, i.e. from a
+    signal of 1 on the first row, is not a trade.
+
+    Returns
+    -------
+    tuple
+        The entry index, exit index, entry price, exit price and pnl of every
+        trade.
+
+    """
+    trades = 0
+    for i in range(len(trigger)):
+        if trigger[i] == 1:
+            trades += 1
+    entry_index = np.empty(trades, dtype=np.int64)
+    exit_index = np.full(trades, -1, dtype=np.int64)
+    entry_price = np.empty(trades)
+    exit_price = np.full(trades, np.nan)
+    pnl = np.full(trades, np.nan)
+    last_entry = np.nan
+    t = -1
+    is_open = False
+    for i in range(len(trigger)):
+        if trigger[i] == 1:
+            if not np.isnan(ask[i]):
+                last_entry = ask[i]
+            t += 1
+            entry_index[t] = i
+            entry_price[t] = last_entry
+            is_open = True
+        elif trigger[i] == -1 and is_open:
+            exit_index[t] = i
+            exit_price[t] = bid[i]
+            pnl[t] = position_value[i]
+            is_open = False
+    return entry_index, exit_index, entry_price, exit_price, pnl
+
+
+@jit(nopython=True)
+def trade_metrics_numpy(
+    signal: NDArray[np.int64],
+    trigger: NDArray[np.int64],
+    position_value: NDArray[np.float64],
+    periods_per_year: float,
+    out: NDArray[np.float64],
+) -> None:
+    """Reduce a position to the metrics of METRIC_FIELDS in a single pass.
+
+    exit_total, min_exit_total, wins and losses are the last values of
+    exit_total_numpy.  The equity of every candle is the exit total before it
+    plus the value of the open position, which gives the max drawdown and the
+    annualized Sharpe and Sortino ratios of the candle to candle equity changes.
+    time_in_market is the share of candles with a signal of 1.
+
+    Parameters
+    ----------
+    signal : NDArray[np.int64]
+        The signal.
+    trigger : NDArray[np.int64]
+        The trigger.
+    position_value : NDArray[np.float64]
+        The position value.
+    periods_per_year : float
+        The number of candles in a year.
+    out : NDArray[np.float64]
+        Receives the metrics in the order of METRIC_FIELDS.
+
+    """
+    n = len(position_value)
+    total = 0.0
+    started = False
+    minimum = np.nan
+    last_exit_total = np.nan
+    wins = 0
+    losses = 0
+    trades = 0
+    gross_profit = 0.0
+    gross_loss = 0.0
+    streak = 0
+    max_streak = 0
+    previous = 0.0
+    peak = 0.0
+    max_drawdown = 0.0
+    mean = 0.0
+    m2 = 0.0
+    downside = 0.0
+    held = 0
+    for i in range(n):
+        value = position_value[i] * (1 if trigger[i] == -1 else 0)
+        addend = 0.0 if np.isnan(value) else value
+        total = total + addend if started else addend
+        started = True
+        if np.isnan(value):
+            last_exit_total = np.nan
+        else:
+            last_exit_total = total
+            if np.isnan(minimum) or total < minimum:
+                minimum = total
+            if trigger[i] == -1:
+                trades += 1
+        if value > 0:
+            wins += 1
+            gross_profit += value
+            streak = 0
+        if value < 0:
+            losses += 1
+            gross_loss -= value
+            streak += 1
+            if streak > max_streak:
+                max_streak = streak
+
+        # on an exit candle the position value is the exit value, so the
+        # equity is the new total
+        open_value = 0.0 if np.isnan(position_value[i]) else position_value[i]
+        equity = total - addend + open_value
+        if equity > peak:
+            peak = equity
+        if peak - equity > max_drawdown:
+            max_drawdown = peak - equity
+        change = equity - previous
+        previous = equity
+        # Welford's running mean and variance
+        delta = change - mean
+        mean += delta / (i + 1)
+        m2 += delta * (change - mean)
+        if change < 0:
+            downside += change * change
+        if signal[i] == 1:
+            held += 1
+
+    scale = np.sqrt(periods_per_year)
+    std = np.sqrt(m2 / n) if n > 0 else 0.0
+    out[0] = last_exit_total
+    out[1] = minimum
+    out[2] = wins
+    out[3] = losses
+    out[4] = trades
+    out[5] = wins / trades if trades > 0 else np.nan
+    out[6] = gross_profit
+    out[7] = gross_loss
+    if gross_loss > 0:
+        out[8] = gross_profit / gross_loss
+    else:
+        out[8] = np.inf if gross_profit > 0 else np.nan
+    out[9] = (gross_profit - gross_loss) / trades if trades > 0 else np.nan
+    out[10] = gross_profit / wins if wins > 0 else np.nan
+    out[11] = -gross_loss / losses if losses > 0 else np.nan
+    out[12] = max_streak
+    out[13] = max_drawdown
+    out[14] = mean / std * scale if std > 0 else np.nan
+    out[15] = mean / np.sqrt(downside / n) * scale if downside > 0 else np.nan
+    out[16] = held / n if n > 0 else np.nan
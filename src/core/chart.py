@@ -1,12 +1,22 @@
 """Functions for generating charts."""
 
 import typing
+import orjson
 import pandas as pd
 import numpy as np
 from numba import jit  # type: ignore
 from typing import Any
 from numpy.typing import NDArray
 
+from core.frame import CandleFrame
+from core.store import CANDLE_COLUMNS
+
+HA_COLUMNS = [
+    f"ha_{prefix}{name}"
+    for prefix in ["", "bid_", "ask_"]
+    for name in ["open", "high", "low", "close"]
+]
+
 
 @jit(nopython=True)
 def heiken_ashi_numpy(
@@ -26,7 +36,149 @@ def heiken_ashi_numpy(
     return ha_open, ha_high, ha_low, ha_close
 
 
-def heikin_ashi(df: pd.DataFrame) -> None:
+@jit(nopython=True)
+def heiken_ashi_step_numpy(
+    c_open: NDArray[Any],
+    c_high: NDArray[Any],
+    c_low: NDArray[Any],
+    c_close: NDArray[Any],
+    state: NDArray[Any],
+) -> tuple[NDArray[Any], NDArray[Any], NDArray[Any], NDArray[Any]]:
+    """Generate Heikin Ashi candlesticks continuing from the previous chunk.
+
+    state holds the last [ha_open, ha_close] and is updated in place, NaNs start
+    a new series.  The results are identical to heiken_ashi_numpy over the
+    concatenated input.
+    """
+    ha_close = (c_open + c_high + c_low + c_close) / 4
+    ha_open = np.empty_like(ha_close)
+    if np.isnan(state[0]):
+        ha_open[0] = (c_open[0] + c_close[0]) / 2
+    else:
+        ha_open[0] = (state[0] + state[1]) / 2
+    for i in range(1, len(c_close)):
+        ha_open[i] = (ha_open[i - 1] + ha_close[i - 1]) / 2
+    ha_high = np.maximum(np.maximum(ha_open, ha_close), c_high)
+    ha_low = np.minimum(np.minimum(ha_open, ha_close), c_low)
+    state[0] = ha_open[-1]
+    state[1] = ha_close[-1]
+    return ha_open, ha_high, ha_low, ha_close
+
+
+@jit(nopython=True)
+def lttb_numpy(x: NDArray[Any], y: NDArray[Any], threshold: int) -> NDArray[np.int64]:
+    """Downsample a series with Largest-Triangle-Three-Buckets.
+
+    Returns the indices of the threshold points that keep the visual shape of
+    the series, always including the first and the last point.  All indices
+    are returned when the series is not longer than threshold.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    indices = np.empty(threshold, dtype=np.int64)
+    indices[0] = 0
+    every = (n - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        # average of the next bucket is the third point of the triangle
+        avg_start = int(np.floor((i + 1) * every)) + 1
+        avg_end = min(int(np.floor((i + 2) * every)) + 1, n)
+        avg_x = x[avg_start:avg_end].mean()
+        avg_y = y[avg_start:avg_end].mean()
+
+        start = int(np.floor(i * every)) + 1
+        end = int(np.floor((i + 1) * every)) + 1
+        best_area = -1.0
+        best = start
+        for j in range(start, end):
+            area = abs(
+                (x[a] - avg_x) * (y[j] - y[a]) - (x[a] - x[j]) * (avg_y - y[a])
+            )
+            if area > best_area:
+                best_area = area
+                best = j
+        indices[i + 1] = best
+        a = best
+    indices[threshold - 1] = n - 1
+    return indices
+
+
+@jit(nopython=True)
+def _max(a: float, b: float) -> float:
+    """Return the maximum like np.maximum, propagating NaNs."""
+    if np.isnan(a) or np.isnan(b):
+        return np.nan
+    return a if a >= b else b
+
+
+@jit(nopython=True)
+def _min(a: float, b: float) -> float:
+    """Return the minimum like np.minimum, propagating NaNs."""
+    if np.isnan(a) or np.isnan(b):
+        return np.nan
+    return a if a <= b else b
+
+
+@jit(nopython=True)
+def heiken_ashi_block_numpy(
+    block: NDArray[Any], out: NDArray[Any], start: int
+) -> None:
+    """Generate the mid, bid and ask Heikin Ashi candlesticks in one pass.
+
+    block is a (12 x rows) price block in the order of CANDLE_COLUMNS and out a
+    (12 x rows) block in the order of HA_COLUMNS.  Only the rows from start are
+    written, the rows before are expected to hold earlier results.  The values
+    are identical to heiken_ashi_numpy.
+    """
+    for i in range(start, block.shape[1]):
+        for k in range(0, 12, 4):
+            c_open = block[k, i]
+            c_high = block[k + 1, i]
+            c_low = block[k + 2, i]
+            c_close = block[k + 3, i]
+            ha_close = (c_open + c_high + c_low + c_close) / 4
+            if i == 0:
+                ha_open = (c_open + c_close) / 2
+            else:
+                ha_open = (out[k, i - 1] + out[k + 3, i - 1]) / 2
+            out[k, i] = ha_open
+            out[k + 1, i] = _max(_max(ha_open, ha_close), c_high)
+            out[k + 2, i] = _min(_min(ha_open, ha_close), c_low)
+            out[k + 3, i] = ha_close
+
+
+def heikin_ashi_block(
+    block: NDArray[Any], out: NDArray[Any] | None = None, start: int = 0
+) -> NDArray[np.float64]:
+    """Generate the Heikin Ashi block of a (12 x rows) price block.
+
+    Parameters
+    ----------
+    block : NDArray
+        Prices in the order of CANDLE_COLUMNS.
+    out : NDArray | None, optional
+        A preallocated (12 x rows) output block.  A new one is allocated when
+        not given.
+    start : int, optional
+        The first row to compute.  After appending rows to block, pass the
+        previous row count to update only the new rows of out.
+
+    Returns
+    -------
+    NDArray[np.float64]
+        The Heikin Ashi candlesticks in the order of HA_COLUMNS.
+
+    """
+    block = np.ascontiguousarray(block, dtype=np.float64)
+    if out is None:
+        out = np.empty_like(block)
+    heiken_ashi_block_numpy(block, out, start)
+    return out
+
+
+def heikin_ashi(df: pd.DataFrame | CandleFrame) -> None:
     """Generate Heikin Ashi candlesticks for a given dataframe.
 
     Heikin Ashi is a Japanese chart type that is used to identify trends and
@@ -47,41 +199,144 @@ def heikin_ashi(df: pd.DataFrame) -> None:
         added as new columns to the original DataFrame.  They are named
         'ha_close', 'ha_open', 'ha_high', and 'ha_low'. The 'ha_bid_close',
         'ha_ask_close', 'ha_bid_open', 'ha_ask_open', 'ha_bid_high', 'ha_ask_high',
-        'ha_bid_low', and 'ha_ask_low' are also added.
+        'ha_bid_low', and 'ha_ask_low' are also added.  A 'timestamp' column
+        becomes the index.
+
+    Notes
+    -----
+    Adding columns in place costs pandas a lot of per-column overhead, prefer
+    heikin_ashi_frame when a new DataFrame will do.
 
     """
-    df.reset_index(inplace=True)
+    if isinstance(df, CandleFrame):
+        out = heikin_ashi_block(df.block())
+        for i, name in enumerate(HA_COLUMNS):
+            df[name] = out[i]
+        return
 
-    df["ha_open"], df["ha_high"], df["ha_low"], df["ha_close"] = heiken_ashi_numpy(
-        df["open"].to_numpy(),
-        df["high"].to_numpy(),
-        df["low"].to_numpy(),
-        df["close"].to_numpy(),
-    )
+    if "timestamp" in df.columns:
+        df.set_index("timestamp", inplace=True)
+
+    out = heikin_ashi_block(df[CANDLE_COLUMNS].to_numpy(dtype=np.float64).T)
+    df[HA_COLUMNS] = out.T
+
+
+def heikin_ashi_frame(df: pd.DataFrame | CandleFrame) -> pd.DataFrame | CandleFrame:
+    """Return a new frame with the Heikin Ashi columns of heikin_ashi added.
 
-    df["ha_bid_open"], df["ha_bid_high"], df["ha_bid_low"], df["ha_bid_close"] = (
-        heiken_ashi_numpy(
-            df["bid_open"].to_numpy(),
-            df["bid_high"].to_numpy(),
-            df["bid_low"].to_numpy(),
-            df["bid_close"].to_numpy(),
-        )
+    The Heikin Ashi block is attached with a single concat instead of twelve
+    column insertions.  A CandleFrame gets views onto the block, sharing the
+    arrays of the input.
+    """
+    if isinstance(df, CandleFrame):
+        frame = CandleFrame(df.index, dict(df.columns))
+        heikin_ashi(frame)
+        return frame
+
+    if "timestamp" in df.columns:
+        df = df.set_index("timestamp")
+
+    out = heikin_ashi_block(df[CANDLE_COLUMNS].to_numpy(dtype=np.float64).T)
+    return pd.concat(
+        [df, pd.DataFrame(out.T, index=df.index, columns=HA_COLUMNS, copy=False)],
+        axis=1,
     )
 
-    df["ha_ask_open"], df["ha_ask_high"], df["ha_ask_low"], df["ha_ask_close"] = (
-        heiken_ashi_numpy(
-            df["ask_open"].to_numpy(),
-            df["ask_high"].to_numpy(),
-            df["ask_low"].to_numpy(),
-            df["ask_close"].to_numpy(),
-        )
+
+SERIALIZATIONS = ["none", "json", "orjson", "arrow", "numpy"]
+
+
+def ohlc_records(df_ohlc: pd.DataFrame) -> bytes:
+    """Encode OHLC data as JSON records with orjson.
+
+    The output has the same shape as to_json(orient="records"): one object per
+    row with the timestamp in epoch milliseconds and NaNs as null.  Prices keep
+    full double precision instead of the 10 digits pandas writes.
+    """
+    index = df_ohlc.index
+    name = index.name or "index"
+    millis = (
+        index.as_unit("ms").asi8.tolist()
+        if isinstance(index, pd.DatetimeIndex)
+        else index.tolist()
     )
+    columns = [name] + list(df_ohlc.columns)
+    values = [millis] + [df_ohlc[c].to_numpy().tolist() for c in df_ohlc.columns]
+    return orjson.dumps([dict(zip(columns, row)) for row in zip(*values)])
+
+
+def ohlc_arrays(df_ohlc: pd.DataFrame) -> dict[str, NDArray[Any]]:
+    """Return the OHLC columns as NumPy arrays without copying.
+
+    The index is returned under its name as int64 epoch nanoseconds.
+    """
+    index = df_ohlc.index
+    arrays: dict[str, NDArray[Any]] = {
+        index.name or "index": index.asi8
+        if isinstance(index, pd.DatetimeIndex)
+        else index.to_numpy()
+    }
+    for column in df_ohlc.columns:
+        arrays[column] = df_ohlc[column].to_numpy()
+    return arrays
+
+
+def ohlc_arrow(df_ohlc: pd.DataFrame) -> bytes:
+    """Encode OHLC data as an Arrow IPC stream, requires pyarrow."""
+    try:
+        import pyarrow as pa  # type: ignore
+    except ImportError as err:
+        raise Exception("arrow serialization requires pyarrow") from err
+
+    table = pa.Table.from_pydict(ohlc_arrays(df_ohlc))
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def serialize_ohlc(df_ohlc: pd.DataFrame, serialization: str = "json") -> typing.Any:
+    """Serialize OHLC data for consumers outside of pandas.
+
+    Parameters
+    ----------
+    df_ohlc : pd.DataFrame
+        OHLC data with a DatetimeIndex, as returned by ohlc.
+    serialization : str, optional
+        One of SERIALIZATIONS:
+
+        - 'none': nothing, returns None
+        - 'json': a JSON records string from pandas
+        - 'orjson': the same records as bytes, encoded with orjson
+        - 'arrow': an Arrow IPC stream as bytes
+        - 'numpy': a dict of column name to NumPy array, without copying
+
+    Returns
+    -------
+    typing.Any
+        The serialized data.
 
-    df.set_index("timestamp", inplace=True)
+    """
+    if serialization == "none":
+        return None
+    if serialization == "json":
+        return df_ohlc.reset_index().to_json(orient="records")
+    if serialization == "orjson":
+        return ohlc_records(df_ohlc)
+    if serialization == "arrow":
+        return ohlc_arrow(df_ohlc)
+    if serialization == "numpy":
+        return ohlc_arrays(df_ohlc)
+    raise ValueError(
+        f"unknown serialization {serialization}, expected one of {SERIALIZATIONS}"
+    )
 
 
 def ohlc(
-    df: pd.DataFrame, timeFrame: str = "5Min", isSwapped: bool = False
+    df: pd.DataFrame,
+    timeFrame: str = "5Min",
+    isSwapped: bool = False,
+    serialization: str = "json",
 ) -> tuple[pd.DataFrame, typing.Any]:
     """Resample the input DataFrame into OHLC format for specified time intervals.
 
@@ -99,11 +354,16 @@ def ohlc(
         The time interval for resampling, by default '5Min'.
     isSwapped: bool, optional
         If True, swap the columns 'amount0' and 'amount1'.
+    serialization: str, optional
+        How to serialize the OHLC data next to the frame, by default 'json'.
+        See serialize_ohlc.
 
     Returns
     -------
     pandas.DataFrame
         A DataFrame containing resampled OHLC data for price, bid price, and ask price.
+    typing.Any
+        The OHLC data serialized as requested.
 
     """
     if isSwapped:
@@ -152,6 +412,4 @@ def ohlc(
     df_ohlc["ask_low"] = df_a["low"]
     df_ohlc["ask_close"] = df_a["close"]
 
-    df_json = df_ohlc.reset_index()
-
-    return df_ohlc, df_json.to_json(orient="records")
+    return df_ohlc, serialize_ohlc(df_ohlc, serialization)
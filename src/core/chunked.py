@@ -0,0 +1,177 @@
+"""Out-of-core execution of the kernel over a stream of candle chunks."""
+
+from typing import Any, Iterable, Iterator
+
+import numpy as np
+import pandas as pd
+from numpy.typing import NDArray
+
+from core.calc import (
+    ASK_COLUMN,
+    BID_COLUMN,
+    entry_price_numpy,
+    exit_total_numpy,
+    stop_loss_numpy,
+    take_profit_numpy,
+    trigger_numpy,
+    wma_numpy,
+    wma_signals_numpy,
+)
+from core.chart import heiken_ashi_step_numpy
+from core.kernel import KernelConfig
+from core.store import CANDLE_COLUMNS
+
+HA_PREFIXES = ["", "bid_", "ask_"]
+
+
+class ChunkedKernel:
+    """Run the kernel pipeline one chunk at a time.
+
+    Only the state each stage needs from the previous chunk is carried over: the
+    last Heikin Ashi open and close, the WMA running sums and window, the
+    previous signal of every stage, the last entry price of every entry price
+    pass and the cumulative totals.  Peak memory is therefore bounded by the
+    chunk size, and since every stage uses the same arithmetic as
+    core.kernel.kernel the summary is bit-identical to an in-memory run over the
+    concatenated candles, whatever the chunk size.
+    """
+
+    def __init__(self, config: KernelConfig):
+        """Initialize a ChunkedKernel object."""
+        self.config = config
+        self.ha_state = np.full((len(HA_PREFIXES), 2), np.nan)
+        self.wma_state = np.zeros(4)
+        self.wma_window = np.zeros(config.wma_period)
+        # previous signal of the wma, take profit and stop loss stages
+        self.prev_signal = [-1, -1, -1]
+        # last entry price of the three entry price passes
+        self.last_entry = [np.nan, np.nan, np.nan]
+        self.totals = np.array([0.0, 0.0, 0.0, 0.0, np.nan])
+        self.signal = 0
+        self.trigger = 0
+        self.exit_total = np.nan
+        self.rows = 0
+
+    def columns(self, block: NDArray[Any]) -> dict[str, NDArray[Any]]:
+        """Return the raw and Heikin Ashi columns of a (12 x rows) block."""
+        columns = {name: block[i] for i, name in enumerate(CANDLE_COLUMNS)}
+        for j, prefix in enumerate(HA_PREFIXES):
+            ha = heiken_ashi_step_numpy(
+                columns[prefix + "open"],
+                columns[prefix + "high"],
+                columns[prefix + "low"],
+                columns[prefix + "close"],
+                self.ha_state[j],
+            )
+            for name, values in zip(("open", "high", "low", "close"), ha):
+                columns[f"ha_{prefix}{name}"] = values
+        return columns
+
+    def stage(
+        self, index: int, signal: NDArray[np.int64], columns: dict[str, NDArray[Any]]
+    ) -> tuple[NDArray[np.int64], NDArray[np.int64], NDArray[np.float64]]:
+        """Recompute the trigger and the position value of one pipeline stage."""
+        trigger = trigger_numpy(signal, self.prev_signal[index])
+        self.prev_signal[index] = int(signal[-1])
+        _, position_value, self.last_entry[index] = entry_price_numpy(
+            signal,
+            trigger,
+            columns[ASK_COLUMN],
+            columns[BID_COLUMN],
+            self.last_entry[index],
+        )
+        return signal, trigger, position_value
+
+    def process(self, block: NDArray[Any]) -> None:
+        """Process the next (12 x rows) block of candles in CANDLE_COLUMNS order."""
+        if block.shape[1] == 0:
+            return
+
+        config = self.config
+        columns = self.columns(np.asarray(block, dtype=np.float64))
+        wma = wma_numpy(
+            columns[config.source_column],
+            config.wma_period,
+            self.wma_state,
+            self.wma_window,
+        )
+        signal = wma_signals_numpy(
+            columns[config.signal_buy_column],
+            columns[config.signal_exit_column],
+            wma,
+            config.signal_buy_column != config.signal_exit_column,
+        )
+        signal, trigger, position_value = self.stage(0, signal, columns)
+
+        if config.take_profit > 0:
+            signal = take_profit_numpy(
+                signal, trigger, position_value, config.take_profit
+            )
+            signal, trigger, position_value = self.stage(1, signal, columns)
+
+        if config.stop_loss > 0:
+            signal = stop_loss_numpy(signal, position_value, config.stop_loss)
+            signal, trigger, position_value = self.stage(2, signal, columns)
+
+        _, exit_total, _, _, _ = exit_total_numpy(position_value, trigger, self.totals)
+        self.exit_total = float(exit_total[-1])
+        self.signal = int(signal[-1])
+        self.trigger = int(trigger[-1])
+        self.rows += block.shape[1]
+
+    def process_frame(self, df: pd.DataFrame) -> None:
+        """Process the next chunk given as an OHLC DataFrame."""
+        self.process(df[CANDLE_COLUMNS].to_numpy(dtype=np.float64).T)
+
+    def summary(self) -> dict[str, Any]:
+        """Return the fields of the last row that make up a backtest Record."""
+        return {
+            "signal": self.signal,
+            "trigger": self.trigger,
+            "losses": int(self.totals[3]),
+            "wins": int(self.totals[2]),
+            "exit_total": self.exit_total,
+            "min_exit_total": float(self.totals[4]),
+        }
+
+
+def kernel_chunked(
+    chunks: Iterable[NDArray[Any] | pd.DataFrame],
+    include_incomplete: bool,
+    config: KernelConfig,
+) -> ChunkedKernel:
+    """Run the kernel over a stream of candle chunks.
+
+    Parameters
+    ----------
+    chunks : Iterable[NDArray | pd.DataFrame]
+        (12 x rows) blocks in CANDLE_COLUMNS order, or OHLC DataFrames.
+    include_incomplete : bool
+        Whether to include the last candle of the stream.
+    config : KernelConfig
+        A dataclass containing the configuration for the kernel.
+
+    Returns
+    -------
+    ChunkedKernel
+        The kernel after processing every chunk, see ChunkedKernel.summary.
+
+    """
+    chunked = ChunkedKernel(config)
+    blocks: Iterator[NDArray[Any]] = (
+        chunk[CANDLE_COLUMNS].to_numpy(dtype=np.float64).T
+        if isinstance(chunk, pd.DataFrame)
+        else chunk
+        for chunk in chunks
+    )
+
+    # hold back one chunk so the last candle can be dropped
+    pending: NDArray[Any] | None = None
+    for block in blocks:
+        if pending is not None:
+            chunked.process(pending)
+        pending = block
+    if pending is not None:
+        chunked.process(pending if include_incomplete else pending[:, :-1])
+
+    return chunked
@@ -0,0 +1,189 @@
+"""Array-backed candle frame for the kernel hot path."""
+
+from typing import Any, Iterator
+
+import numpy as np
+import pandas as pd
+from numpy.typing import NDArray
+
+from core.store import CANDLE_COLUMNS, to_epoch_ns
+
+
+class CandleFrame:
+    """Candles and derived series as a struct of NumPy arrays.
+
+    The index holds int64 epoch nanoseconds and every column is an array of
+    the same length.  Column access is a dict lookup and assignment never
+    copies, so the kernel stages carry none of the per-operation overhead of a
+    DataFrame.  Convert with from_pandas and to_pandas at the edges only.  The
+    kernel sets ledger to the trades of the frame, see core.calc.trade_ledger.
+    """
+
+    __slots__ = ("index", "columns", "ledger")
+
+    def __init__(
+        self,
+        index: NDArray[np.int64],
+        columns: dict[str, NDArray[Any]] | None = None,
+    ):
+        """Initialize a CandleFrame object."""
+        self.index = index
+        self.columns: dict[str, NDArray[Any]] = columns if columns is not None else {}
+        self.ledger: NDArray[Any] | None = None
+
+    @classmethod
+    def from_pandas(cls, df: pd.DataFrame) -> "CandleFrame":
+        """Build a frame from an OHLC DataFrame.
+
+        The timestamps are taken from the 'timestamp' column, or from the index
+        when there is no such column.  Only the CANDLE_COLUMNS are copied.
+        """
+        index = to_epoch_ns(df["timestamp"] if "timestamp" in df.columns else df.index)
+        return cls(
+            index,
+            {name: df[name].to_numpy(dtype=np.float64) for name in CANDLE_COLUMNS},
+        )
+
+    @classmethod
+    def from_block(
+        cls, index: NDArray[np.int64], block: NDArray[np.float64]
+    ) -> "CandleFrame":
+        """Build a frame of views onto a (12 x rows) block in CANDLE_COLUMNS order."""
+        return cls(index, {name: block[i] for i, name in enumerate(CANDLE_COLUMNS)})
+
+    def to_pandas(self) -> pd.DataFrame:
+        """Return a DataFrame indexed by int64 epoch nanoseconds, shaped like the kernel output."""
+        return pd.DataFrame(self.columns, index=pd.Index(self.index, name="timestamp"))
+
+    def head(self, rows: int) -> "CandleFrame":
+        """Return a frame of views onto the first rows, negative counts from the end."""
+        return CandleFrame(
+            self.index[:rows],
+            {name: values[:rows] for name, values in self.columns.items()},
+        )
+
+    def copy(self) -> "CandleFrame":
+        """Return a frame with copies of every array."""
+        return CandleFrame(
+            self.index.copy(),
+            {name: values.copy() for name, values in self.columns.items()},
+        )
+
+    def block(self, names: list[str] = CANDLE_COLUMNS) -> NDArray[np.float64]:
+        """Return the named columns stacked into a (columns x rows) block."""
+        return np.stack([self.columns[name] for name in names])
+
+    def __getitem__(self, name: str) -> NDArray[Any]:
+        """Return a column."""
+        return self.columns[name]
+
+    def __setitem__(self, name: str, values: Any) -> None:
+        """Set a column, scalars are broadcast to the length of the frame."""
+        if np.ndim(values) == 0:
+            values = np.full(len(self.index), values)
+        self.columns[name] = values
+
+    def __contains__(self, name: object) -> bool:
+        """Return whether the frame has a column."""
+        return name in self.columns
+
+    def __iter__(self) -> Iterator[str]:
+        """Iterate over the column names."""
+        return iter(self.columns)
+
+    def __len__(self) -> int:
+        """Return the number of rows."""
+        return len(self.index)
+
+
+class CandleBuffer:
+    """Fixed-size window of the most recent candles, refreshed with deltas.
+
+    The candles live in preallocated arrays of twice the capacity.  New candles
+    are written after the window, and only when the end of the arrays is
+    reached is the window moved back to the front, so the window is always a
+    contiguous view and the memory never grows.
+    """
+
+    def __init__(self, capacity: int):
+        """Initialize a CandleBuffer object."""
+        self.capacity = capacity
+        self.times = np.empty(2 * capacity, dtype=np.int64)
+        self.block = np.empty((len(CANDLE_COLUMNS), 2 * capacity))
+        self.start = 0
+        self.stop = 0
+
+    def __len__(self) -> int:
+        """Return the number of candles in the window."""
+        return self.stop - self.start
+
+    def clear(self) -> None:
+        """Drop every candle, the next refresh is a full resync."""
+        self.start = 0
+        self.stop = 0
+
+    def last_complete(self) -> int | None:
+        """Return the time of the last complete candle, the last one is still forming."""
+        return int(self.times[self.stop - 2]) if len(self) >= 2 else None
+
+    def merge(self, times: NDArray[np.int64], block: NDArray[np.float64]) -> bool:
+        """Merge fetched candles into the window.
+
+        The fetched candles replace the buffered candles from the time of the
+        first fetched one on.
+
+        Parameters
+        ----------
+        times : NDArray[np.int64]
+            The times of the fetched candles, the first one must already be in
+            the window unless the window is empty.
+        block : NDArray[np.float64]
+            The (12 x rows) prices in CANDLE_COLUMNS order.
+
+        Returns
+        -------
+        bool
+            False when the fetched candles do not connect to the window, which
+            then needs a resync.
+
+        """
+        rows = len(times)
+        if rows == 0:
+            return True
+        if rows > self.capacity:
+            times = times[-self.capacity :]
+            block = block[:, -self.capacity :]
+            rows = self.capacity
+
+        position = self.start
+        if len(self) > 0:
+            window = self.times[self.start : self.stop]
+            position += int(np.searchsorted(window, times[0]))
+            if position == self.stop or self.times[position] != times[0]:
+                return False
+
+        keep_from = max(self.start, position + rows - self.capacity)
+        if position + rows > len(self.times):
+            # move the candles that stay to the front
+            kept = position - keep_from
+            self.times[:kept] = self.times[keep_from:position]
+            self.block[:, :kept] = self.block[:, keep_from:position]
+            keep_from, position = 0, kept
+
+        self.times[position : position + rows] = times
+        self.block[:, position : position + rows] = block
+        self.start = keep_from
+        self.stop = position + rows
+        return True
+
+    def timestamps(self) -> NDArray[np.int64]:
+        """Return a view of the times in the window."""
+        return self.times[self.start : self.stop]
+
+    def prices(self) -> NDArray[np.float64]:
+        """Return a (12 x rows) view of the prices in the window."""
+        return self.block[:, self.start : self.stop]
+
+    def frame(self) -> CandleFrame:
+        """Return a CandleFrame of views onto the window."""
+        return CandleFrame.from_block(self.timestamps(), self.prices())
@@ -0,0 +1,421 @@
+"""Ingest directories of DEX swap files into the candle store in parallel."""
+
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+import logging
+import os
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+from numba import jit  # type: ignore
+from numpy.typing import NDArray
+
+from core.store import CANDLE_COLUMNS, CandleWriter, to_epoch_ns
+
+logger = logging.getLogger("ingest")
+
+SWAP_SUFFIXES = (".csv", ".csv.gz", ".parquet")
+NS_PER_DAY = 24 * 3600 * 1_000_000_000
+
+
+@dataclass
+class IngestConfig:
+    """IngestConfig class.
+
+    source is a directory of swap files (see SWAP_SUFFIXES) with a timestamp
+    column and the amount0 and amount1 columns core.chart.ohlc reads.  Integer
+    timestamps are in timestamp_unit, i.e. seconds for block timestamps.  The
+    files are read by workers threads, all cores when None.
+    """
+
+    source: str
+    time_frame: str = "5Min"
+    is_swapped: bool = False
+    timestamp_column: str = "timestamp"
+    timestamp_unit: str = "s"
+    workers: int | None = None
+
+
+@dataclass
+class IngestResult:
+    """The outcome of an ingestion."""
+
+    files: int
+    rows: int
+    candles: int
+    seconds: float
+
+    @property
+    def rows_per_second(self) -> float:
+        """Return the swap rows ingested per second."""
+        return self.rows / self.seconds if self.seconds > 0 else float("inf")
+
+
+@dataclass
+class SwapPartition:
+    """The candles of one swap file, before the previous files are known.
+
+    The first head_bins candles cover the rows before the file has seen both a
+    bid and an ask, plus the rest of their bins.  Those prices depend on the
+    last bid and ask of the previous files, so the raw head rows are kept to
+    recompute them.
+    """
+
+    path: str
+    rows: int
+    first_time: int
+    last_time: int
+    labels: NDArray[np.int64]
+    block: NDArray[np.float64]
+    head_bins: int
+    head_times: NDArray[np.int64]
+    head_prices: NDArray[np.float64]
+    last_prices: NDArray[np.float64]
+
+
+@jit(nopython=True, nogil=True)
+def swap_prices_numpy(
+    amount0: NDArray[np.float64], amount1: NDArray[np.float64]
+) -> NDArray[np.float64]:
+    """Return the (2 x rows) raw bid and ask price of every swap.
+
+    A swap with a positive amount0 is a sell at the bid and one with a negative
+    amount0 a buy at the ask, the other price is NaN, as in core.chart.ohlc.
+    """
+    n = len(amount0)
+    prices = np.full((2, n), np.nan)
+    for i in range(n):
+        if amount0[i] > 0:
+            prices[0, i] = abs(amount1[i] / amount0[i])
+        elif amount0[i] < 0:
+            prices[1, i] = abs(amount1[i] / amount0[i])
+    return prices
+
+
+@jit(nopython=True, nogil=True)
+def resample_swaps_numpy(
+    times: NDArray[np.int64],
+    prices: NDArray[np.float64],
+    carry: NDArray[np.float64],
+    bin_ns: int,
+) -> tuple[NDArray[np.int64], NDArray[np.float64]]:
+    """Resample swaps into candles of the bins that have swaps.
+
+    The bid and ask are forward filled from carry, the last bid and ask before
+    the first swap, and the mid is their mean.  The candles skip NaN prices like
+    pandas ohlc and are NaN when a bin has no price at all.
+
+    Parameters
+    ----------
+    times : NDArray[np.int64]
+        Increasing epoch nanoseconds.
+    prices : NDArray[np.float64]
+        The (2 x rows) raw bid and ask of swap_prices_numpy.
+    carry : NDArray[np.float64]
+        The bid and ask to start from, updated in place to the last ones.
+    bin_ns : int
+        The candle length, bins start at multiples of it since the epoch.
+
+    Returns
+    -------
+    tuple[NDArray[np.int64], NDArray[np.float64]]
+        The bin start times and a (12 x bins) block in the order of
+        CANDLE_COLUMNS.
+
+    """
+    n = len(times)
+    labels = np.empty(n, dtype=np.int64)
+    block = np.full((12, n), np.nan)
+    bins = 0
+    label = np.int64(0)
+    bid = carry[0]
+    ask = carry[1]
+    for i in range(n):
+        if not np.isnan(prices[0, i]):
+            bid = prices[0, i]
+        if not np.isnan(prices[1, i]):
+            ask = prices[1, i]
+        current = times[i] - times[i] % bin_ns
+        if bins == 0 or current != label:
+            label = current
+            labels[bins] = label
+            bins += 1
+        b = bins - 1
+        for k in range(3):
+            if k == 0:
+                value = (bid + ask) / 2
+            elif k == 1:
+                value = bid
+            else:
+                value = ask
+            if np.isnan(value):
+                continue
+            row = 4 * k
+            if np.isnan(block[row, b]):
+                block[row, b] = value
+                block[row + 1, b] = value
+                block[row + 2, b] = value
+            else:
+                if value > block[row + 1, b]:
+                    block[row + 1, b] = value
+                if value < block[row + 2, b]:
+                    block[row + 2, b] = value
+            block[row + 3, b] = value
+    carry[0] = bid
+    carry[1] = ask
+    return labels[:bins], block[:, :bins]
+
+
+@jit(nopython=True, nogil=True)
+def merge_candles_numpy(
+    labels: NDArray[np.int64], block: NDArray[np.float64], bin_ns: int
+) -> tuple[NDArray[np.int64], NDArray[np.float64]]:
+    """Merge resampled partitions into a forward filled run of candles.
+
+    Consecutive partial candles of the same bin, from partitions that split a
+    bin, are combined into one, the bins without swaps are added and every
+    column is forward filled, like the ffill after resampling in ohlc.
+
+    Parameters
+    ----------
+    labels : NDArray[np.int64]
+        The concatenated, non decreasing bin start times of the partitions.
+    block : NDArray[np.float64]
+        The concatenated (12 x bins) blocks of the partitions.
+    bin_ns : int
+        The candle length.
+
+    """
+    n = len(labels)
+    if n == 0:
+        return np.empty(0, dtype=np.int64), np.empty((12, 0))
+    first = labels[0]
+    count = (labels[n - 1] - first) // bin_ns + 1
+    times = first + np.arange(count, dtype=np.int64) * bin_ns
+    out = np.full((12, count), np.nan)
+    for i in range(n):
+        b = (labels[i] - first) // bin_ns
+        for row in range(0, 12, 4):
+            if np.isnan(block[row, i]):
+                continue
+            if np.isnan(out[row, b]):
+                for k in range(4):
+                    out[row + k, b] = block[row + k, i]
+            else:
+                out[row + 1, b] = max(out[row + 1, b], block[row + 1, i])
+                out[row + 2, b] = min(out[row + 2, b], block[row + 2, i])
+                out[row + 3, b] = block[row + 3, i]
+    for row in range(12):
+        for b in range(1, count):
+            if np.isnan(out[row, b]):
+                out[row, b] = out[row, b - 1]
+    return times, out
+
+
+def swap_files(source: str) -> list[str]:
+    """Return the swap files of a directory, sorted by name."""
+    return sorted(
+        os.path.join(source, name)
+        for name in os.listdir(source)
+        if name.endswith(SWAP_SUFFIXES)
+    )
+
+
+def read_swaps(
+    path: str, config: IngestConfig
+) -> tuple[NDArray[np.int64], NDArray[np.float64], NDArray[np.float64]]:
+    """Read the timestamps, amount0 and amount1 of a swap file with pyarrow.
+
+    pyarrow reads the columns with multiple threads and releases the GIL, so
+    several files are read at once.  Files that are not in time order are
+    sorted, keeping the order of swaps with the same timestamp.
+    """
+    try:
+        import pyarrow as pa  # type: ignore
+        import pyarrow.csv as pa_csv  # type: ignore
+        import pyarrow.parquet as pq  # type: ignore
+    except ImportError as err:
+        raise Exception("swap ingestion requires pyarrow") from err
+
+    columns = [config.timestamp_column, "amount0", "amount1"]
+    if path.endswith(".parquet"):
+        table = pq.read_table(path, columns=columns, use_threads=True)
+    else:
+        table = pa_csv.read_csv(
+            path,
+            read_options=pa_csv.ReadOptions(use_threads=True),
+            convert_options=pa_csv.ConvertOptions(include_columns=columns),
+        )
+
+    column = table.column(config.timestamp_column)
+    if pa.types.is_timestamp(column.type):
+        times = column.cast(pa.timestamp("ns")).to_numpy().view(np.int64)
+    elif pa.types.is_integer(column.type):
+        times = column.to_numpy().astype(np.int64) * pd.Timedelta(
+            1, unit=config.timestamp_unit
+        ).value
+    else:
+        times = to_epoch_ns(column.to_numpy(zero_copy_only=False))
+
+    amount0 = table.column("amount0").to_numpy().astype(np.float64)
+    amount1 = table.column("amount1").to_numpy().astype(np.float64)
+    if config.is_swapped:
+        amount0, amount1 = amount1, amount0
+    if np.any(np.diff(times) < 0):
+        order = np.argsort(times, kind="stable")
+        times, amount0, amount1 = times[order], amount0[order], amount1[order]
+    return times, amount0, amount1
+
+
+def resample_partition(path: str, config: IngestConfig, bin_ns: int) -> SwapPartition:
+    """Read a swap file and resample it into candles, without the previous files."""
+    times, amount0, amount1 = read_swaps(path, config)
+    prices = swap_prices_numpy(amount0, amount1)
+    carry = np.full(2, np.nan)
+    labels, block = resample_swaps_numpy(times, prices, carry, bin_ns)
+
+    # rows before the first bid or ask of the file take the last ones of the
+    # previous files, keep the raw rows of the bins they fall in
+    bid_seen = np.flatnonzero(~np.isnan(prices[0]))
+    ask_seen = np.flatnonzero(~np.isnan(prices[1]))
+    if len(bid_seen) > 0 and len(ask_seen) > 0:
+        head = max(bid_seen[0], ask_seen[0])
+    else:
+        head = len(times)
+    head_bins = 0
+    head_rows = 0
+    if head > 0:
+        head_label = times[head - 1] - times[head - 1] % bin_ns
+        head_bins = int(np.searchsorted(labels, head_label, side="right"))
+        head_rows = int(np.searchsorted(times, head_label + bin_ns, side="left"))
+
+    return SwapPartition(
+        path=path,
+        rows=len(times),
+        first_time=int(times[0]) if len(times) > 0 else 0,
+        last_time=int(times[-1]) if len(times) > 0 else 0,
+        labels=labels,
+        block=block,
+        head_bins=head_bins,
+        head_times=times[:head_rows].copy(),
+        head_prices=prices[:, :head_rows].copy(),
+        last_prices=np.array(
+            [
+                prices[0, bid_seen[-1]] if len(bid_seen) > 0 else np.nan,
+                prices[1, ask_seen[-1]] if len(ask_seen) > 0 else np.nan,
+            ]
+        ),
+    )
+
+
+def swap_candles(config: IngestConfig) -> tuple[NDArray[np.int64], NDArray[np.float64], int]:
+    """Resample every swap file of config.source into candles.
+
+    The files are resampled in parallel, each one as if no swap came before it.
+    The candles at the start of every file are then recomputed with the last
+    bid and ask of the files before it, and the partitions are merged, so the
+    candles are the same as those of core.chart.ohlc over all swaps at once.
+
+    Returns
+    -------
+    tuple[NDArray[np.int64], NDArray[np.float64], int]
+        The candle start times in epoch nanoseconds, a (12 x candles) block in
+        the order of CANDLE_COLUMNS and the number of swaps read.
+
+    """
+    bin_ns = pd.Timedelta(config.time_frame).value
+    if bin_ns <= 0 or NS_PER_DAY % bin_ns != 0:
+        raise ValueError(f"time_frame must divide a day, not {config.time_frame}")
+    paths = swap_files(config.source)
+    if len(paths) == 0:
+        raise ValueError(f"no swap files in {config.source}")
+
+    with ThreadPoolExecutor(
+        max_workers=config.workers or os.cpu_count(), thread_name_prefix="ingest"
+    ) as executor:
+        partitions = [
+            p
+            for p in executor.map(
+                lambda path: resample_partition(path, config, bin_ns), paths
+            )
+            if p.rows > 0
+        ]
+    partitions.sort(key=lambda p: p.first_time)
+
+    carry = np.full(2, np.nan)
+    labels: list[NDArray[np.int64]] = []
+    blocks: list[NDArray[np.float64]] = []
+    last_time = None
+    for p in partitions:
+        if last_time is not None and p.first_time < last_time:
+            raise ValueError(f"{p.path} overlaps the swaps of the previous file")
+        last_time = p.last_time
+        if p.head_bins > 0:
+            head_labels, head_block = resample_swaps_numpy(
+                p.head_times, p.head_prices, carry.copy(), bin_ns
+            )
+            labels.append(head_labels)
+            blocks.append(head_block)
+        labels.append(p.labels[p.head_bins :])
+        blocks.append(p.block[:, p.head_bins :])
+        carry = np.where(np.isnan(p.last_prices), carry, p.last_prices)
+
+    times, block = merge_candles_numpy(
+        np.concatenate(labels), np.concatenate(blocks, axis=1), bin_ns
+    )
+    return times, block, sum(p.rows for p in partitions)
+
+
+def ingest_swaps(config: IngestConfig, store_path: str) -> IngestResult:
+    """Resample a directory of swap files into candles and append them to a store.
+
+    Candles before the swaps have both a bid and an ask are not stored, and
+    neither are candles that are not newer than the store.
+
+    Parameters
+    ----------
+    config : IngestConfig
+        Where the swaps are and how to read them.
+    store_path : str
+        The candle store, created when it does not exist.
+
+    Returns
+    -------
+    IngestResult
+        The number of files, swaps and candles and the time taken.
+
+    """
+    start = perf_counter()
+    times, block, rows = swap_candles(config)
+    complete = np.flatnonzero(~np.isnan(block).any(axis=0))
+    first = complete[0] if len(complete) > 0 else len(times)
+    writer = CandleWriter(store_path)
+    before = len(writer)
+    count = writer.append_new(times[first:], block[:, first:])
+    writer.flush()
+
+    result = IngestResult(
+        files=len(swap_files(config.source)),
+        rows=rows,
+        candles=count - before,
+        seconds=perf_counter() - start,
+    )
+    logger.info(
+        "ingested %s swaps from %s files into %s %s candles in %.2fs, %.0f rows/s",
+        result.rows,
+        result.files,
+        result.candles,
+        config.time_frame,
+        result.seconds,
+        result.rows_per_second,
+    )
+    return result
+
+
+def candle_frame(times: NDArray[np.int64], block: NDArray[np.float64]) -> pd.DataFrame:
+    """Return candles as a DataFrame shaped like the output of core.chart.ohlc."""
+    return pd.DataFrame(
+        dict(zip(CANDLE_COLUMNS, block)),
+        index=pd.DatetimeIndex(pd.to_datetime(times), name="timestamp"),
+    )
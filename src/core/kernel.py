@@ -1,11 +1,31 @@
 """Functions for processing and generating trading signals."""
 
-from dataclasses import dataclass
-import talib
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Sequence
+import numpy as np
 import pandas as pd
+from numpy.typing import NDArray
 
-from core.chart import heikin_ashi
+from core.chart import heikin_ashi_frame, heiken_ashi_numpy, heiken_ashi_step_numpy
+from core.frame import CandleFrame
+from core.store import CANDLE_COLUMNS
 from core.calc import (
+    ASK_COLUMN,
+    BID_COLUMN,
+    METRIC_FIELDS,
+    entry_price_numpy,
+    exit_total_numpy,
+    extend_weighted_moving_average,
+    stop_loss_numpy,
+    take_profit_numpy,
+    trade_ledger,
+    trade_ledger_numpy,
+    trade_metrics_numpy,
+    trigger_numpy,
+    weighted_moving_average,
+    wma_matrix,
+    wma_signals_numpy,
     entry_price,
     exit_total,
     take_profit,
@@ -27,17 +47,18 @@ class KernelConfig:
 
 
 def wma_signals(
-    df: pd.DataFrame,
+    df: pd.DataFrame | CandleFrame,
     source_column: str = "open",
     signal_buy_column: str = "bid_low",
     signal_exit_column: str = "bid_high",
     wma_period: int = 20,
+    wma: NDArray[Any] | None = None,
 ) -> None:
     """Generate trading signals based on a comparison of the Heikin-Ashi highs and lows to the wma.
 
     Parameters
     ----------
-    df : pd.DataFrame
+    df : pd.DataFrame | CandleFrame
         The DataFrame containing the trading data.
     first_time_frame_run : bool, optional
         Whether this is the first time frame run.
@@ -49,6 +70,9 @@ def wma_signals(
         The column name for the exit signal data.
     wma_period : int, optional
         The period for the weighted moving average, by default 20
+    wma : NDArray, optional
+        A precomputed weighted moving average of the source column, i.e. a row
+        of core.calc.wma_matrix.  When given, wma_period is ignored.
 
     Returns
     -------
@@ -61,8 +85,22 @@ def wma_signals(
     is greater than the wma, and 0 where the Heikin-Ashi low is less than the wma.
 
     """
+    if wma is None:
+        wma = weighted_moving_average(np.asarray(df[source_column]), wma_period)
+
+    if isinstance(df, CandleFrame):
+        df["wma"] = wma
+        df["signal"] = wma_signals_numpy(
+            df[signal_buy_column],
+            df[signal_exit_column],
+            wma,
+            signal_buy_column != signal_exit_column,
+        )
+        df["trigger"] = trigger_numpy(df["signal"], -1)
+        return
+
     df["signal"] = 0
-    df["wma"] = talib.WMA(df[source_column].to_numpy(), wma_period)
+    df["wma"] = wma
 
     # check if the buy column is greater than the wma
     # B > W  S < W  Result
@@ -82,37 +120,42 @@ def wma_signals(
 
 
 def kernel(
-    df: pd.DataFrame,
+    df: pd.DataFrame | CandleFrame,
     include_incomplete: bool,
     config: KernelConfig,
-) -> pd.DataFrame:
+    wma: NDArray[Any] | None = None,
+) -> pd.DataFrame | CandleFrame:
     """Process a DataFrame containing trading data.
 
     This function processes a DataFrame containing trading data and generate trading signals
-    using candlesticks and weighted moving average (wma).
-
-    TODO: support other pipelines
+    using candlesticks and weighted moving average (wma).  See Pipeline for
+    running the same stages as a graph of shared, cached nodes.
 
     Parameters
     ----------
-    df : pd.DataFrame
-        A DataFrame containing trading data.
+    df : pd.DataFrame | CandleFrame
+        A DataFrame containing trading data.  A CandleFrame runs every stage on
+        its arrays and is returned as a CandleFrame.
     include_incomplete:
         Whether to include the last candle in the output DataFrame.
     config : KernelConfig
         A dataclass containing the configuration for the kernel.
+    wma : NDArray, optional
+        A precomputed weighted moving average aligned with the processed rows.
 
     Returns
     -------
-    pd.DataFrame
-        A DataFrame containing the processed trading data.
+    pd.DataFrame | CandleFrame
+        A DataFrame containing the processed trading data.  A CandleFrame also
+        carries its trade ledger.
 
     """
     if not include_incomplete:
-        df = df.iloc[:-1].copy()
+        df = df.head(-1) if isinstance(df, CandleFrame) else df.iloc[:-1]
 
+    # a new frame, the caller's DataFrame is left untouched
+    df = heikin_ashi_frame(df)
     # calculate the ATR for the trailing stop loss
-    heikin_ashi(df)
     # atr(df, config.wma_period)
 
     # signal using the close prices
@@ -126,6 +169,7 @@ def kernel(
         signal_exit_column=config.signal_exit_column,
         wma_period=config.wma_period,
         source_column=config.source_column,
+        wma=wma,
     )
 
     # calculate the entry prices:
@@ -150,4 +194,481 @@ def kernel(
     # calculate the exit total
     exit_total(df)
 
+    if isinstance(df, CandleFrame):
+        # the few trades, so consumers skip the rows without a trigger
+        df.ledger = trade_ledger(df)
+
     return df
+
+
+HA_FIELDS = ["open", "high", "low", "close"]
+OPS: dict[str, Callable[..., Any]] = {}
+# ops whose outputs can be extended to appended rows, see NodeCache.extend
+EXTENSIONS: dict[str, Callable[..., Any]] = {}
+# ops computing a 0/1 signal vector, see signal_digest
+SIGNAL_OPS = {"signal", "buy_signal", "take_profit", "stop_loss"}
+# ops computing the signal of the wma comparison, before any exit rule
+BASE_SIGNAL_OPS = {"signal", "buy_signal"}
+
+
+def register_op(name: str) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+    """Register the function computing the nodes of an op.
+
+    The function is called with the values of the input nodes followed by the
+    parameters of the node.
+    """
+
+    def decorator(fn: Callable[..., Any]) -> Callable[..., Any]:
+        OPS[name] = fn
+        return fn
+
+    return decorator
+
+
+def register_extension(name: str) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+    """Register the function extending the outputs of an op to appended rows.
+
+    The function is called with the output over the previous rows, the values
+    of the input nodes over all rows and the parameters of the node.
+    """
+
+    def decorator(fn: Callable[..., Any]) -> Callable[..., Any]:
+        EXTENSIONS[name] = fn
+        return fn
+
+    return decorator
+
+
+@dataclass(frozen=True)
+class Node:
+    """A node of the indicator graph.
+
+    Nodes compare by value, so two nodes built independently from the same op,
+    inputs and parameters are the same node and are computed once.  The 'column'
+    op reads the input column named by its only parameter.
+    """
+
+    op: str
+    inputs: tuple["Node", ...] = ()
+    params: tuple[Any, ...] = ()
+    _hash: int = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        """Cache the hash, the graphs are hashed on every cache lookup."""
+        object.__setattr__(self, "_hash", hash((self.op, self.inputs, self.params)))
+
+    def __hash__(self) -> int:
+        """Return the cached hash."""
+        return self._hash
+
+
+@register_op("heikin_ashi")
+def _heikin_ashi_op(c_open, c_high, c_low, c_close):
+    return heiken_ashi_numpy(c_open, c_high, c_low, c_close)
+
+
+@register_op("item")
+def _item_op(values, index):
+    return values[index]
+
+
+@register_op("wma")
+def _wma_op(source, period):
+    return weighted_moving_average(source, period)
+
+
+@register_op("signal")
+def _signal_op(buy, exit, wma):
+    return wma_signals_numpy(buy, exit, wma, True)
+
+
+@register_op("buy_signal")
+def _buy_signal_op(buy, wma):
+    return wma_signals_numpy(buy, buy, wma, False)
+
+
+@register_op("position")
+def _position_op(signal, ask, bid):
+    trigger = trigger_numpy(signal, -1)
+    _, position_value, _ = entry_price_numpy(signal, trigger, ask, bid, np.nan)
+    return signal, trigger, position_value
+
+
+@register_op("take_profit")
+def _take_profit_op(position, multiplier):
+    signal, trigger, position_value = position
+    return take_profit_numpy(signal, trigger, position_value, multiplier)
+
+
+@register_op("stop_loss")
+def _stop_loss_op(position, multiplier):
+    signal, _, position_value = position
+    return stop_loss_numpy(signal, position_value, multiplier)
+
+
+@register_op("exit_total")
+def _exit_total_op(position):
+    signal, trigger, position_value = position
+    _, total, wins, losses, min_total = exit_total_numpy(
+        position_value, trigger, np.array([0.0, 0.0, 0.0, 0.0, np.nan])
+    )
+    return {
+        "signal": signal,
+        "trigger": trigger,
+        "losses": losses,
+        "wins": wins,
+        "exit_total": total,
+        "min_exit_total": min_total,
+    }
+
+
+@register_op("metrics")
+def _metrics_op(position, periods_per_year):
+    signal, trigger, position_value = position
+    metrics = np.empty(len(METRIC_FIELDS))
+    trade_metrics_numpy(signal, trigger, position_value, periods_per_year, metrics)
+    return {"signal": signal[-1], "trigger": trigger[-1], "metrics": metrics}
+
+
+@register_op("ledger")
+def _ledger_op(position, ask, bid):
+    _, trigger, position_value = position
+    return trade_ledger_numpy(trigger, position_value, ask, bid)
+
+
+@register_extension("heikin_ashi")
+def _heikin_ashi_extension(previous, c_open, c_high, c_low, c_close):
+    rows = len(previous[0])
+    state = np.array([previous[0][-1], previous[3][-1]])
+    tail = heiken_ashi_step_numpy(
+        c_open[rows:], c_high[rows:], c_low[rows:], c_close[rows:], state
+    )
+    return tuple(np.concatenate((head, new)) for head, new in zip(previous, tail))
+
+
+@register_extension("item")
+def _item_extension(previous, values, index):
+    return values[index]
+
+
+@register_extension("wma")
+def _wma_extension(previous, source, period):
+    return extend_weighted_moving_average(previous, source, period)
+
+
+def column_node(name: str) -> Node:
+    """Return the node of a candle or Heikin Ashi column, i.e. 'bid_low' or 'ha_ask_open'."""
+    if not name.startswith("ha_"):
+        return Node("column", params=(name,))
+
+    prefix, _, ha_field = name[len("ha_") :].rpartition("_")
+    prefix = prefix + "_" if prefix else ""
+    ha = Node(
+        "heikin_ashi",
+        tuple(column_node(prefix + f) for f in HA_FIELDS),
+    )
+    return Node("item", (ha,), (HA_FIELDS.index(ha_field),))
+
+
+def position_node(config: KernelConfig) -> Node:
+    """Build the graph of the kernel pipeline up to the final position stage."""
+    wma = Node("wma", (column_node(config.source_column),), (config.wma_period,))
+    if config.signal_buy_column != config.signal_exit_column:
+        signal = Node(
+            "signal",
+            (
+                column_node(config.signal_buy_column),
+                column_node(config.signal_exit_column),
+                wma,
+            ),
+        )
+    else:
+        signal = Node("buy_signal", (column_node(config.signal_buy_column), wma))
+
+    prices = (column_node(ASK_COLUMN), column_node(BID_COLUMN))
+    position = Node("position", (signal,) + prices)
+    if config.take_profit > 0:
+        signal = Node("take_profit", (position,), (config.take_profit,))
+        position = Node("position", (signal,) + prices)
+    if config.stop_loss > 0:
+        signal = Node("stop_loss", (position,), (config.stop_loss,))
+        position = Node("position", (signal,) + prices)
+    return position
+
+
+def kernel_node(config: KernelConfig) -> Node:
+    """Build the graph of the kernel pipeline for a configuration.
+
+    The stages are the same as in kernel, so the last values of the outputs
+    match the last row of its DataFrame.
+    """
+    return Node("exit_total", (position_node(config),))
+
+
+def ledger_node(config: KernelConfig) -> Node:
+    """Build the graph of the trades of a configuration, see core.calc.trade_ledger.
+
+    The output is the tuple of arrays of core.calc.trade_ledger_numpy.
+    """
+    return Node(
+        "ledger",
+        (position_node(config), column_node(ASK_COLUMN), column_node(BID_COLUMN)),
+    )
+
+
+def metrics_node(config: KernelConfig, periods_per_year: float) -> Node:
+    """Build the graph reducing the kernel pipeline of a configuration to metrics.
+
+    The output holds the last signal and trigger and the METRIC_FIELDS of
+    core.calc.trade_metrics_numpy, without the per-row arrays of kernel_node.
+    periods_per_year is the number of candles in a year, which annualizes the
+    Sharpe and Sortino ratios, see bot.exchange.periods_per_year.
+    """
+    return Node("metrics", (position_node(config),), (periods_per_year,))
+
+
+def signal_digest(signal: NDArray[np.int64]) -> tuple[int, bytes]:
+    """Return a key that is equal for equal 0/1 signal vectors, 1 bit per row."""
+    return len(signal), np.packbits(signal != 0).tobytes()
+
+
+def _nbytes(value: Any) -> int:
+    """Return the memory held by a node output."""
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, dict):
+        return sum(_nbytes(v) for v in value.values())
+    if isinstance(value, (tuple, list)):
+        return sum(_nbytes(v) for v in value)
+    return 0
+
+
+class NodeCache:
+    """Least recently used cache of node outputs, bounded in bytes.
+
+    A cache belongs to one set of input columns, share it between every
+    pipeline and sweep iteration that runs over the same candles, extend it
+    when candles are appended and clear it when the candles change.  signals maps the signal_digest of every signal
+    computed so far to the first node that computed it, and aliases every
+    signal node to that node.
+    """
+
+    def __init__(self, max_bytes: int = 1 << 30):
+        """Initialize a NodeCache object."""
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.entries: OrderedDict[Node, Any] = OrderedDict()
+        self.signals: dict[tuple[int, bytes], Node] = {}
+        self.aliases: dict[Node, Node] = {}
+
+    def get(self, node: Node) -> Any | None:
+        """Return the output of a node, or None when it is not cached."""
+        value = self.entries.get(node)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(node)
+        return value
+
+    def put(self, node: Node, value: Any) -> None:
+        """Store the output of a node, evicting the least recently used outputs."""
+        size = _nbytes(value)
+        if size > self.max_bytes:
+            return
+        self.entries[node] = value
+        self.nbytes += size
+        while self.nbytes > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.nbytes -= _nbytes(evicted)
+
+    def signal_counts(self) -> tuple[int, int]:
+        """Return the number of distinct wma comparison signals and of their nodes.
+
+        Only the nodes of BASE_SIGNAL_OPS are counted, one per source, buy and
+        exit column and wma period, so the take profit and stop loss signals
+        derived from them do not inflate either count.
+        """
+        unique = {
+            alias for node, alias in self.aliases.items() if node.op in BASE_SIGNAL_OPS
+        }
+        total = sum(1 for node in self.aliases if node.op in BASE_SIGNAL_OPS)
+        return len(unique), total
+
+    def clear(self) -> None:
+        """Drop every cached output."""
+        self.entries.clear()
+        self.signals.clear()
+        self.aliases.clear()
+        self.nbytes = 0
+
+    def extend(self, columns: dict[str, NDArray[Any]]) -> None:
+        """Carry the cache over to columns that append rows to the cached ones.
+
+        The outputs of the ops of EXTENSIONS, the Heikin Ashi and WMA columns,
+        only have the new rows computed.  Every other output is dropped, along
+        with the signals, as the signal and position stages are recomputed.
+        """
+        previous = self.entries
+        self.entries = OrderedDict()
+        self.clear()
+        extended: dict[Node, Any] = {}
+
+        def extend(node: Node) -> Any | None:
+            if node.op == "column":
+                return np.ascontiguousarray(columns[node.params[0]], dtype=np.float64)
+            if node not in extended:
+                if node.op not in EXTENSIONS or node not in previous:
+                    return None
+                inputs = [extend(child) for child in node.inputs]
+                if any(value is None for value in inputs):
+                    return None
+                extended[node] = EXTENSIONS[node.op](
+                    previous[node], *inputs, *node.params
+                )
+            return extended[node]
+
+        # least recently used first, like the entries they replace
+        for node in previous:
+            if extend(node) is not None:
+                self.put(node, extended[node])
+
+
+class Pipeline:
+    """A graph of indicator and signal nodes computing named outputs.
+
+    Nodes shared between outputs are computed once per run, and once overall
+    when a NodeCache is given.  Different signal nodes often compute the same
+    vector, i.e. when the exit comparison never fires, so the nodes that
+    depend on a signal are keyed on the first node that computed the same
+    vector, and the stages after equal signals are computed once.
+
+    Parameters
+    ----------
+    outputs : dict[str, Node]
+        The nodes to compute, by output name.
+
+    """
+
+    def __init__(self, outputs: dict[str, Node]):
+        """Initialize a Pipeline object."""
+        self.outputs = outputs
+        self.order: list[Node] = []
+        seen: set[Node] = set()
+
+        def visit(node: Node) -> None:
+            if node in seen:
+                return
+            seen.add(node)
+            for child in node.inputs:
+                visit(child)
+            self.order.append(node)
+
+        for node in outputs.values():
+            visit(node)
+
+    @classmethod
+    def from_configs(cls, configs: dict[str, KernelConfig]) -> "Pipeline":
+        """Build the pipeline of several kernel configurations."""
+        return cls({name: kernel_node(config) for name, config in configs.items()})
+
+    def run(
+        self, columns: dict[str, NDArray[Any]], cache: NodeCache | None = None
+    ) -> dict[str, Any]:
+        """Compute the outputs.
+
+        Parameters
+        ----------
+        columns : dict[str, NDArray]
+            The candle columns by name, i.e. the processed rows of an OHLC
+            DataFrame.
+        cache : NodeCache | None, optional
+            Outputs of previous runs over the same columns.
+
+        Returns
+        -------
+        dict[str, Any]
+            The value of every output node by output name.
+
+        """
+        values: dict[Node, Any] = {}
+        # the node every node is computed and cached as
+        keys: dict[Node, Node] = {}
+        signals = cache.signals if cache is not None else {}
+        aliases = cache.aliases if cache is not None else {}
+        for node in self.order:
+            if node.op == "column":
+                values[node] = np.ascontiguousarray(
+                    columns[node.params[0]], dtype=np.float64
+                )
+                keys[node] = node
+                continue
+            inputs = tuple(keys[child] for child in node.inputs)
+            key = (
+                node
+                if all(k is child for k, child in zip(inputs, node.inputs))
+                else Node(node.op, inputs, node.params)
+            )
+            value = values.get(key)
+            if value is None and cache is not None:
+                value = cache.get(key)
+            if value is None:
+                value = OPS[node.op](*(values[k] for k in inputs), *node.params)
+                if cache is not None:
+                    cache.put(key, value)
+            values[key] = value
+            if node.op in SIGNAL_OPS:
+                alias = aliases.get(key)
+                if alias is None:
+                    alias = signals.setdefault(signal_digest(value), key)
+                    aliases[key] = alias
+                key = alias
+                values.setdefault(key, value)
+            keys[node] = key
+        return {name: values[keys[node]] for name, node in self.outputs.items()}
+
+
+def cache_wma_matrix(
+    cache: NodeCache,
+    columns: dict[str, NDArray[Any]],
+    source_column: str,
+    periods: Sequence[int],
+) -> None:
+    """Compute the wma nodes of a source column for many periods at once.
+
+    The rows of core.calc.wma_matrix have the bits of the wma op, so the
+    configurations of a period sweep find their wma nodes in the cache, and a
+    row that was evicted is recomputed to the same values.
+
+    Parameters
+    ----------
+    cache : NodeCache
+        The cache of the columns, receives the wma nodes.
+    columns : dict[str, NDArray]
+        The candle columns by name, see Pipeline.run.
+    source_column : str
+        The candle or Heikin Ashi column the averages are computed of.
+    periods : Sequence[int]
+        The wma periods of the sweep.
+
+    """
+    source = column_node(source_column)
+    missing = [
+        period
+        for period in periods
+        if Node("wma", (source,), (period,)) not in cache.entries
+    ]
+    if len(missing) == 0:
+        return
+    values = Pipeline({"source": source}).run(columns, cache)["source"]
+    for period, row in zip(missing, wma_matrix(values, missing)):
+        cache.put(Node("wma", (source,), (period,)), row)
+
+
+def candle_columns(df: pd.DataFrame, include_incomplete: bool) -> dict[str, NDArray[Any]]:
+    """Return the columns of an OHLC DataFrame a Pipeline runs over."""
+    if not include_incomplete:
+        df = df.iloc[:-1]
+    return {name: df[name].to_numpy(dtype=np.float64) for name in CANDLE_COLUMNS}
@@ -0,0 +1,363 @@
+"""Monte Carlo robustness scoring of kernel configurations on resampled paths."""
+
+from dataclasses import dataclass
+from typing import Any
+
+import numpy as np
+from numba import jit, prange  # type: ignore
+from numpy.typing import NDArray
+
+from core.calc import ASK_COLUMN, BID_COLUMN, wma_sums_numpy
+from core.chart import HA_COLUMNS, heiken_ashi_block_numpy
+from core.kernel import KernelConfig
+from core.store import CANDLE_COLUMNS
+
+PATH_COLUMNS = CANDLE_COLUMNS + HA_COLUMNS
+ASK_INDEX = PATH_COLUMNS.index(ASK_COLUMN)
+BID_INDEX = PATH_COLUMNS.index(BID_COLUMN)
+RESULT_FIELDS = ["exit_total", "min_exit_total", "wins", "losses"]
+
+
+@dataclass
+class MonteCarloConfig:
+    """MonteCarloConfig class.
+
+    Every path is built from blocks of block_size consecutive candles of the
+    history, drawn with replacement.  spread_jitter is the relative standard
+    deviation the bid and ask spreads of every candle are scaled by.  The top_k
+    configurations of a sweep are scored.
+    """
+
+    paths: int = 10_000
+    block_size: int = 50
+    spread_jitter: float = 0.2
+    top_k: int = 50
+    seed: int = 0
+
+
+@jit(nopython=True)
+def simulate_numpy(
+    columns: NDArray[np.float64],
+    source: int,
+    buy: int,
+    exit: int,
+    period: int,
+    take_profit: float,
+    stop_loss: float,
+    window: NDArray[np.float64],
+    out: NDArray[np.float64],
+) -> None:
+    """Run the kernel pipeline of one configuration in a single pass.
+
+    Every stage of the pipeline only depends on the current and earlier rows,
+    so the WMA, signal, take profit, stop loss and exit total stages are fused
+    into one loop carrying the state of each stage.  The arithmetic is that of
+    the separate *_numpy stages and the WMA that of core.calc.wma_numpy, so the
+    results on the original path are those of core.kernel.kernel_node.
+
+    Parameters
+    ----------
+    columns : NDArray[np.float64]
+        A (24 x rows) block in the order of PATH_COLUMNS.
+    source, buy, exit : int
+        The rows of the source, signal buy and signal exit columns.
+    period : int
+        The wma period.
+    take_profit, stop_loss : float
+        The multipliers, 0 skips the stage.
+    window : NDArray[np.float64]
+        Scratch space of at least period values.
+    out : NDArray[np.float64]
+        Receives the exit total, min exit total, wins and losses of the last row.
+
+    """
+    compare_exit = buy != exit
+    divider = (period * (period + 1)) >> 1
+    period_sub = 0.0
+    period_sum = 0.0
+    trailing = 0.0
+    seen = 0
+    # ring buffer position of seen % period, without a division per row
+    head = 0
+    prev0 = -1
+    prev1 = -1
+    prev2 = -1
+    last0 = np.nan
+    last1 = np.nan
+    last2 = np.nan
+    total = 0.0
+    started = False
+    wins = 0
+    losses = 0
+    minimum = np.nan
+    exit_total = np.nan
+
+    for i in range(columns.shape[1]):
+        wma = np.nan
+        value = columns[source, i]
+        if not (seen == 0 and np.isnan(value)):
+            window[head] = value
+            head = head + 1 if head + 1 < period else 0
+            if period == 1:
+                wma = value
+            elif seen < period - 1:
+                period_sub += value
+                period_sum += value * (seen + 1)
+            else:
+                period_sub += value
+                period_sub -= trailing
+                period_sum += value * period
+                trailing = window[head]
+                wma = period_sum / divider
+                period_sum -= period_sub
+            seen += 1
+            # head is back at the oldest value of a full window
+            if period > 1 and head == 0 and seen >= period:
+                period_sub, period_sum = wma_sums_numpy(window, 0, period)
+
+        ask = columns[ASK_INDEX, i]
+        bid = columns[BID_INDEX, i]
+        signal = 1 if columns[buy, i] > wma else 0
+        if compare_exit and columns[exit, i] < wma:
+            signal = 0
+        trigger = 0 if prev0 < 0 else signal - prev0
+        prev0 = signal
+        mask = signal | abs(trigger)
+        if trigger == 1 and not np.isnan(ask):
+            last0 = ask
+        position_value = (bid - last0 * mask) * mask
+
+        if take_profit > 0:
+            if position_value > take_profit and trigger != 1:
+                signal = 0
+            trigger = 0 if prev1 < 0 else signal - prev1
+            prev1 = signal
+            mask = signal | abs(trigger)
+            if trigger == 1 and not np.isnan(ask):
+                last1 = ask
+            position_value = (bid - last1 * mask) * mask
+
+        if stop_loss > 0:
+            if position_value < stop_loss:
+                signal = 0
+            trigger = 0 if prev2 < 0 else signal - prev2
+            prev2 = signal
+            mask = signal | abs(trigger)
+            if trigger == 1 and not np.isnan(ask):
+                last2 = ask
+            position_value = (bid - last2 * mask) * mask
+
+        value = position_value * (1 if trigger == -1 else 0)
+        addend = 0.0 if np.isnan(value) else value
+        total = total + addend if started else addend
+        started = True
+        if np.isnan(value):
+            exit_total = np.nan
+        else:
+            exit_total = total
+            if np.isnan(minimum) or total < minimum:
+                minimum = total
+        if value > 0:
+            wins += 1
+        if value < 0:
+            losses += 1
+
+    out[0] = exit_total
+    out[1] = minimum
+    out[2] = wins
+    out[3] = losses
+
+
+@jit(nopython=True)
+def bootstrap_path_numpy(
+    relative: NDArray[np.float64],
+    first: NDArray[np.float64],
+    block_size: int,
+    spread_jitter: float,
+    out: NDArray[np.float64],
+) -> None:
+    """Fill the first 12 rows of out with a block-bootstrapped path.
+
+    relative holds every candle of the history relative to the close before
+    it, so a drawn candle is scaled onto the close of the path so far.  The bid
+    and ask spreads of every drawn candle are scaled by 1 + spread_jitter * N(0,
+    1), floored at 0.  Draws come from the random state of the current thread.
+    """
+    rows = out.shape[1]
+    sources = relative.shape[1]
+    for k in range(12):
+        out[k, 0] = first[k]
+    base = first[3]
+    i = 1
+    while i < rows:
+        start = np.random.randint(0, max(1, sources - block_size + 1))
+        for s in range(start, min(start + block_size, sources)):
+            if i == rows:
+                break
+            scale = 1.0
+            if spread_jitter > 0:
+                scale = max(0.0, 1.0 + spread_jitter * np.random.standard_normal())
+            for k in range(4):
+                mid = relative[k, s]
+                out[k, i] = base * mid
+                out[4 + k, i] = base * (mid - (mid - relative[4 + k, s]) * scale)
+                out[8 + k, i] = base * (mid + (relative[8 + k, s] - mid) * scale)
+            base = out[3, i]
+            i += 1
+
+
+@jit(nopython=True, parallel=True)
+def monte_carlo_numpy(
+    relative: NDArray[np.float64],
+    first: NDArray[np.float64],
+    columns: NDArray[np.int64],
+    multipliers: NDArray[np.float64],
+    paths: int,
+    block_size: int,
+    spread_jitter: float,
+    seed: int,
+) -> NDArray[np.float64]:
+    """Score configurations on bootstrapped paths, in parallel across paths.
+
+    Every path seeds the random state of its thread with seed + path, so the
+    results do not depend on the number of threads.
+
+    Parameters
+    ----------
+    relative : NDArray[np.float64]
+        The (12 x rows - 1) history relative to the previous close.
+    first : NDArray[np.float64]
+        The 12 prices of the first candle.
+    columns : NDArray[np.int64]
+        (configs x 4) source, buy and exit rows in PATH_COLUMNS and wma period.
+    multipliers : NDArray[np.float64]
+        (configs x 2) take profit and stop loss.
+
+    Returns
+    -------
+    NDArray[np.float64]
+        (paths x configs x 4) results in the order of RESULT_FIELDS.
+
+    """
+    configs = columns.shape[0]
+    rows = relative.shape[1] + 1
+    max_period = max(1, columns[:, 3].max())
+    results = np.empty((paths, configs, 4))
+    for p in prange(paths):
+        np.random.seed(seed + p)
+        path = np.empty((24, rows))
+        bootstrap_path_numpy(relative, first, block_size, spread_jitter, path)
+        heiken_ashi_block_numpy(path[:12], path[12:], 0)
+        window = np.empty(max_period)
+        for c in range(configs):
+            simulate_numpy(
+                path,
+                columns[c, 0],
+                columns[c, 1],
+                columns[c, 2],
+                columns[c, 3],
+                multipliers[c, 0],
+                multipliers[c, 1],
+                window,
+                results[p, c],
+            )
+    return results
+
+
+def config_arrays(
+    configs: list[KernelConfig],
+) -> tuple[NDArray[np.int64], NDArray[np.float64]]:
+    """Encode kernel configurations for simulate_numpy and monte_carlo_numpy."""
+    columns = np.array(
+        [
+            [
+                PATH_COLUMNS.index(config.source_column),
+                PATH_COLUMNS.index(config.signal_buy_column),
+                PATH_COLUMNS.index(config.signal_exit_column),
+                config.wma_period,
+            ]
+            for config in configs
+        ],
+        dtype=np.int64,
+    ).reshape(-1, 4)
+    multipliers = np.array(
+        [[config.take_profit, config.stop_loss] for config in configs],
+        dtype=np.float64,
+    ).reshape(-1, 2)
+    return columns, multipliers
+
+
+def monte_carlo(
+    candles: dict[str, NDArray[Any]],
+    configs: list[KernelConfig],
+    config: MonteCarloConfig,
+) -> dict[str, NDArray[np.float64]]:
+    """Run configurations over block-bootstrapped copies of the candles.
+
+    Parameters
+    ----------
+    candles : dict[str, NDArray]
+        The CANDLE_COLUMNS of the complete candles, see core.kernel.candle_columns.
+    configs : list[KernelConfig]
+        The configurations to score.
+    config : MonteCarloConfig
+        The number of paths and how they are resampled.
+
+    Returns
+    -------
+    dict[str, NDArray[np.float64]]
+        A (paths x configs) array of every field of RESULT_FIELDS.
+
+    """
+    block = np.stack([np.asarray(candles[name], dtype=np.float64) for name in CANDLE_COLUMNS])
+    if block.shape[1] < 2:
+        raise ValueError("monte carlo needs at least 2 candles")
+    columns, multipliers = config_arrays(configs)
+    results = monte_carlo_numpy(
+        block[:, 1:] / block[3, :-1],
+        block[:, 0].copy(),
+        columns,
+        multipliers,
+        config.paths,
+        config.block_size,
+        config.spread_jitter,
+        config.seed,
+    )
+    return {field: results[:, :, i] for i, field in enumerate(RESULT_FIELDS)}
+
+
+def summarize(results: dict[str, NDArray[np.float64]]) -> list[dict[str, float]]:
+    """Summarize the distribution of the outcomes of every configuration.
+
+    Returns
+    -------
+    list[dict[str, float]]
+        Per configuration the mean, standard deviation and 5th, 50th and 95th
+        percentile of the exit total over the paths, the share of profitable
+        paths, the 5th percentile of the min exit total and the mean wins and
+        losses.  Paths without a closed trade count as an exit total of 0.
+
+    """
+    # NaN means no trade was closed on the path
+    exit_total = np.nan_to_num(results["exit_total"])
+    p5, p50, p95 = np.percentile(exit_total, [5, 50, 95], axis=0)
+    mean = exit_total.mean(axis=0)
+    std = exit_total.std(axis=0)
+    profitable = np.mean(exit_total > 0, axis=0)
+    min_p5 = np.percentile(np.nan_to_num(results["min_exit_total"]), 5, axis=0)
+    wins = results["wins"].mean(axis=0)
+    losses = results["losses"].mean(axis=0)
+    return [
+        {
+            "mean": float(mean[c]),
+            "std": float(std[c]),
+            "p5": float(p5[c]),
+            "p50": float(p50[c]),
+            "p95": float(p95[c]),
+            "profitable": float(profitable[c]),
+            "min_exit_total_p5": float(min_p5[c]),
+            "wins": float(wins[c]),
+            "losses": float(losses[c]),
+        }
+        for c in range(exit_total.shape[1])
+    ]
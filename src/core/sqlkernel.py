@@ -0,0 +1,454 @@
+"""Run the kernel pipeline inside SQLite with user-defined functions.
+
+SQLite stands in locally for the ohlchistory table of src/sql.  The Heikin
+Ashi, WMA and trade accounting stages are running window functions, the WMA
+signal is a scalar function and kernel_metrics is an aggregate reducing the
+candles of a query to the METRIC_FIELDS of a configuration:
+
+    select timestamp, ha_close(open, high, low, close) over w
+    from ohlchistory
+    window w as (order by timestamp rows between unbounded preceding and current row)
+
+Window functions cannot be nested, so a pipeline stages them in subqueries, see
+exit_total_query.
+The window functions hold the state of the resumable *_numpy stages and repeat
+their arithmetic row by row, the WMA that of core.calc.wma_numpy, so they give
+the results of core.kernel.  The aggregate collects the candles and runs the
+compiled pipeline once.
+"""
+
+import abc
+import math
+import sqlite3
+from typing import Any
+
+import numpy as np
+import orjson
+
+from core.calc import METRIC_FIELDS
+from core.kernel import KernelConfig, NodeCache, Pipeline, metrics_node
+from core.store import CANDLE_COLUMNS
+
+# the SQLite version of the ohlchistory table of src/sql/00020_tables.sql
+HISTORY_SCHEMA = f"""
+create table if not exists ohlchistory (
+    id integer primary key,
+    token0 text not null,
+    token1 text not null,
+    timestamp text not null,
+    {", ".join(f"{name} real" for name in CANDLE_COLUMNS)}
+);
+create index if not exists ohlchistory_pair on ohlchistory (token0, token1, timestamp);
+"""
+
+
+def _float(value: float | None) -> float:
+    """Return a SQL value as a float, SQLite stores NaN as NULL."""
+    return math.nan if value is None else float(value)
+
+
+def _sql(value: float) -> float | None:
+    """Return a float as a SQL value, NaN as NULL."""
+    return None if math.isnan(value) else value
+
+
+class _Running(abc.ABC):
+    """A window function over a frame that only grows, like a running total."""
+
+    def inverse(self, *args: Any) -> None:
+        """Reject frames that drop rows, the stages only run forward."""
+        raise sqlite3.NotSupportedError(
+            "kernel window functions need 'rows between unbounded preceding and current row'"
+        )
+
+    def finalize(self) -> float | None:
+        """Return the value of the last row."""
+        return self.value()
+
+    @abc.abstractmethod
+    def value(self) -> float | None:
+        """Return the value of the current row, NULL for NaN."""
+
+
+class _HeikinAshi(_Running):
+    """The Heikin Ashi candle of core.chart.heiken_ashi_numpy, row by row."""
+
+    part = ""
+
+    def __init__(self) -> None:
+        """Initialize a _HeikinAshi object."""
+        self.started = False
+        self.ha_open = math.nan
+        self.ha_close = math.nan
+        self.high = math.nan
+        self.low = math.nan
+
+    def step(
+        self,
+        c_open: float | None,
+        c_high: float | None,
+        c_low: float | None,
+        c_close: float | None,
+    ) -> None:
+        """Add a candle."""
+        c_open, c_high, c_low, c_close = map(_float, (c_open, c_high, c_low, c_close))
+        if self.started:
+            self.ha_open = (self.ha_open + self.ha_close) / 2
+        else:
+            self.ha_open = (c_open + c_close) / 2
+            self.started = True
+        self.ha_close = (c_open + c_high + c_low + c_close) / 4
+        self.high = c_high
+        self.low = c_low
+
+    def value(self) -> float | None:
+        """Return the part of the Heikin Ashi candle of the current row."""
+        if self.part == "open":
+            return _sql(self.ha_open)
+        if self.part == "close":
+            return _sql(self.ha_close)
+        values = (self.ha_open, self.ha_close, self.high if self.part == "high" else self.low)
+        if any(math.isnan(value) for value in values):
+            return None
+        return max(values) if self.part == "high" else min(values)
+
+
+class _HeikinAshiOpen(_HeikinAshi):
+    part = "open"
+
+
+class _HeikinAshiHigh(_HeikinAshi):
+    part = "high"
+
+
+class _HeikinAshiLow(_HeikinAshi):
+    part = "low"
+
+
+class _HeikinAshiClose(_HeikinAshi):
+    part = "close"
+
+
+class _WeightedMovingAverage(_Running):
+    """The weighted moving average of core.calc.wma_numpy, row by row."""
+
+    def __init__(self) -> None:
+        """Initialize a _WeightedMovingAverage object."""
+        self.period = 0
+        self.window: list[float] = []
+        self.period_sub = 0.0
+        self.period_sum = 0.0
+        self.trailing = 0.0
+        self.seen = 0
+        self.current = math.nan
+
+    def step(self, value: float | None, period: int) -> None:
+        """Add a source price."""
+        if self.period == 0:
+            if period < 1:
+                raise ValueError(f"wma period must be at least 1, got {period}")
+            self.period = period
+            self.window = [0.0] * period
+        value = _float(value)
+        self.current = math.nan
+        # TA-Lib skips leading NaNs
+        if self.seen == 0 and math.isnan(value):
+            return
+        period = self.period
+        self.window[self.seen % period] = value
+        if period == 1:
+            self.current = value
+        elif self.seen < period - 1:
+            self.period_sub += value
+            self.period_sum += value * (self.seen + 1)
+        else:
+            self.period_sub += value
+            self.period_sub -= self.trailing
+            self.period_sum += value * period
+            self.trailing = self.window[(self.seen - period + 1) % period]
+            self.current = self.period_sum / ((period * (period + 1)) >> 1)
+            self.period_sum -= self.period_sub
+        self.seen += 1
+        # rebuild the sums like wma_numpy whenever the window is full again
+        if period > 1 and self.seen % period == 0:
+            self.period_sub = 0.0
+            self.period_sum = 0.0
+            for k, value in enumerate(self.window):
+                self.period_sub += value
+                self.period_sum += k * value
+
+    def value(self) -> float | None:
+        """Return the weighted moving average of the current row."""
+        return _sql(self.current)
+
+
+def wma_signal(buy: float | None, exit: float | None, wma: float | None) -> int:
+    """Return the signal of core.calc.wma_signals_numpy for one row.
+
+    Comparing the exit column too does not change the signal when it is the buy
+    column, so the scalar function always does.
+    """
+    wma = _float(wma)
+    signal = 1 if _float(buy) > wma else 0
+    if _float(exit) < wma:
+        signal = 0
+    return signal
+
+
+class _Stage:
+    """The trigger and entry price of a signal stage, see core.calc.entry_price_numpy."""
+
+    __slots__ = ("prev", "last_entry", "trigger", "position_value")
+
+    def __init__(self) -> None:
+        """Initialize a _Stage object."""
+        self.prev = -1
+        self.last_entry = math.nan
+        self.trigger = 0
+        self.position_value = math.nan
+
+    def step(self, signal: int, ask: float, bid: float) -> None:
+        """Update the trigger and position value for the signal of a row."""
+        self.trigger = 0 if self.prev < 0 else signal - self.prev
+        self.prev = signal
+        mask = signal | abs(self.trigger)
+        if self.trigger == 1 and not math.isnan(ask):
+            self.last_entry = ask
+        self.position_value = (bid - self.last_entry * mask) * mask
+
+
+class _ExitTotal(_Running):
+    """The exit total of the kernel pipeline for a signal, row by row.
+
+    The take profit and stop loss stages run like in core.kernel.position_node,
+    skipped when 0, and the totals are those of core.calc.exit_total_numpy.
+    """
+
+    def __init__(self) -> None:
+        """Initialize a _ExitTotal object."""
+        self.stages = (_Stage(), _Stage(), _Stage())
+        self.total = 0.0
+        self.started = False
+        self.exit_total = math.nan
+
+    def step(
+        self,
+        signal: int | None,
+        ask: float | None,
+        bid: float | None,
+        take_profit: float,
+        stop_loss: float,
+    ) -> None:
+        """Add the signal and prices of a row."""
+        ask = _float(ask)
+        bid = _float(bid)
+        signal = 0 if signal is None else int(signal)
+        stage = self.stages[0]
+        stage.step(signal, ask, bid)
+        if take_profit > 0:
+            if stage.position_value > take_profit and stage.trigger != 1:
+                signal = 0
+            stage = self.stages[1]
+            stage.step(signal, ask, bid)
+        if stop_loss > 0:
+            if stage.position_value < stop_loss:
+                signal = 0
+            stage = self.stages[2]
+            stage.step(signal, ask, bid)
+
+        value = stage.position_value * (1 if stage.trigger == -1 else 0)
+        addend = 0.0 if math.isnan(value) else value
+        self.total = self.total + addend if self.started else addend
+        self.started = True
+        self.exit_total = math.nan if math.isnan(value) else self.total
+
+    def value(self) -> float | None:
+        """Return the exit total of the current row."""
+        return _sql(self.exit_total)
+
+
+class _KernelMetrics:
+    """Reduce the candles of a query to the metrics of a kernel configuration.
+
+    The rows are ordered by the timestamp argument, so the aggregate does not
+    depend on the order SQLite visits them in.
+    """
+
+    def __init__(self) -> None:
+        """Initialize a _KernelMetrics object."""
+        self.timestamps: list[Any] = []
+        self.rows: list[tuple[float | None, ...]] = []
+        self.config: KernelConfig | None = None
+        self.periods_per_year = 0.0
+
+    def step(self, timestamp: Any, *args: Any) -> None:
+        """Add a candle, the configuration is read from the first row."""
+        if self.config is None:
+            (
+                source,
+                buy,
+                exit,
+                period,
+                take_profit,
+                stop_loss,
+                periods_per_year,
+            ) = args[len(CANDLE_COLUMNS) :]
+            self.config = KernelConfig(
+                signal_buy_column=buy,
+                signal_exit_column=exit,
+                source_column=source,
+                wma_period=int(period),
+                take_profit=float(take_profit),
+                stop_loss=float(stop_loss),
+            )
+            self.periods_per_year = float(periods_per_year)
+        self.timestamps.append(timestamp)
+        self.rows.append(args[: len(CANDLE_COLUMNS)])
+
+    def finalize(self) -> str | None:
+        """Return the metrics as a JSON object, NULL without rows."""
+        if self.config is None:
+            return None
+        order = sorted(range(len(self.timestamps)), key=self.timestamps.__getitem__)
+        # None becomes NaN
+        block = np.array([self.rows[i] for i in order], dtype=np.float64).T
+        columns = {name: block[i] for i, name in enumerate(CANDLE_COLUMNS)}
+        node = metrics_node(self.config, self.periods_per_year)
+        output = Pipeline({"record": node}).run(columns, NodeCache())
+        metrics = output["record"]["metrics"].tolist()
+        return orjson.dumps(
+            {name: _sql(value) for name, value in zip(METRIC_FIELDS, metrics)}
+        ).decode()
+
+
+def register(conn: sqlite3.Connection) -> sqlite3.Connection:
+    """Register the kernel functions on a connection.
+
+    Window functions, over a running frame ordered by timestamp:
+        ha_open, ha_high, ha_low, ha_close(open, high, low, close)
+        wma(value, period)
+        exit_total(signal, ask, bid, take_profit, stop_loss)
+    Scalar function:
+        wma_signal(buy, exit, wma)
+    Aggregate function, returning the METRIC_FIELDS as a JSON object:
+        kernel_metrics(timestamp, <CANDLE_COLUMNS>, source_column,
+            signal_buy_column, signal_exit_column, wma_period, take_profit,
+            stop_loss, periods_per_year)
+    """
+    for part, window in [
+        ("open", _HeikinAshiOpen),
+        ("high", _HeikinAshiHigh),
+        ("low", _HeikinAshiLow),
+        ("close", _HeikinAshiClose),
+    ]:
+        conn.create_window_function(f"ha_{part}", 4, window)
+    conn.create_window_function("wma", 2, _WeightedMovingAverage)
+    conn.create_window_function("exit_total", 5, _ExitTotal)
+    conn.create_function("wma_signal", 3, wma_signal, deterministic=True)
+    conn.create_aggregate("kernel_metrics", 1 + len(CANDLE_COLUMNS) + 7, _KernelMetrics)
+    return conn
+
+
+def _column_sql(name: str) -> str:
+    """Return the SQL of a kernel column, a Heikin Ashi column as a window function."""
+    if not name.startswith("ha_"):
+        return name
+    prefix, _, part = name[len("ha_") :].rpartition("_")
+    prefix = f"{prefix}_" if prefix else ""
+    columns = ", ".join(f"{prefix}{price}" for price in ["open", "high", "low", "close"])
+    return f"ha_{part}({columns}) over w"
+
+
+def exit_total_query(config: KernelConfig) -> str:
+    """Return the query of the timestamp and exit total of every row of a pair.
+
+    The stages of the kernel pipeline of the configuration run as window
+    functions, one subquery per nesting level.  The parameters are token0 and
+    token1.
+    """
+    window = "window w as (order by timestamp rows between unbounded preceding and current row)"
+    return f"""
+        select timestamp,
+            exit_total(wma_signal(buy, exit, wma), ask_close, bid_close,
+                {float(config.take_profit)}, {float(config.stop_loss)}) over w
+        from (
+            select timestamp, buy, exit, ask_close, bid_close,
+                wma(source, {int(config.wma_period)}) over w as wma
+            from (
+                select timestamp, ask_close, bid_close,
+                    {_column_sql(config.source_column)} as source,
+                    {_column_sql(config.signal_buy_column)} as buy,
+                    {_column_sql(config.signal_exit_column)} as exit
+                from ohlchistory where token0 = ? and token1 = ?
+                {window}
+            )
+            {window}
+        )
+        {window}
+    """
+
+
+def insert_history(
+    conn: sqlite3.Connection,
+    token0: str,
+    token1: str,
+    timestamps: np.ndarray,
+    block: np.ndarray,
+) -> int:
+    """Append candles to the ohlchistory table, creating it if needed.
+
+    Parameters
+    ----------
+    timestamps : np.ndarray
+        Epoch-nanosecond timestamps, stored as UTC datetime text.
+    block : np.ndarray
+        A (12 x rows) block in the order of CANDLE_COLUMNS.
+
+    Returns
+    -------
+    int
+        The number of rows inserted.
+
+    """
+    conn.executescript(HISTORY_SCHEMA)
+    text = np.datetime_as_string(np.asarray(timestamps, dtype="datetime64[ns]"), unit="s")
+    conn.executemany(
+        f"insert into ohlchistory (token0, token1, timestamp, {', '.join(CANDLE_COLUMNS)}) "
+        f"values (?, ?, ?, {', '.join('?' * len(CANDLE_COLUMNS))})",
+        (
+            (token0, token1, str(timestamp), *values)
+            for timestamp, values in zip(text, block.T.tolist())
+        ),
+    )
+    conn.commit()
+    return len(text)
+
+
+def kernel_metrics(
+    conn: sqlite3.Connection,
+    token0: str,
+    token1: str,
+    config: KernelConfig,
+    periods_per_year: float,
+) -> dict[str, float | None]:
+    """Compute the metrics of a configuration over the stored candles of a pair in place.
+
+    periods_per_year is the number of candles in a year, see
+    bot.exchange.periods_per_year.
+    """
+    row = conn.execute(
+        f"select kernel_metrics(timestamp, {', '.join(CANDLE_COLUMNS)}, ?, ?, ?, ?, ?, ?, ?) "
+        "from ohlchistory where token0 = ? and token1 = ?",
+        (
+            config.source_column,
+            config.signal_buy_column,
+            config.signal_exit_column,
+            config.wma_period,
+            config.take_profit,
+            config.stop_loss,
+            periods_per_year,
+            token0,
+            token1,
+        ),
+    ).fetchone()
+    return {} if row[0] is None else orjson.loads(row[0])
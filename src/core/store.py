@@ -0,0 +1,227 @@
+"""Memory-mapped columnar candle store shared between processes.
+
+A store is a single file with a fixed layout::
+
+    header    64 bytes, see HEADER_DTYPE
+    timestamp int64[capacity]      epoch nanoseconds
+    open      float64[capacity]
+    ...       one block per entry of CANDLE_COLUMNS
+    ask_close float64[capacity]
+
+The file is created at its full size, which stays sparse on disk until rows are
+written.  Rows are only ever appended and the row count in the header is
+updated after the rows themselves, so readers mapping the same file see a
+consistent prefix and pick up new rows as soon as the count changes.  Every
+reader gets NumPy views straight onto the page cache, so any number of
+processes share one physical copy of the candles.
+"""
+
+import os
+from typing import Any
+
+import numpy as np
+import pandas as pd
+from numpy.typing import NDArray
+
+MAGIC = b"UDCANDLE"
+VERSION = 1
+HEADER_SIZE = 64
+DEFAULT_CAPACITY = 10_000_000
+
+CANDLE_COLUMNS = [
+    "open",
+    "high",
+    "low",
+    "close",
+    "bid_open",
+    "bid_high",
+    "bid_low",
+    "bid_close",
+    "ask_open",
+    "ask_high",
+    "ask_low",
+    "ask_close",
+]
+
+HEADER_DTYPE = np.dtype(
+    [
+        ("magic", "S8"),
+        ("version", "<u4"),
+        ("columns", "<u4"),
+        ("capacity", "<u8"),
+        ("count", "<u8"),
+        ("reserved", "<u8", (4,)),
+    ]
+)
+
+
+def to_epoch_ns(timestamps: Any) -> NDArray[np.int64]:
+    """Convert timestamps (strings, datetimes or integers) to int64 epoch nanoseconds."""
+    values = np.asarray(timestamps)
+    if values.dtype == np.int64:
+        return values
+    return (
+        pd.to_datetime(values, utc=True)
+        .tz_localize(None)
+        .to_numpy()
+        .astype("datetime64[ns]")
+        .view(np.int64)
+    )
+
+
+class _CandleFile:
+    """Views onto a mapped candle store file."""
+
+    def __init__(self, path: str, mode: str):
+        self.path = path
+        self._mm = np.memmap(path, dtype=np.uint8, mode=mode)
+        self.header = np.ndarray((), dtype=HEADER_DTYPE, buffer=self._mm, offset=0)
+        if bytes(self.header["magic"]) != MAGIC:
+            raise ValueError(f"{path} is not a candle store")
+        if int(self.header["version"]) != VERSION:
+            raise ValueError(f"{path} has unsupported version {self.header['version']}")
+
+        self.capacity = int(self.header["capacity"])
+        self._timestamps = np.ndarray(
+            (self.capacity,), dtype="<i8", buffer=self._mm, offset=HEADER_SIZE
+        )
+        self._block = np.ndarray(
+            (len(CANDLE_COLUMNS), self.capacity),
+            dtype="<f8",
+            buffer=self._mm,
+            offset=HEADER_SIZE + 8 * self.capacity,
+        )
+
+    def __len__(self) -> int:
+        """Return the number of rows published so far."""
+        return int(self.header["count"])
+
+
+class CandleWriter(_CandleFile):
+    """Append-only writer of a candle store, creating the file if needed."""
+
+    def __init__(self, path: str, capacity: int = DEFAULT_CAPACITY):
+        """Initialize a CandleWriter object."""
+        if not os.path.exists(path):
+            header = np.zeros((), dtype=HEADER_DTYPE)
+            header["magic"] = MAGIC
+            header["version"] = VERSION
+            header["columns"] = len(CANDLE_COLUMNS)
+            header["capacity"] = capacity
+            with open(path, "wb") as f:
+                f.write(header.tobytes())
+                f.truncate(HEADER_SIZE + 8 * capacity * (1 + len(CANDLE_COLUMNS)))
+        super().__init__(path, "r+")
+
+    def last_timestamp(self) -> int | None:
+        """Return the newest timestamp, or None if the store is empty."""
+        count = len(self)
+        return int(self._timestamps[count - 1]) if count > 0 else None
+
+    def append(self, timestamps: NDArray[np.int64], values: NDArray[np.float64]) -> int:
+        """Append rows and publish them to readers.
+
+        Parameters
+        ----------
+        timestamps : NDArray[np.int64]
+            Strictly increasing epoch nanoseconds, newer than the last stored row.
+        values : NDArray[np.float64]
+            A (12 x rows) block in the order of CANDLE_COLUMNS.
+
+        Returns
+        -------
+        int
+            The number of rows in the store.
+
+        """
+        count = len(self)
+        rows = len(timestamps)
+        if rows == 0:
+            return count
+        if count + rows > self.capacity:
+            raise ValueError(f"{self.path} is full ({self.capacity} rows)")
+        last = self.last_timestamp()
+        if (last is not None and timestamps[0] <= last) or np.any(
+            np.diff(timestamps) <= 0
+        ):
+            raise ValueError("timestamps must be strictly increasing")
+
+        self._timestamps[count : count + rows] = timestamps
+        self._block[:, count : count + rows] = values
+        # publish the rows only once they are written
+        self.header["count"] = count + rows
+        return count + rows
+
+    def append_new(
+        self, timestamps: NDArray[np.int64], values: NDArray[np.float64]
+    ) -> int:
+        """Append the rows that are newer than the store, see append."""
+        last = self.last_timestamp()
+        if last is None:
+            return self.append(timestamps, values)
+        new = timestamps > last
+        return self.append(timestamps[new], values[:, new])
+
+    def append_frame(self, df: pd.DataFrame) -> int:
+        """Append the rows of an OHLC DataFrame that are newer than the store.
+
+        The timestamps are taken from the 'timestamp' column, or from the index
+        when there is no such column.
+        """
+        timestamps = to_epoch_ns(
+            df["timestamp"] if "timestamp" in df.columns else df.index
+        )
+        return self.append_new(
+            timestamps, df[CANDLE_COLUMNS].to_numpy(dtype=np.float64).T
+        )
+
+    def flush(self) -> None:
+        """Flush the mapped pages to disk."""
+        self._mm.flush()
+
+
+class CandleReader(_CandleFile):
+    """Read-only zero-copy views of a candle store."""
+
+    def __init__(self, path: str):
+        """Initialize a CandleReader object."""
+        super().__init__(path, "r")
+
+    def rows(self, start: int = 0) -> slice:
+        """Return the slice of the published rows from row start.
+
+        A negative start counts back from the last row, like a list index, and
+        is clamped to the first row.
+        """
+        count = len(self)
+        if start < 0:
+            start = max(0, count + start)
+        return slice(start, count)
+
+    def timestamps(self, start: int = 0) -> NDArray[np.int64]:
+        """Return a view of the timestamps from row start, see rows."""
+        return self._timestamps[self.rows(start)]
+
+    def block(self, start: int = 0) -> NDArray[np.float64]:
+        """Return a (12 x rows) view of the prices from row start, see rows."""
+        return self._block[:, self.rows(start)]
+
+    def column(self, name: str, start: int = 0) -> NDArray[np.float64]:
+        """Return a view of one price column from row start, see rows."""
+        return self._block[CANDLE_COLUMNS.index(name), self.rows(start)]
+
+    def columns(self, start: int = 0) -> dict[str, NDArray[np.float64]]:
+        """Return views of every price column from row start, see rows."""
+        rows = self.rows(start)
+        return {name: self._block[i, rows] for i, name in enumerate(CANDLE_COLUMNS)}
+
+    def to_frame(self, start: int = 0) -> pd.DataFrame:
+        """Copy rows from start into a DataFrame shaped like getOandaOHLC, see rows.
+
+        The timestamp column holds the int64 epoch nanoseconds of the store.
+        """
+        rows = self.rows(start)
+        data: dict[str, Any] = {"timestamp": self._timestamps[rows].copy()}
+        for i, name in enumerate(CANDLE_COLUMNS):
+            data[name] = self._block[i, rows].copy()
+        return pd.DataFrame(data)
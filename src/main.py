@@ -6,7 +6,16 @@ import sys
 import yaml
 
 from bot.backtest import ChartConfig, SignalConfig, backtest
+from bot.benchmarks import BENCHMARKS
 from bot.bot import TradeConfig, bot
+from bot.dashboard import DashboardConfig
+from bot.optimizer import OptimizerConfig
+from core.ingest import IngestConfig, ingest_swaps
+from core.montecarlo import MonteCarloConfig
+from bot.reoptimize import ReoptimizeConfig
+from bot.replay import ReplayConfig, replay
+from bot.service import JobService, ServiceConfig
+from bot.shadow import ShadowConfig
 
 logging.root.handlers = []
 
@@ -30,8 +39,19 @@ if __name__ == "__main__":
         conf = yaml.safe_load(open(sys.argv[3]))
         chart_conf = ChartConfig(**conf["chart_config"])
         token = sys.argv[2]
+        optimizer_conf = None
+        if "optimizer_config" in conf:
+            optimizer_conf = OptimizerConfig(**conf["optimizer_config"])
+        montecarlo_conf = None
+        if "montecarlo_config" in conf:
+            montecarlo_conf = MonteCarloConfig(**(conf["montecarlo_config"] or {}))
 
-        result = backtest(chart_conf, token=token)
+        result = backtest(
+            chart_conf,
+            token=token,
+            optimizer_config=optimizer_conf,
+            montecarlo_config=montecarlo_conf,
+        )
         logger.info(result)
         if result is None:
             sys.exit(1)
@@ -43,13 +63,59 @@ if __name__ == "__main__":
         chart_conf = ChartConfig(**conf["chart_config"])
         signal_conf = SignalConfig(**conf["signal_config"])
         trade_conf = TradeConfig(**conf["trade_config"])
+        dashboard_conf = None
+        if "dashboard_config" in conf:
+            dashboard_conf = DashboardConfig(**(conf["dashboard_config"] or {}))
+        shadow_conf = None
+        if "shadow_config" in conf:
+            shadow_conf = ShadowConfig(**(conf["shadow_config"] or {}))
+        reoptimize_conf = None
+        if "reoptimize_config" in conf:
+            reoptimize_conf = ReoptimizeConfig(**(conf["reoptimize_config"] or {}))
         bot(
             token=token,
             account_id=account_id,
             chart_conf=chart_conf,
             signal_conf=signal_conf,
             trade_conf=trade_conf,
+            dashboard_conf=dashboard_conf,
+            shadow_conf=shadow_conf,
+            reoptimize_conf=reoptimize_conf,
         )
+    elif "replay" in sys.argv[1]:
+        logger = get_logger("replay.log")
+        conf = yaml.safe_load(open(sys.argv[2]))
+        chart_conf = ChartConfig(**conf["chart_config"])
+        signal_conf = SignalConfig(**conf["signal_config"])
+        trade_conf = TradeConfig(**conf["trade_config"])
+        replay_conf = ReplayConfig(**(conf.get("replay_config") or {}))
+        result = replay(chart_conf, signal_conf, trade_conf, replay_conf)
+        for order in result.orders:
+            logger.info("order %s %s %s", *order)
+        if len(result.mismatches) > 0:
+            sys.exit(1)
+    elif "ingest" in sys.argv[1]:
+        logger = get_logger("ingest.log")
+        conf = yaml.safe_load(open(sys.argv[2]))
+        chart_conf = ChartConfig(**conf["chart_config"])
+        if chart_conf.store_path is None:
+            logger.error("ingest needs a store_path in the chart config")
+            sys.exit(1)
+        ingest_swaps(IngestConfig(**conf["ingest_config"]), chart_conf.store_path)
+    elif "serve" in sys.argv[1]:
+        logger = get_logger("service.log")
+        conf = yaml.safe_load(open(sys.argv[2]))
+        service = JobService(ServiceConfig(**(conf.get("service_config") or {}))).start()
+        try:
+            if service.server.thread is not None:
+                service.server.thread.join()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            service.stop()
+    elif "bench" in sys.argv[1]:
+        logger = get_logger("bench.log")
+        BENCHMARKS[sys.argv[2]]()
     else:
         print(sys.argv)
         print("""
@@ -57,4 +123,8 @@ if __name__ == "__main__":
               Usage: 
                 python main.py backtest <token> <my_config>.yaml
                 python main.py bot <token> <account_id> <my_config>.yaml
+                python main.py replay <my_config>.yaml
+                python main.py ingest <my_config>.yaml
+                python main.py serve <my_config>.yaml
+                python main.py bench <benchmark>
               """)
@@ -0,0 +1,42 @@
+"""The live chart dashboard fed by the bot cycles."""
+
+from typing import Iterator
+
+import numpy as np
+import pytest
+
+from bot.dashboard import DASHBOARD_COLUMNS, Dashboard, DashboardConfig
+from core.frame import CandleFrame
+
+
+@pytest.fixture
+def dashboard() -> Iterator[Dashboard]:
+    """Return a dashboard whose worker is not started."""
+    dashboard = Dashboard(DashboardConfig(port=0, warmup=0))
+    yield dashboard
+    dashboard.server.server_close()
+
+
+def test_published_frame_is_not_changed_by_the_next_cycle(dashboard: Dashboard):
+    """Rewriting the candle buffer after publish leaves the queued frame intact."""
+    rows = 50
+    buffer = {
+        "close": np.linspace(150.0, 151.0, rows),
+        "wma": np.linspace(149.0, 150.0, rows),
+        "signal": np.ones(rows),
+        "trigger": np.zeros(rows),
+    }
+    frame = CandleFrame(np.arange(rows, dtype=np.int64), dict(buffer))
+    expected = {column: buffer[column].copy() for column in DASHBOARD_COLUMNS}
+    dashboard.publish(frame)
+
+    # the next cycle merges candles into the same arrays
+    for values in buffer.values():
+        values[:] = -1.0
+    frame.index[:] += rows
+
+    update = dashboard.update(dashboard.pending.get_nowait())
+    assert update is not None
+    np.testing.assert_array_equal(update["time"], np.arange(rows))
+    for column in DASHBOARD_COLUMNS:
+        np.testing.assert_array_equal(update[column], expected[column])
@@ -0,0 +1,227 @@
+"""The exchange helpers and the Oanda client against the mock server."""
+
+from datetime import datetime
+from time import perf_counter, time_ns
+from typing import Iterator
+
+import numpy as np
+import pytest
+
+from bot.clock import VirtualClock
+from bot.exchange import (
+    OandaClient,
+    OrderTemplate,
+    RetryConfig,
+    TradeLatency,
+    next_candle_close,
+    parse_times,
+)
+from bot.mock_oanda import MockOandaHandler, MockOandaServer
+
+
+def ns(time: str) -> int:
+    """Return the epoch nanoseconds of an RFC3339 UTC time."""
+    return int(parse_times([time])[0])
+
+
+def test_next_candle_close_intraday_is_epoch_aligned():
+    """Up to H1 the candles close on multiples of their length."""
+    now = ns("2024-01-03T10:07:30Z")
+    assert next_candle_close(now, "M5") == ns("2024-01-03T10:10:00Z")
+    assert next_candle_close(now, "H1") == ns("2024-01-03T11:00:00Z")
+    assert next_candle_close(now, "M5", ns("2024-01-03T10:05:00Z")) == ns(
+        "2024-01-03T10:10:00Z"
+    )
+
+
+@pytest.mark.parametrize(
+    "granularity, last_time, expected",
+    [
+        # daily candles open at 17:00 New York time
+        ("D", "2024-01-02T22:00:00Z", "2024-01-03T22:00:00Z"),
+        ("H4", "2024-01-03T06:00:00Z", "2024-01-03T10:00:00Z"),
+        ("H4", "2024-01-03T10:00:00Z", "2024-01-03T14:00:00Z"),
+        # the last candle is older than one period, e.g. over a weekend
+        ("H2", "2024-01-02T22:00:00Z", "2024-01-03T10:00:00Z"),
+    ],
+)
+def test_next_candle_close_aligns_on_last_candle(
+    granularity: str, last_time: str, expected: str
+):
+    """Longer granularities are aligned on the last candle, not the epoch."""
+    now = ns("2024-01-03T10:00:00Z") - 1
+    assert next_candle_close(now, granularity, ns(last_time)) == ns(expected)
+
+
+@pytest.mark.parametrize("granularity", ["H2", "H12", "D", "W"])
+def test_next_candle_close_needs_last_candle(granularity: str):
+    """Without a last candle the granularities above H1 cannot be aligned."""
+    with pytest.raises(ValueError):
+        next_candle_close(ns("2024-01-03T10:00:00Z"), granularity)
+
+
+def test_parse_times_is_int64():
+    """Oanda times parse to int64 epoch nanoseconds."""
+    times = parse_times(["1970-01-01T00:00:01.000000000Z"])
+    assert times.dtype == np.int64
+    assert times[0] == 1_000_000_000
+
+
+class CountingHandler(MockOandaHandler):
+    """Count the connections the mock server accepts."""
+
+    connections = 0
+
+    def setup(self) -> None:
+        """Count a new connection."""
+        type(self).connections += 1
+        super().setup()
+
+
+@pytest.fixture
+def server() -> Iterator[MockOandaServer]:
+    """Serve a fresh mock Oanda API that counts its connections."""
+    CountingHandler.connections = 0
+    server = MockOandaServer(handler=CountingHandler).start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def client(server: MockOandaServer) -> Iterator[OandaClient]:
+    """Return a client of the mock server that retries without waiting."""
+    client = OandaClient(
+        "mock",
+        "mock",
+        "USD_JPY",
+        hostname="127.0.0.1",
+        port=server.port,
+        ssl=False,
+        retry=RetryConfig(max_attempts=3, base_delay=0.001, max_delay=0.001),
+    )
+    yield client
+    client.close()
+
+
+def test_client_retries_injected_503(server: MockOandaServer, client: OandaClient):
+    """503 responses are retried until a request succeeds."""
+    server.state.fail_next = 2
+    times, block = client.get_candle_arrays("M5", count=10)
+    assert len(times) == 10 and block.shape == (12, 10)
+    stats = client.latency.summary()["candles"]
+    assert (stats["count"], stats["errors"]) == (3, 2)
+
+
+def test_client_gives_up_after_max_attempts(
+    server: MockOandaServer, client: OandaClient
+):
+    """The last error is raised once every attempt failed."""
+    server.state.fail_next = 5
+    with pytest.raises(Exception, match="503"):
+        client.get_open_trades()
+    assert server.state.fail_next == 2
+
+
+def test_client_does_not_retry_client_errors(
+    server: MockOandaServer, client: OandaClient
+):
+    """4xx responses other than 429 are raised on the first attempt."""
+    with pytest.raises(Exception, match="404"):
+        client.request("unknown", "GET", "/v3/unknown")
+    assert client.latency.summary()["unknown"]["count"] == 1
+
+
+def test_client_sends_orders_once(server: MockOandaServer, client: OandaClient):
+    """A market order is not retried, a retry could fill it twice."""
+    server.state.fail_next = 1
+    with pytest.raises(Exception, match="503"):
+        client.place_market_order(OrderTemplate("USD_JPY", 1000))
+    assert server.state.trades == []
+    trade_id = client.place_market_order(OrderTemplate("USD_JPY", 1000))
+    assert [trade["id"] for trade in server.state.trades] == [str(trade_id)]
+
+
+def test_client_reuses_keep_alive_connection(
+    server: MockOandaServer, client: OandaClient
+):
+    """Consecutive requests, retries included, share one connection."""
+    for _ in range(10):
+        client.get_candle_arrays("M5", count=10)
+        client.get_open_trades()
+    server.state.fail_next = 2
+    client.get_open_trades()
+    trade_id = client.place_market_order(OrderTemplate("USD_JPY", 1000))
+    client.close_trade(trade_id)
+    assert CountingHandler.connections == 1
+
+
+def test_gather_overlaps_requests(server: MockOandaServer, client: OandaClient):
+    """Independent requests are sent concurrently, not one after the other."""
+    server.state.delay = 0.3
+    start = perf_counter()
+    trades, (times, _) = client.gather(
+        client.get_open_trades, lambda: client.get_candle_arrays("M5", count=10)
+    )
+    assert perf_counter() - start < 0.5
+    assert trades == [] and len(times) == 10
+
+
+def test_gather_raises_once_every_call_finished(
+    server: MockOandaServer, client: OandaClient
+):
+    """A failed call does not cancel the others."""
+    server.state.delay = 0.1
+    done = []
+    with pytest.raises(Exception, match="404"):
+        client.gather(
+            lambda: client.request("unknown", "GET", "/v3/unknown"),
+            lambda: done.append(client.get_open_trades()),
+        )
+    assert done == [[]]
+
+
+def test_retries_sleep_on_the_clock(server: MockOandaServer):
+    """The backoff moves a virtual clock instead of blocking."""
+    clock = VirtualClock(datetime(2024, 1, 1))
+    client = OandaClient(
+        "mock",
+        "mock",
+        "USD_JPY",
+        hostname="127.0.0.1",
+        port=server.port,
+        ssl=False,
+        retry=RetryConfig(max_attempts=3, base_delay=60.0, max_delay=60.0),
+        clock=clock,
+    )
+    server.state.fail_next = 2
+    start = perf_counter()
+    client.get_open_trades()
+    client.close()
+    assert perf_counter() - start < 5
+    assert clock.monotonic() >= 60
+
+
+def test_rejected_order_raises_reason(server: MockOandaServer, client: OandaClient):
+    """A 400 reject is parsed for its reason instead of raised as an HTTP error."""
+    with pytest.raises(Exception, match="^UNITS_INVALID$"):
+        client.place_market_order(OrderTemplate("USD_JPY", 0))
+    assert client.latency.summary()["order"]["count"] == 1
+
+
+def test_close_of_missing_trade_raises_reason(
+    server: MockOandaServer, client: OandaClient
+):
+    """A 404 close reject is parsed for its reason."""
+    with pytest.raises(Exception, match="^TRADE_DOESNT_EXIST$"):
+        client.close_trade(999)
+
+
+def test_open_and_close_are_stamped(server: MockOandaServer, client: OandaClient):
+    """Opening and closing a trade both record their latency stamps."""
+    opened = TradeLatency(candle_close=time_ns(), kernel_done=time_ns())
+    trade_id = client.place_market_order(OrderTemplate("USD_JPY", 1000), opened)
+    closed = TradeLatency(candle_close=time_ns(), kernel_done=time_ns())
+    client.close_trade(trade_id, closed)
+    assert [lat.action for lat in client.trade_latencies] == ["open", "close"]
+    for latency in client.trade_latencies:
+        assert latency.kernel_done <= latency.request_sent <= latency.fill_received
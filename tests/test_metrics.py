@@ -0,0 +1,39 @@
+"""Annualization of the metrics of the kernel pipeline."""
+
+import math
+
+import pytest
+
+from bot.backtest import run_record
+from bot.exchange import periods_per_year
+from bot.synthetic import SyntheticConfig, iter_candles
+from core.kernel import KernelConfig, NodeCache
+from core.store import CANDLE_COLUMNS
+
+
+@pytest.mark.parametrize(
+    "granularity, expected",
+    [("M5", 288 * 260), ("H1", 24 * 260), ("D", 260), ("W", 52)],
+)
+def test_periods_per_year(granularity: str, expected: float):
+    """Every granularity has its own number of candles in a trading year."""
+    assert periods_per_year(granularity) == expected
+
+
+def test_periods_per_year_rejects_unknown_granularity():
+    """An unknown granularity is an error, not the M5 default."""
+    with pytest.raises(ValueError):
+        periods_per_year("M3")
+
+
+def test_ratios_scale_with_granularity():
+    """The Sharpe and Sortino ratios scale with the root of the periods per year."""
+    _, block = next(iter_candles(SyntheticConfig(rows=3000, seed=1)))
+    columns = {name: block[i] for i, name in enumerate(CANDLE_COLUMNS)}
+    config = KernelConfig("ha_bid_low", "ha_ask_high", "ha_close", 20, 0.1, 0.05)
+    cache = NodeCache()
+    m5 = run_record(columns, config, cache, periods_per_year("M5"))
+    h1 = run_record(columns, config, cache, periods_per_year("H1"))
+    assert m5.exit_total == h1.exit_total
+    for ratio in ("sharpe", "sortino"):
+        assert m5.metrics[ratio] == pytest.approx(h1.metrics[ratio] * math.sqrt(12))
@@ -0,0 +1,106 @@
+"""The position cache fed by order responses and the transaction stream."""
+
+from typing import Iterator
+
+import pytest
+
+from bot.exchange import OandaClient, OrderTemplate
+from bot.mock_oanda import MockOandaServer
+from bot.positions import PositionCache, TransactionStream
+
+ORDER = OrderTemplate("USD_JPY", 1000)
+
+
+@pytest.fixture
+def server() -> Iterator[MockOandaServer]:
+    """Serve a fresh mock Oanda API."""
+    server = MockOandaServer().start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def client(server: MockOandaServer) -> Iterator[OandaClient]:
+    """Return a client of the mock server."""
+    client = OandaClient(
+        "mock", "mock", "USD_JPY", hostname="127.0.0.1", port=server.port, ssl=False
+    )
+    yield client
+    client.close()
+
+
+def trade_ids(cache: PositionCache) -> list[int]:
+    """Return the ids of the cached USD_JPY trades."""
+    return [trade.trade_id for trade in cache.open_trades("USD_JPY")]
+
+
+def test_late_opening_fill_does_not_reopen_trade(
+    server: MockOandaServer, client: OandaClient
+):
+    """A streamed opening fill arriving after the close is ignored."""
+    cache = PositionCache(client)
+    trade_id = client.place_market_order(ORDER)
+    opening = server.state.transactions[-1]
+    client.close_trade(trade_id)
+    cache.apply_transaction(opening)
+    assert trade_ids(cache) == []
+
+
+def test_fill_is_applied_once(server: MockOandaServer, client: OandaClient):
+    """A reduce delivered by both sources reduces the trade once."""
+    cache = PositionCache(client)
+    trade_id = client.place_market_order(ORDER)
+    reduce = {
+        "id": "100",
+        "type": "ORDER_FILL",
+        "instrument": "USD_JPY",
+        "tradeReduced": {"tradeID": str(trade_id), "units": "-400"},
+    }
+    cache.apply_fill(reduce)
+    cache.apply_transaction(reduce)
+    assert cache.open_trades("USD_JPY")[0].units == 600
+
+
+def test_reconcile_keeps_newer_fills(
+    server: MockOandaServer, client: OandaClient, monkeypatch: pytest.MonkeyPatch
+):
+    """Fills older than the listing are skipped, newer ones survive a reconcile."""
+    cache = PositionCache(client)
+    first = client.place_market_order(ORDER)
+    opening = server.state.transactions[-1]
+    cache.reconcile()
+    assert trade_ids(cache) == [first]
+
+    # the listing includes the close, a late opening fill is older than it
+    server.state.close(str(first))
+    cache.reconcile()
+    cache.apply_fill(opening)
+    assert trade_ids(cache) == []
+
+    # the trades were listed before the next order filled
+    snapshot = client.open_trades_snapshot()
+    second = client.place_market_order(ORDER)
+    monkeypatch.setattr(client, "open_trades_snapshot", lambda: snapshot)
+    cache.reconcile()
+    assert trade_ids(cache) == [second]
+
+
+def test_stream_catches_up_after_reconnect(
+    server: MockOandaServer, client: OandaClient
+):
+    """Transactions missed while disconnected are requested since the last id."""
+    cache = PositionCache(client)
+    stream = TransactionStream(
+        cache, hostname="127.0.0.1", port=server.port, ssl=False
+    )
+    first = client.place_market_order(ORDER)
+    cache.apply_transaction({"type": "HEARTBEAT", "lastTransactionID": str(first)})
+
+    # missed while the stream was down
+    server.state.close(str(first))
+    fill = server.state.fill({"instrument": "USD_JPY", "units": "500"})
+    second = int(fill["orderFillTransaction"]["id"])
+    assert stream.catch_up() == 2
+    assert trade_ids(cache) == [second]
+    assert cache.last_transaction_id == second
+    assert stream.catch_up() == 0
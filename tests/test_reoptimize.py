@@ -0,0 +1,87 @@
+"""Node cache reuse between the sweeps of the re-optimizer."""
+
+import numpy as np
+import pytest
+
+from bot.backtest import run_record
+from bot.reoptimize import SweepWindow
+from bot.synthetic import SyntheticConfig, iter_candles
+from core.kernel import (
+    EXTENSIONS,
+    HA_FIELDS,
+    KernelConfig,
+    Node,
+    NodeCache,
+    column_node,
+)
+from core.store import CANDLE_COLUMNS, CandleWriter
+
+CONFIGS = [
+    KernelConfig("ha_bid_low", "ha_ask_high", "ha_close", 20, 0.1, 0.05),
+    KernelConfig("ha_ask_low", "ha_bid_high", "ha_open", 35),
+    KernelConfig("bid_low", "ask_high", "ha_ask_close", 50, 0.2),
+]
+
+
+@pytest.fixture(scope="module")
+def candles() -> tuple[np.ndarray, np.ndarray]:
+    """Return the timestamps and (12 x rows) block of 6000 candles."""
+    return next(iter_candles(SyntheticConfig(rows=6000, seed=3, decimals=6)))
+
+
+def columns(block: np.ndarray, start: int, end: int) -> dict[str, np.ndarray]:
+    """Return the candle columns of rows start to end."""
+    return {name: block[i, start:end] for i, name in enumerate(CANDLE_COLUMNS)}
+
+
+def test_extended_cache_matches_fresh_cache(candles):
+    """Extending the cached columns gives the records of a fresh run."""
+    _, block = candles
+    cache = NodeCache()
+    for config in CONFIGS:
+        run_record(columns(block, 0, 4000), config, cache, 74880.0)
+
+    cache.extend(columns(block, 0, 6000))
+    assert len(cache.signals) == 0
+    assert all(node.op in EXTENSIONS for node in cache.entries)
+    ha = Node("heikin_ashi", tuple(column_node(f) for f in HA_FIELDS))
+    assert all(len(values) == 6000 for values in cache.entries[ha])
+
+    fresh = NodeCache()
+    for config in CONFIGS:
+        extended = run_record(columns(block, 0, 6000), config, cache, 74880.0)
+        expected = run_record(columns(block, 0, 6000), config, fresh, 74880.0)
+        assert extended == expected
+    # the Heikin Ashi and WMA columns were extended, not recomputed
+    for node in cache.entries:
+        if node.op in EXTENSIONS:
+            np.testing.assert_equal(cache.entries[node], fresh.entries[node])
+
+
+def test_sweep_window_extends_then_starts_over(tmp_path, candles):
+    """The window grows by the appended candles until it is slack too long."""
+    times, block = candles
+    path = str(tmp_path / "store")
+    writer = CandleWriter(path, capacity=len(times))
+    writer.append(times[:3000], block[:, :3000])
+    writer.flush()
+
+    window = SweepWindow(path, candle_count=2000, slack=500)
+    assert len(window.columns()["open"]) == 2000
+    for config in CONFIGS:
+        run_record(window.columns(), config, window.cache, 74880.0)
+    shared = [node for node in window.cache.entries if node.op in EXTENSIONS]
+
+    writer.append(times[3000:3400], block[:, 3000:3400])
+    writer.flush()
+    extended = window.columns()
+    assert (window.start, len(extended["open"])) == (1000, 2400)
+    assert list(window.cache.entries) == shared
+    wma = [node for node in shared if node.op == "wma"]
+    assert all(len(window.cache.entries[node]) == 2400 for node in wma)
+
+    writer.append(times[3400:3600], block[:, 3400:3600])
+    writer.flush()
+    restarted = window.columns()
+    assert (window.start, len(restarted["open"])) == (1600, 2000)
+    assert len(window.cache.entries) == 0
@@ -0,0 +1,68 @@
+"""Replays of the bot loop against the simulated exchange and recordings."""
+
+import pytest
+
+from bot.backtest import ChartConfig, SignalConfig
+from bot.bot import TradeConfig
+from bot.clock import WALL_CLOCK
+from bot.mock_oanda import MockOandaState
+from bot.replay import ReplayConfig, _LocalAdapter, replay
+
+SIGNAL = SignalConfig("ha_close", "ha_bid_low", "ha_ask_high", 0.0, 0.0)
+TRADE = TradeConfig(amount=1000)
+
+
+def chart(granularity: str) -> ChartConfig:
+    """Return a chart config of the granularity."""
+    return ChartConfig("USD_JPY", granularity, wma_period=20, candle_count=300)
+
+
+def test_local_adapter_is_abstract():
+    """An adapter has to say how it answers requests."""
+    with pytest.raises(TypeError):
+        _LocalAdapter(WALL_CLOCK)
+
+
+def test_mock_serves_its_granularity_only():
+    """Candles of another granularity are rejected, not served as M5."""
+    state = MockOandaState(granularity="H1")
+    status, body = state.respond(
+        "GET", "/v3/instruments/USD_JPY/candles?granularity=H1&count=3"
+    )
+    assert status == 200
+    assert [c["time"][11:16] for c in body["candles"]] == ["00:00", "01:00", "02:00"]
+    status, _ = state.respond(
+        "GET", "/v3/instruments/USD_JPY/candles?granularity=M5&count=3"
+    )
+    assert status == 400
+
+
+def test_replay_runs_one_cycle_per_candle():
+    """The simulated exchange advances by the granularity of the chart."""
+    result = replay(chart("H1"), SIGNAL, TRADE, ReplayConfig(days=5))
+    assert result.cycles == 5 * 24
+    assert result.virtual_days == pytest.approx(5, abs=0.01)
+
+
+def test_recording_replays_without_mismatches(tmp_path):
+    """A recorded run replays to the same orders."""
+    path = str(tmp_path / "replay.jsonl")
+    recorded = replay(
+        chart("M15"), SIGNAL, TRADE, ReplayConfig(days=2, record_path=path)
+    )
+    replayed = replay(chart("M15"), SIGNAL, TRADE, ReplayConfig(replay_path=path))
+    assert len(recorded.orders) > 0
+    assert replayed.mismatches == []
+    assert replayed.orders == recorded.orders
+
+
+def test_concurrent_requests_replay_in_either_order(tmp_path):
+    """Requests a cycle sent concurrently match in the order they were recorded."""
+    path = tmp_path / "replay.jsonl"
+    replay(chart("M15"), SIGNAL, TRADE, ReplayConfig(days=1, record_path=str(path)))
+    lines = path.read_bytes().splitlines(keepends=True)
+    # the first cycle reconciled the open trades, then fetched the candles
+    assert b"openTrades" in lines[0] and b"candles" in lines[1]
+    path.write_bytes(b"".join([lines[1], lines[0]] + lines[2:]))
+    replayed = replay(chart("M15"), SIGNAL, TRADE, ReplayConfig(replay_path=str(path)))
+    assert replayed.mismatches == []
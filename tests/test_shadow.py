@@ -0,0 +1,65 @@
+"""Paper trading of the sweep configurations next to the live bot."""
+
+from dataclasses import asdict
+
+import numpy as np
+import yaml
+
+from bot.backtest import ChartConfig, SignalConfig
+from bot.shadow import PaperTrades, ShadowConfig, ShadowTrader
+from bot.synthetic import SyntheticConfig, iter_candles
+from core.frame import CandleFrame
+
+SIGNAL = SignalConfig("ha_close", "ha_bid_low", "ha_ask_high", 0.0, 0.0)
+
+
+def trader(sweep_path: str) -> ShadowTrader:
+    """Return a shadow trader of the sweep file."""
+    chart_conf = ChartConfig("USD_JPY", "M5", 20, 300, sweep_path=sweep_path)
+    return ShadowTrader(ShadowConfig(), chart_conf)
+
+
+def test_missing_sweep_is_loaded_once_written(tmp_path):
+    """Until the sweep file exists nothing is paper traded."""
+    path = str(tmp_path / "sweep.yaml")
+    shadow = trader(path)
+    times, block = next(iter_candles(SyntheticConfig(rows=300, seed=4)))
+    frame = CandleFrame.from_block(times, block)
+    shadow.run(frame.head(-1))
+    assert shadow.paper == []
+
+    with open(path, "w") as f:
+        yaml.safe_dump({"results": [{"signal_config": asdict(SIGNAL)}]}, f)
+    shadow.run(frame)
+    assert shadow.signal_confs == [SIGNAL]
+    assert len(shadow.paper) == 1
+
+
+class Triggers:
+    """A pipeline giving one configuration the next of the listed triggers."""
+
+    def __init__(self, triggers: list[int]):
+        """Initialize a Triggers object."""
+        self.triggers = iter(triggers)
+
+    def run(self, columns: dict[str, np.ndarray]) -> dict[str, dict[str, np.ndarray]]:
+        """Return the next trigger as the last one of the configuration."""
+        return {"0": {"trigger": np.array([next(self.triggers)])}}
+
+
+def test_break_even_close_is_not_a_loss(tmp_path):
+    """A paper trade closed at its entry price counts as neither win nor loss."""
+    shadow = trader(str(tmp_path / "missing.yaml"))
+    shadow.signal_confs = [SIGNAL]
+    shadow.paper = [PaperTrades()]
+    shadow.pipeline = Triggers([1, -1])
+    price = np.full(3, 150.0)
+    for rows in (2, 3):
+        shadow.run(
+            CandleFrame(
+                np.arange(rows, dtype=np.int64),
+                {"ask_close": price[:rows], "bid_close": price[:rows]},
+            )
+        )
+    paper = shadow.paper[0]
+    assert (paper.trades, paper.wins, paper.losses) == (1, 0, 0)
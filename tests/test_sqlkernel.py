@@ -0,0 +1,52 @@
+"""The kernel functions registered on SQLite against the Python pipeline."""
+
+import sqlite3
+
+import pytest
+
+from bot.backtest import run_record
+from bot.synthetic import SyntheticConfig, iter_candles
+from core.kernel import KernelConfig, NodeCache
+from core.sqlkernel import (
+    _Running,
+    exit_total_query,
+    insert_history,
+    kernel_metrics,
+    register,
+)
+from core.store import CANDLE_COLUMNS
+
+CONFIG = KernelConfig("ha_bid_low", "ha_ask_high", "ha_close", 20, 0.1, -0.05)
+
+
+@pytest.fixture(scope="module")
+def history():
+    """Return a connection holding 3000 candles and their columns."""
+    times, block = next(iter_candles(SyntheticConfig(rows=3000, seed=2)))
+    conn = register(sqlite3.connect(":memory:"))
+    insert_history(conn, "USD", "JPY", times, block)
+    yield conn, {name: block[i] for i, name in enumerate(CANDLE_COLUMNS)}
+    conn.close()
+
+
+def test_running_value_is_abstract():
+    """A running window function has to return its current value."""
+    with pytest.raises(TypeError):
+        _Running()
+
+
+def test_aggregate_matches_pipeline(history):
+    """kernel_metrics gives the metrics of the Python pipeline."""
+    conn, columns = history
+    expected = run_record(columns, CONFIG, NodeCache(), 74880.0)
+    metrics = kernel_metrics(conn, "USD", "JPY", CONFIG, 74880.0)
+    assert metrics["exit_total"] == expected.exit_total
+    assert metrics["sharpe"] == expected.metrics["sharpe"]
+
+
+def test_window_functions_match_pipeline(history):
+    """The staged window functions end exactly on the exit total of the pipeline."""
+    conn, columns = history
+    expected = run_record(columns, CONFIG, NodeCache(), 74880.0)
+    rows = conn.execute(exit_total_query(CONFIG), ("USD", "JPY")).fetchall()
+    assert rows[-1][1] == expected.exit_total
@@ -0,0 +1,59 @@
+"""Round trips through the memory-mapped candle store."""
+
+import numpy as np
+import pytest
+
+from bot.synthetic import SyntheticConfig, iter_candles
+from core.store import CANDLE_COLUMNS, CandleReader, CandleWriter
+
+
+@pytest.fixture
+def store(tmp_path) -> tuple[str, np.ndarray, np.ndarray]:
+    """Return the path of a store of 100 candles, with room for 1000, and 110 candles."""
+    times, block = next(iter_candles(SyntheticConfig(rows=110, seed=5)))
+    path = str(tmp_path / "candles")
+    writer = CandleWriter(path, capacity=1000)
+    writer.append(times[:100], block[:, :100])
+    writer.flush()
+    return path, times, block
+
+
+def test_reader_returns_written_rows(store):
+    """Every accessor reads back the published rows only."""
+    path, times, block = store
+    times, block = times[:100], block[:, :100]
+    reader = CandleReader(path)
+    assert len(reader) == 100
+    np.testing.assert_array_equal(reader.timestamps(), times)
+    np.testing.assert_array_equal(reader.block(), block)
+    np.testing.assert_array_equal(
+        reader.column("bid_low"), block[CANDLE_COLUMNS.index("bid_low")]
+    )
+    frame = reader.to_frame()
+    np.testing.assert_array_equal(frame["timestamp"], times)
+    for i, name in enumerate(CANDLE_COLUMNS):
+        np.testing.assert_array_equal(reader.columns()[name], block[i])
+        np.testing.assert_array_equal(frame[name], block[i])
+
+
+@pytest.mark.parametrize("start, expected", [(-5, 95), (-100, 0), (-1000, 0), (40, 40)])
+def test_reader_counts_negative_start_from_last_row(store, start: int, expected: int):
+    """A negative start counts back from the last row, not from the capacity."""
+    path, times, block = store
+    times, block = times[:100], block[:, :100]
+    reader = CandleReader(path)
+    np.testing.assert_array_equal(reader.timestamps(start), times[expected:])
+    np.testing.assert_array_equal(reader.block(start), block[:, expected:])
+    np.testing.assert_array_equal(reader.column("open", start), block[0, expected:])
+    np.testing.assert_array_equal(reader.columns(start)["close"], block[3, expected:])
+    np.testing.assert_array_equal(reader.to_frame(start)["timestamp"], times[expected:])
+
+
+def test_reader_sees_appended_rows(store):
+    """Rows appended after the reader opened the store are read from the end."""
+    path, times, block = store
+    reader = CandleReader(path)
+    CandleWriter(path).append_new(times, block)
+    assert len(reader) == 110
+    np.testing.assert_array_equal(reader.timestamps(-10), times[100:])
+    np.testing.assert_array_equal(reader.block(-10), block[:, 100:])
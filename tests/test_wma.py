@@ -0,0 +1,150 @@
+"""Accuracy of the weighted moving averages against talib.WMA."""
+
+from dataclasses import asdict
+
+import numpy as np
+import pandas as pd
+import pytest
+import talib
+
+from bot.backtest import Record, get_record, run_record
+from bot.constants import WMA_PERIODS
+from core.calc import (
+    extend_weighted_moving_average,
+    weighted_moving_average,
+    wma_matrix,
+    wma_numpy,
+)
+from core.chunked import kernel_chunked
+from core.kernel import (
+    KernelConfig,
+    Node,
+    NodeCache,
+    Pipeline,
+    cache_wma_matrix,
+    candle_columns,
+    column_node,
+    kernel,
+)
+from bot.synthetic import SyntheticConfig, oanda_frame
+
+ROWS = 1_000_000
+
+
+@pytest.fixture(scope="module")
+def prices() -> np.ndarray:
+    """Return a random walk around 150 of ROWS prices."""
+    rng = np.random.default_rng(0)
+    return 150 + np.cumsum(rng.normal(0, 0.05, ROWS))
+
+
+@pytest.mark.parametrize("period", [2, 20, 200])
+def test_wma_numpy_stays_close_to_talib(prices: np.ndarray, period: int):
+    """The error of the resumable recurrence does not grow with the length."""
+    expected = talib.WMA(prices, period)
+    actual = wma_numpy(prices, period, np.zeros(4), np.zeros(period))
+    error = np.abs(actual - expected)
+    assert np.isnan(actual[: period - 1]).all()
+    assert np.nanmax(error) < 1e-10
+    # the last rows are no worse than the first ones
+    assert np.nanmax(error[-1000:]) < 1e-10
+
+
+@pytest.mark.parametrize("period", [2, 20])
+def test_wma_numpy_does_not_depend_on_chunks(prices: np.ndarray, period: int):
+    """Resuming from the state of the previous chunk gives the same output."""
+    whole = wma_numpy(prices, period, np.zeros(4), np.zeros(period))
+    state, window = np.zeros(4), np.zeros(period)
+    chunked = np.concatenate(
+        [wma_numpy(chunk, period, state, window) for chunk in np.array_split(prices, 13)]
+    )
+    np.testing.assert_array_equal(whole, chunked)
+
+
+@pytest.mark.parametrize("period", [1, 2, 20, 200])
+def test_extended_wma_matches_whole_series(prices: np.ndarray, period: int):
+    """Extending the WMA of the first rows gives the bits of a run over all rows."""
+    whole = weighted_moving_average(prices[:10_000], period)
+    for rows in (period - 1, period, 3 * period + 1, 9_999):
+        previous = weighted_moving_average(prices[:rows], period)
+        extended = extend_weighted_moving_average(previous, prices[:10_000], period)
+        np.testing.assert_array_equal(extended, whole)
+
+
+def test_wma_matrix_matches_talib(prices: np.ndarray):
+    """Every row of the matrix is the WMA of its period, close to talib.WMA."""
+    source = prices[:100_000]
+    matrix = wma_matrix(source, WMA_PERIODS)
+    assert matrix.shape == (len(WMA_PERIODS), len(source))
+    for row, period in zip(matrix, WMA_PERIODS):
+        assert np.isnan(row[: period - 1]).all()
+        assert np.nanmax(np.abs(row - talib.WMA(source, period))) < 1e-10
+        np.testing.assert_array_equal(row, weighted_moving_average(source, period))
+
+
+@pytest.fixture(scope="module")
+def synthetic() -> pd.DataFrame:
+    """Return 20000 synthetic candles."""
+    return oanda_frame(SyntheticConfig(rows=20_000, seed=1))
+
+
+@pytest.mark.parametrize(
+    "config",
+    [
+        KernelConfig("ha_bid_low", "ha_ask_high", "ha_close", 20, 0.1, -0.05),
+        KernelConfig("bid_low", "ask_high", "ha_open", 35, 0.2, 0.1),
+    ],
+)
+# chunk boundaries inside the first WMA window, on it and far past it
+@pytest.mark.parametrize("chunk_size", [7, 19, 20, 1000, 3000])
+def test_chunked_kernel_matches_kernel(
+    synthetic: pd.DataFrame, config: KernelConfig, chunk_size: int
+):
+    """The chunked kernel gives exactly the Record of an in-memory run."""
+    expected = get_record(kernel(synthetic, include_incomplete=False, config=config))
+    columns = candle_columns(synthetic, include_incomplete=True)
+    block = np.stack([columns[name] for name in columns])
+    chunks = [
+        block[:, start : start + chunk_size]
+        for start in range(0, block.shape[1], chunk_size)
+    ]
+    summary = kernel_chunked(chunks, include_incomplete=False, config=config).summary()
+    assert Record(**summary) == expected
+
+
+def test_cached_wma_matrix_feeds_pipeline(synthetic: pd.DataFrame):
+    """The sweep finds the rows of the matrix as its wma nodes."""
+    columns = candle_columns(synthetic, include_incomplete=False)
+    cache = NodeCache()
+    cache_wma_matrix(cache, columns, "ha_close", WMA_PERIODS)
+    rows = {
+        period: cache.entries[Node("wma", (column_node("ha_close"),), (period,))]
+        for period in WMA_PERIODS
+    }
+    for period in WMA_PERIODS[::7]:
+        config = KernelConfig("ha_bid_low", "ha_ask_high", "ha_close", period, 0.1)
+        expected = run_record(columns, config, NodeCache(), 74880.0)
+        actual = run_record(columns, config, cache, 74880.0)
+        # the metrics hold NaN when there is no win or loss
+        np.testing.assert_equal(asdict(actual), asdict(expected))
+    # the wma nodes were read from the cache, not recomputed
+    for period, row in rows.items():
+        node = Node("wma", (column_node("ha_close"),), (period,))
+        assert cache.entries[node] is row
+
+
+def test_signal_counts_ignore_exit_rules(synthetic: pd.DataFrame):
+    """Only the wma comparison signals are counted, not the take profit and stop loss."""
+    columns = candle_columns(synthetic, include_incomplete=False)
+    cache = NodeCache()
+    configs = {
+        f"{period} {take_profit} {stop_loss}": KernelConfig(
+            "ha_bid_low", "ha_ask_high", "ha_close", period, take_profit, stop_loss
+        )
+        for period in (20, 35)
+        for take_profit in (0, 0.1, 0.2)
+        for stop_loss in (0, -0.05)
+    }
+    Pipeline.from_configs(configs).run(columns, cache)
+    assert cache.signal_counts() == (2, 2)
+    assert len(cache.aliases) > 2